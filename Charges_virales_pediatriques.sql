@@ -1,7 +1,7 @@
 use caris_db;
 
 SELECT 
-    b.*, a.*
+    b.departement, b.commune, b.section, a.*
 FROM
     (SELECT 
         IF(lh.id IS NOT NULL, CONCAT(lh.city_code, '/', lh.hospital_code), CONCAT(pt.city_code, '/', pt.hospital_code)) AS site,
@@ -307,6 +307,11 @@ FROM
     LEFT JOIN lookup_commune lc ON lc.id = lh.commune
     LEFT JOIN lookup_departement ld ON ld.id = lc.departement
     LEFT JOIN lookup_network ln ON ln.id = lh.network) b ON a.site = b.site
-    HAVING NOT (departement IN ('Nippes' , 'Sud', 'Sud-Est', 'Grand-Anse')
-        OR office IN ('JER' , 'CAY', 'FDN', 'MIR'))
+    WHERE NOT (b.departement IN ('Nippes' , 'Sud', 'Sud-Est', 'Grand-Anse')
+        OR a.office IN ('JER' , 'CAY', 'FDN', 'MIR'))
+        AND (a.office IS NULL OR a.office NOT IN :excluded_offices)
+        AND (a.network IS NULL OR a.network NOT IN :excluded_networks)
+        AND (a.site IS NULL OR a.site NOT IN :excluded_sites)
+        AND (:min_age IS NULL OR a.age >= :min_age)
+        AND (:max_age IS NULL OR a.age <= :max_age)
 
@@ -32,6 +32,7 @@ import os
 from dotenv import load_dotenv
 import openpyxl
 from openpyxl.utils import get_column_letter
+from excel_io import read_exports_parallel, WorkbookBuilder
 
 # Define datetime range
 start_date = pd.to_datetime('2025-08-25')
@@ -114,98 +115,39 @@ def process_grouped(df, date_col, value_col, group_col):
 
     return df_pivot
 
-def export_multiple_pivot_tables_to_excel(pivot_tables, file_name, sheet_names, titles, title_font_size=14, title_alignment='center', delete_row=None):
-    # Création du fichier Excel avec ordre spécifique pour "Tableau des Appels et Visites"
-    with pd.ExcelWriter(file_name, engine='openpyxl') as writer:
-        # Traiter les feuilles dans l'ordre spécifié pour garantir que "Tableau des Appels et Visites" soit en premier
-        for i, (pivot_table, sheet_name, title) in enumerate(zip(pivot_tables, sheet_names, titles)):
-            pivot_table.to_excel(writer, sheet_name=sheet_name, startrow=2)
-            workbook = writer.book
-            worksheet = writer.sheets[sheet_name]
-
-            # Ajouter un titre
-            cell = worksheet.cell(row=1, column=1)
-            cell.value = title
-            worksheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=10)
-            cell.font = Font(bold=True, size=title_font_size)
-            cell.alignment = Alignment(horizontal=title_alignment)
-
-            # Ajuster la largeur des colonnes
-            for col in worksheet.columns:
-                max_length = 0
-                column = col[0].column  # Get the column index
-                for cell in col:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = (max_length + 2)
-
-            # Supprimer une ligne spécifique si nécessaire
-            if delete_row:
-                worksheet.delete_rows(delete_row)
-        
-        # S'assurer que "Tableau des Appels et Visites" est en première position
-        # et que "Listes des Appels et Visites" est après
-        if "Tableau des Appels et Visites" in sheet_names:
-            workbook = writer.book
-            all_sheets = list(workbook.sheetnames)
-            
-            # Placer "Tableau des Appels et Visites" en première position
-            if "Tableau des Appels et Visites" in all_sheets and all_sheets[0] != "Tableau des Appels et Visites":
-                target_sheet = workbook["Tableau des Appels et Visites"]
-                workbook.move_sheet(target_sheet, offset=-len(all_sheets))
-                print(f"[OK] Feuille 'Tableau des Appels et Visites' placée en première position dans le fichier Excel.")
-            
-            # S'assurer que "Listes des Appels et Visites" est après "Tableau des Appels et Visites"
-            updated_sheets = list(workbook.sheetnames)
-            if "Listes des Appels et Visites" in updated_sheets:
-                tableau_index = updated_sheets.index("Tableau des Appels et Visites") if "Tableau des Appels et Visites" in updated_sheets else -1
-                liste_index = updated_sheets.index("Listes des Appels et Visites")
-                
-                if tableau_index >= 0 and liste_index < tableau_index:
-                    # Déplacer "Listes des Appels et Visites" juste après "Tableau des Appels et Visites"
-                    liste_sheet = workbook["Listes des Appels et Visites"]
-                    workbook.move_sheet(liste_sheet, offset=(tableau_index - liste_index))
-                    print(f"[OK] Feuille 'Listes des Appels et Visites' placée après 'Tableau des Appels et Visites'.")
-                elif tableau_index >= 0 and liste_index > tableau_index:
-                    print(f"[OK] L'ordre correct est déjà respecté: 'Tableau des Appels et Visites' avant 'Listes des Appels et Visites'.")
+def add_pivot_tables_to_workbook(builder, pivot_tables, sheet_names, titles, title_font_size=14, title_alignment='center', delete_row=None):
+    # Une feuille par tableau : titre fusionné (A1:J1) puis tableau à partir de la ligne 3
+    for pivot_table, sheet_name, title in zip(pivot_tables, sheet_names, titles):
+        builder.add_title(sheet_name, 0, title, last_col=9, font_size=title_font_size, alignment=title_alignment)
+        builder.add_frame(sheet_name, pivot_table, startrow=2)
+        # Supprimer une ligne spécifique si nécessaire
+        if delete_row:
+            builder.delete_row(sheet_name, delete_row)
+    return builder
 
+def export_multiple_pivot_tables_to_excel(pivot_tables, file_name, sheet_names, titles, title_font_size=14, title_alignment='center', delete_row=None):
+    # "Tableau des Appels et Visites" en première position, "Listes des Appels et Visites" juste après
+    order = sorted(range(len(sheet_names)), key=lambda i: {"Tableau des Appels et Visites": 0, "Listes des Appels et Visites": 1}.get(sheet_names[i], 2))
+    builder = add_pivot_tables_to_workbook(WorkbookBuilder(), [pivot_tables[i] for i in order], [sheet_names[i] for i in order],
+                                           [titles[i] for i in order], title_font_size, title_alignment, delete_row)
+    builder.save(file_name)
     print(f"Les tableaux croisés dynamiques ont été exportés vers '{file_name}'.")
 
 def export_pivot_table_to_excel(pivot_table, file_name, sheet_name, title, title_font_size=14, title_alignment='center', delete_row=None):
-    # Création du fichier Excel
-    with pd.ExcelWriter(file_name, engine='openpyxl') as writer:
-        pivot_table.to_excel(writer, sheet_name=sheet_name, startrow=2)
-        workbook = writer.book
-        worksheet = writer.sheets[sheet_name]
-
-        # Ajouter un titre
-        cell = worksheet.cell(row=1, column=1)
-        cell.value = title
-        worksheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=10)
-        cell.font = Font(bold=True, size=title_font_size)
-        cell.alignment = Alignment(horizontal=title_alignment)
-
-        # Ajuster la largeur des colonnes
-        for col in worksheet.columns:
-            max_length = 0
-            column = col[0].column  # Get the column index
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-
-        # Supprimer une ligne spécifique si nécessaire
-        if delete_row:
-            worksheet.delete_rows(delete_row)
-
+    add_pivot_tables_to_workbook(WorkbookBuilder(), [pivot_table], [sheet_name], [title], title_font_size, title_alignment, delete_row).save(file_name)
     print(f"Le tableau croisé dynamique a été exporté vers '{file_name}'.")
 
+def add_summary_sheet(builder, pivot_tables, sheet_name="Tableau des Appels et Visites"):
+    # Les cinq tableaux sur une seule feuille, chacun sous un titre fusionné (A:L), tous les 6 lignes
+    section_titles = ["Table des Appels et Visites", "Table des visites OEV", "Table des appels OEV",
+                      "Table des visites PTME", "Table des appels PTME"]
+    for pivot_table, table_text, text_row in zip(pivot_tables, section_titles, [1, 7, 13, 19, 25]):
+        builder.add_title(sheet_name, text_row - 1, table_text, last_col=11)
+        builder.add_frame(sheet_name, pivot_table, startrow=text_row, index=True)
+    # Largeur de la première colonne (adaptez si besoin)
+    builder.set_column_width(sheet_name, 0, 20)
+    return builder
+
 # Function to assign commune names using regex
 def assign_commune(name):
     if re.match(r'^1', name):
@@ -265,31 +207,6 @@ def add_found_percentage(data_pivotable):
     # Retourner le DataFrame mis à jour
     return data_pivotable
 
-def add_dataframe_to_workbook(file_path, sheet_name, dataframe):
-    """
-    Adds a DataFrame to an existing Excel workbook in the specified sheet.
-
-    Args:
-        file_path (str): Path to the Excel file.
-        sheet_name (str): Name of the sheet where the DataFrame will be written.
-        dataframe (pd.DataFrame): The DataFrame to write to the sheet.
-    """
-    from openpyxl import load_workbook
-    
-    # Load the existing workbook
-    workbook = load_workbook(file_path)
-
-    # Check if the sheet already exists, and create it if not
-    if sheet_name not in workbook.sheetnames:
-        workbook.create_sheet(title=sheet_name)
-        workbook.save(file_path)
-
-    # Write the DataFrame to the specified sheet
-    with pd.ExcelWriter(file_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-        dataframe.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    print(f"The DataFrame has been written to the sheet '{sheet_name}' in '{file_path}'.")
-
 def generate_excel_from_dataframe(df, file_name):
     from openpyxl.styles import PatternFill, Border, Side
     
@@ -445,17 +362,32 @@ def main():
     end_date = pd.to_datetime('2025-08-31')
     today_date = datetime.today().date().strftime('%Y-%m-%d')
     
-    # Import dial dataset
-    print("Reading dial datasets...")
-    Apel_ptme = pd.read_excel(f"C:/Users/Moise/Downloads/caris-meal-app/data/Caris Health Agent - Femme PMTE  - APPELS PTME (created 2025-02-13) {today_date}.xlsx", parse_dates=True)
-    Apel_oev = pd.read_excel(f"C:/Users/Moise/Downloads/caris-meal-app/data/Caris Health Agent - Enfant - APPELS OEV (created 2025-01-08) {today_date}.xlsx", parse_dates=True)
-
-    # Import visit dataset
-    print("Reading visit datasets...")
-    Visite_ptme = pd.read_excel(f"C:/Users/Moise/Downloads/caris-meal-app/data/Caris Health Agent - Femme PMTE  - Visite PTME (created 2025-02-13) {today_date}.xlsx", parse_dates=True)
-    Ration_ptme = pd.read_excel(f"C:/Users/Moise/Downloads/caris-meal-app/data/Caris Health Agent - Femme PMTE  - Ration & Autres Visites (created 2025-02-18) {today_date}.xlsx", parse_dates=True)
-    Ration_oev = pd.read_excel(f"C:/Users/Moise/Downloads/caris-meal-app/data/Caris Health Agent - Enfant - Ration et autres visites (created 2022-08-29) {today_date}.xlsx", parse_dates=True)
-    oev_visite = pd.read_excel(f"C:/Users/Moise/Downloads/caris-meal-app/data/Caris Health Agent - Enfant - Visite Enfant (created 2025-07-30) {today_date}.xlsx", parse_dates=True)
+    # column to use in the script
+    apel_oev_column = ['formid','form.appels_oev.patient_code','form.appels_oev.date_appel','form.appels_oev.parenttuteur_trouve','username','Programme','Type']
+    visite_ptme_column = ['formid','form.visite_ptme.health_id','form.visite_ptme.date_of_visit','form.visite_ptme.is_present','username','Programme','Type']
+    visite_ration_ptme_column = ['formid','form.visit_ratio_and_others.patient_code','form.visit_ratio_and_others.date_of_visit','form.visit_ratio_and_others.is_benficiary_present','username','Programme','Type']
+    visite_ration_oev_column = ['formid','form.visit_ratio_and_others.patient_code','form.visit_ratio_and_others.date_of_visit','form.visit_ratio_and_others.is_benficiary_present','username','Programme','Type']
+    oev_visite_column = ['formid','form.visite_enfant.patient_code','form.visite_enfant.date_of_visit','form.visite_enfant.is_available_at_time_visit','username','Programme','Type']
+    apel_ptme_column = ['formid','form.APPELS_PTME.patient_code','form.APPELS_PTME.date_appel','form.APPELS_PTME.is_ptme_available','username','Programme','Type']
+
+    def export_columns(columns):
+        # 'Programme' et 'Type' sont ajoutées après lecture
+        return [col for col in columns if col not in ('Programme', 'Type')]
+
+    # Import dial and visit datasets (seules les colonnes utilisées sont chargées,
+    # les six exports en parallèle dans un pool de processus)
+    print("Reading dial and visit datasets...")
+    exports = read_exports_parallel({
+        'Apel_ptme': dict(base="Caris Health Agent - Femme PMTE  - APPELS PTME (created 2025-02-13)", columns=export_columns(apel_ptme_column), date=today_date),
+        'Apel_oev': dict(base="Caris Health Agent - Enfant - APPELS OEV (created 2025-01-08)", columns=export_columns(apel_oev_column), date=today_date),
+        'Visite_ptme': dict(base="Caris Health Agent - Femme PMTE  - Visite PTME (created 2025-02-13)", columns=export_columns(visite_ptme_column), date=today_date),
+        'Ration_ptme': dict(base="Caris Health Agent - Femme PMTE  - Ration & Autres Visites (created 2025-02-18)", columns=export_columns(visite_ration_ptme_column), date=today_date),
+        'Ration_oev': dict(base="Caris Health Agent - Enfant - Ration et autres visites (created 2022-08-29)", columns=export_columns(visite_ration_oev_column), date=today_date),
+        'oev_visite': dict(base="Caris Health Agent - Enfant - Visite Enfant (created 2025-07-30)", columns=export_columns(oev_visite_column), date=today_date),
+    })
+    Apel_ptme, Apel_oev = exports['Apel_ptme'], exports['Apel_oev']
+    Visite_ptme, Ration_ptme = exports['Visite_ptme'], exports['Ration_ptme']
+    Ration_oev, oev_visite = exports['Ration_oev'], exports['oev_visite']
 
     # We copy ration oev file to have info on oev visit
     Visite_oev = Ration_oev.copy(deep=True)
@@ -477,14 +409,6 @@ def main():
     oev_visite["Type"] = "Visite"
     oev_visite["Programme"] = "OEV"
 
-    # column to use in the script
-    apel_oev_column = ['formid','form.appels_oev.patient_code','form.appels_oev.date_appel','form.appels_oev.parenttuteur_trouve','username','Programme','Type']
-    visite_ptme_column = ['formid','form.visite_ptme.health_id','form.visite_ptme.date_of_visit','form.visite_ptme.is_present','username','Programme','Type']
-    visite_ration_ptme_column = ['formid','form.visit_ratio_and_others.patient_code','form.visit_ratio_and_others.date_of_visit','form.visit_ratio_and_others.is_benficiary_present','username','Programme','Type']
-    visite_ration_oev_column = ['formid','form.visit_ratio_and_others.patient_code','form.visit_ratio_and_others.date_of_visit','form.visit_ratio_and_others.is_benficiary_present','username','Programme','Type']
-    oev_visite_column = ['formid','form.visite_enfant.patient_code','form.visite_enfant.date_of_visit','form.visite_enfant.is_available_at_time_visit','username','Programme','Type']
-    apel_ptme_column = ['formid','form.APPELS_PTME.patient_code','form.APPELS_PTME.date_appel','form.APPELS_PTME.is_ptme_available','username','Programme','Type']
-
     Apel_oev = Apel_oev[apel_oev_column]
     print(f"Apel_oev shape: {Apel_oev.shape}")
     Apel_ptme = Apel_ptme[apel_ptme_column]
@@ -695,51 +619,13 @@ def main():
     today_str = datetime.now().strftime("%Y-%m-%d")
     output_file = os.path.join(output_folder, f"Table_des_Performances_{today_str}.xlsx")
 
-    # Combine all pivot tables into one Excel sheet
-    with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-        sheet_name = "Tableau des Appels et Visites"  # Single sheet name
-
-        for pivot_table, table_text, text_row in zip(
-            [total_last, visite_oev_last, appel_oev_last, visite_ptme_last, appel_ptme_last],
-            ["Table des Appels et Visites", "Table des visites OEV", "Table des appels OEV",
-            "Table des visites PTME", "Table des appels PTME"],
-            [1, 7, 13, 19, 25]
-        ):
-            # Texte de section
-            pd.DataFrame([table_text]).to_excel(
-                writer, sheet_name=sheet_name, startrow=text_row - 1, index=False, header=False
-            )
-            # Tableau
-            pivot_table.to_excel(writer, sheet_name=sheet_name, startrow=text_row, index=True)
-
-        # Mise en forme
-        workbook = writer.book
-        worksheet = writer.sheets[sheet_name]
-
-        for row, text in zip(
-            [1, 7, 13, 19, 25],
-            ["Table des Appels et Visites","Table des visites OEV","Table des appels OEV",
-            "Table des visites PTME","Table des appels PTME"]
-        ):
-            worksheet.merge_cells(f"A{row}:L{row}")
-            cell = worksheet[f"A{row}"]
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-        # Largeur de la première colonne (adaptez si besoin)
-        worksheet.column_dimensions[get_column_letter(1)].width = 20
-
+    # Tableaux de synthèse et feuille "Agents", écrits en une seule fois
+    summary_tables = [total_last, visite_oev_last, appel_oev_last, visite_ptme_last, appel_ptme_last]
+    performance_workbook = add_summary_sheet(WorkbookBuilder(), summary_tables)
+    performance_workbook.add_frame("Agents", agent_data, index=False)
+    performance_workbook.save(output_file)
     print(f"All pivot tables have been saved in the '{output_file}' file.")
 
-    # ---------- Ajout d'une feuille "Agents" dans le même fichier ----------
-    def add_dataframe_to_workbook(file_path: str, sheet_name: str, df: pd.DataFrame):
-        # Remplace la feuille si elle existe déjà; sinon la crée
-        with pd.ExcelWriter(file_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    # Écrit 'agent_data' dans le même classeur daté
-    add_dataframe_to_workbook(output_file, "Agents", agent_data)
-
     # Personne trouvée par mois
     mois_order = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
     # Convert the 'mois' column to a categorical type with the defined order
@@ -758,217 +644,14 @@ def main():
     # Export individual pivot table
     export_pivot_table_to_excel(data_pivotable, 'data_pivotable.xlsx', 'Pivot Table', 'Tableau Croisé Dynamique des performances', delete_row=5)
 
-    # Export multiple pivot tables - ORDRE SPÉCIFIQUE: "Tableau des Appels et Visites" AVANT "Listes des Appels et Visites"
-    pivot_tables = [total_last, data_cleaned, groupeby_data, appel_oev_last, appel_ptme_last, visite_oev_last, visite_ptme_last, agent_data_visite, agent_data_appel]
-    sheet_names = ['Tableau des Appels et Visites', 'Listes des Appels et Visites', 'Personnes trouvées', 'Appel OEV', 'Appel PTME', 'Visite OEV', 'Visite PTME', 'Visite par agent', 'Appels par agent']
-    titles = ['Tableau des Appels et Visites - Résumé Principal', 'Liste Détaillée des Appels et Visites', 'Pivotable des personnes trouvées par mois/programme', 'Tableau Croisé des Appels - OEV', 'Tableau Croisé des Appels - PTME', 'Tableau Croisé des Visites - OEV', 'Tableau Croisé des Visites - PTME', 'Performances visite par agent', 'Performances Appels par agent']
-
-    export_multiple_pivot_tables_to_excel(pivot_tables, f'Tableau_des_Performances {today_date}.xlsx', sheet_names, titles, delete_row=None)
-        # Écrit 'agent_data' dans le même classeur daté
-    from pathlib import Path
-    from openpyxl import load_workbook, Workbook
-
-    def copy_sheet_with_formatting(src_path: str, src_sheet: str, dst_path: str, dst_sheet: str, replace: bool = True):
-        """
-        Copie une feuille d'un classeur source vers un classeur destination en préservant :
-        valeurs/formules, merges, largeurs de colonnes, hauteurs de lignes et styles de base.
-        Si `replace=True` et que la feuille existe, elle est supprimée puis recréée.
-        Positionne automatiquement le 'Tableau des Appels et Visites' en première position.
-        """
-        try:
-            wb_src = load_workbook(src_path, data_only=False)
-            if src_sheet not in wb_src.sheetnames:
-                raise ValueError(f"Feuille '{src_sheet}' introuvable dans {src_path}")
-            ws_src = wb_src[src_sheet]
-
-            # S'assurer que le classeur destination existe
-            dst_path_p = Path(dst_path)
-            if not dst_path_p.exists():
-                wb_tmp = Workbook()
-                wb_tmp.save(dst_path_p)
-
-            wb_dst = load_workbook(dst_path_p)
-
-            # Remplacer si demandé
-            if dst_sheet in wb_dst.sheetnames and replace:
-                del wb_dst[dst_sheet]
-
-            ws_dst = wb_dst.create_sheet(dst_sheet)
-
-            # Largeurs de colonnes
-            for col_letter, dim in ws_src.column_dimensions.items():
-                if dim.width:
-                    ws_dst.column_dimensions[col_letter].width = dim.width
-
-            # Hauteurs de lignes
-            for idx, dim in ws_src.row_dimensions.items():
-                if dim.height:
-                    ws_dst.row_dimensions[idx].height = dim.height
-
-            # Geler les volets si présent
-            if ws_src.freeze_panes:
-                ws_dst.freeze_panes = ws_src.freeze_panes
-
-            # Copie cellulaire (valeurs + styles) - CORRECTION PRINCIPALE
-            for row in ws_src.iter_rows():
-                for cell in row:
-                    if cell.value is not None:
-                        # Utiliser row et column au lieu de col_idx inexistant
-                        tgt = ws_dst.cell(row=cell.row, column=cell.column, value=cell.value)
-                        
-                        # Copy font properties individually to avoid StyleProxy error
-                        if cell.font and cell.font != ws_src['A1'].font:
-                            from openpyxl.styles import Font
-                            try:
-                                tgt.font = Font(
-                                    name=cell.font.name,
-                                    size=cell.font.size,
-                                    bold=cell.font.bold,
-                                    italic=cell.font.italic,
-                                    vertAlign=cell.font.vertAlign,
-                                    underline=cell.font.underline,
-                                    strike=cell.font.strike,
-                                    color=cell.font.color
-                                )
-                            except Exception:
-                                pass  # Ignorer les erreurs de style
-                        
-                        # Copy alignment properties individually
-                        if cell.alignment:
-                            from openpyxl.styles import Alignment
-                            try:
-                                tgt.alignment = Alignment(
-                                    horizontal=cell.alignment.horizontal,
-                                    vertical=cell.alignment.vertical,
-                                    textRotation=cell.alignment.textRotation,
-                                    wrapText=cell.alignment.wrapText,
-                                    shrinkToFit=cell.alignment.shrinkToFit,
-                                    indent=cell.alignment.indent
-                                )
-                            except Exception:
-                                pass
-                        
-                        # Copy fill properties individually
-                        if cell.fill and hasattr(cell.fill, 'fill_type') and cell.fill.fill_type:
-                            from openpyxl.styles import PatternFill
-                            try:
-                                if cell.fill.fill_type != 'none':
-                                    tgt.fill = PatternFill(
-                                        fill_type=cell.fill.fill_type,
-                                        start_color=cell.fill.start_color,
-                                        end_color=cell.fill.end_color
-                                    )
-                            except Exception:
-                                pass
-                        
-                        # Copy border properties individually
-                        if cell.border:
-                            from openpyxl.styles import Border
-                            try:
-                                tgt.border = Border(
-                                    left=cell.border.left,
-                                    right=cell.border.right,
-                                    top=cell.border.top,
-                                    bottom=cell.border.bottom,
-                                    diagonal=cell.border.diagonal,
-                                    diagonal_direction=cell.border.diagonal_direction,
-                                    vertical=cell.border.vertical,
-                                    horizontal=cell.border.horizontal
-                                )
-                            except Exception:
-                                pass
-                        
-                        # Copy other properties
-                        try:
-                            if cell.number_format and cell.number_format != 'General':
-                                tgt.number_format = cell.number_format
-                        except Exception:
-                            pass
-                        
-                        # Copy protection properties individually
-                        if cell.protection:
-                            from openpyxl.styles import Protection
-                            try:
-                                tgt.protection = Protection(
-                                    locked=cell.protection.locked,
-                                    hidden=cell.protection.hidden
-                                )
-                            except Exception:
-                                pass
-
-            # Fusions
-            try:
-                for m in ws_src.merged_cells.ranges:
-                    ws_dst.merge_cells(str(m))
-            except Exception as e:
-                print(f"Erreur lors de la copie des cellules fusionnées: {e}")
-
-            # Mise en page (optionnel)
-            try:
-                ws_dst.page_setup = ws_src.page_setup
-                ws_dst.page_margins = ws_src.page_margins
-                ws_dst.print_options = ws_src.print_options
-            except Exception:
-                pass  # Ignorer les erreurs de mise en page
-
-            # AUTOMATIQUEMENT PLACER "Tableau des Appels et Visites" EN PREMIÈRE POSITION
-            # Assurer que cette feuille est toujours en première position et avant "Listes des Appels et Visites"
-            all_sheets = list(wb_dst.sheetnames)
-            if dst_sheet in all_sheets:
-                # Si le nom de la feuille contient "Tableau des Appels et Visites"
-                if "Tableau des Appels et Visites" in dst_sheet:
-                    # Si ce n'est pas déjà la première feuille
-                    if all_sheets[0] != dst_sheet:
-                        target_sheet = wb_dst[dst_sheet]
-                        # Déplacer en première position
-                        wb_dst.move_sheet(target_sheet, offset=-len(all_sheets))
-                        print(f"✅ Feuille '{dst_sheet}' déplacée en première position.")
-                    else:
-                        print(f"✅ Feuille '{dst_sheet}' déjà en première position.")
-                    
-                    # Vérifier que "Listes des Appels et Visites" est après si elle existe
-                    if "Listes des Appels et Visites" in all_sheets:
-                        updated_sheets = list(wb_dst.sheetnames)
-                        tableau_index = updated_sheets.index(dst_sheet)
-                        liste_index = updated_sheets.index("Listes des Appels et Visites")
-                        
-                        if liste_index < tableau_index:
-                            # Déplacer "Listes des Appels et Visites" après "Tableau des Appels et Visites"
-                            liste_sheet = wb_dst["Listes des Appels et Visites"]
-                            wb_dst.move_sheet(liste_sheet, offset=(tableau_index - liste_index))
-                            print(f"✅ Feuille 'Listes des Appels et Visites' déplacée après '{dst_sheet}'.")
-                        else:
-                            print(f"✅ L'ordre correct est respecté: '{dst_sheet}' avant 'Listes des Appels et Visites'.")
-
-            wb_dst.save(dst_path_p)
-            wb_src.close()
-            wb_dst.close()
-            
-        except Exception as e:
-            print(f"Erreur dans copy_sheet_with_formatting: {e}")
-            raise
-
-    # -------------------------
-    # Paramétrage demandé
-    # -------------------------
-    today_str = datetime.now().strftime("%Y-%m-%d")
-
-    src_path = os.path.join("Resultat", f"Table_des_Performances_{today_str}.xlsx")
-    src_sheet = "Tableau des Appels et Visites"
+    # Tableau des performances : feuille de synthèse en première position, puis la liste détaillée et les tableaux croisés
+    pivot_tables = [data_cleaned, groupeby_data, appel_oev_last, appel_ptme_last, visite_oev_last, visite_ptme_last, agent_data_visite, agent_data_appel]
+    sheet_names = ['Listes des Appels et Visites', 'Personnes trouvées', 'Appel OEV', 'Appel PTME', 'Visite OEV', 'Visite PTME', 'Visite par agent', 'Appels par agent']
+    titles = ['Liste Détaillée des Appels et Visites', 'Pivotable des personnes trouvées par mois/programme', 'Tableau Croisé des Appels - OEV', 'Tableau Croisé des Appels - PTME', 'Tableau Croisé des Visites - OEV', 'Tableau Croisé des Visites - PTME', 'Performances visite par agent', 'Performances Appels par agent']
 
-    dst_path = f"./Tableau_des_Performances {today_date}.xlsx"
-    dst_sheet = "Tableau des Appels et Visites"
-
-    # Exécution
-    copy_sheet_with_formatting(
-        src_path=src_path,
-        src_sheet=src_sheet,
-        dst_path=dst_path,
-        dst_sheet=dst_sheet,
-        replace=True
-    )
-    print(f"Feuille '{src_sheet}' copiée vers '{dst_path}' en tant que '{dst_sheet}'.")
-    
+    tableau_workbook = add_summary_sheet(WorkbookBuilder(), summary_tables)
+    add_pivot_tables_to_workbook(tableau_workbook, pivot_tables, sheet_names, titles)
+    tableau_workbook.save(f'./Tableau_des_Performances {today_date}.xlsx')
     print(f"Tableau des performances créé avec 'Tableau des Appels et Visites' en première position.")
 
     # Additional data processing
@@ -1,23 +1,238 @@
 import os
+import json
+import hashlib
+import threading
+import time
+from functools import lru_cache
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import bindparam, create_engine, event, text
 import pandas as pd
 
-def execute_sql_query(env_path: str, sql_file_path: str) -> pd.DataFrame:
+# Pool de connexions MySQL partagé par tous les appels à execute_sql_query
+SQL_POOL_SIZE = 5
+SQL_MAX_OVERFLOW = 5
+SQL_POOL_RECYCLE = 3600
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+# Cache local des résultats SQL (Parquet), activé avec SQL_CACHE=1 ;
+# SQL_CACHE_REFRESH=1 (run_all.py --refresh) force la relecture depuis MySQL
+SQL_CACHE_DIR = os.getenv('SQL_CACHE_DIR', '.sql_cache')
+SQL_CACHE_TTL = int(os.getenv('SQL_CACHE_TTL', str(6 * 3600)))
+SQL_CACHE_MAX_BYTES = int(os.getenv('SQL_CACHE_MAX_MB', '1024')) * 1024 * 1024
+
+_cache_stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+
+
+@lru_cache(maxsize=None)
+def load_db_settings(env_path: str) -> tuple:
+    """Lit (une seule fois par fichier) les paramètres MySQL du fichier .env."""
     load_dotenv(env_path)
-    user = os.getenv('MYSQL_USER')
-    password = os.getenv('MYSQL_PASSWORD')
-    host = os.getenv('MYSQL_HOST')
-    db = os.getenv('MYSQL_DB')
+    return (os.getenv('MYSQL_USER'), os.getenv('MYSQL_PASSWORD'),
+            os.getenv('MYSQL_HOST'), os.getenv('MYSQL_DB'))
+
+
+def _mark_new_connection(dbapi_connection, connection_record):
+    connection_record.info['new'] = True
+
+
+def get_engine(env_path: str = 'dot.env'):
+    """
+    Retourne l'engine SQLAlchemy partagé pour les paramètres de env_path.
+    Un engine (pool de SQL_POOL_SIZE connexions, pre-ping) est créé par
+    jeu de paramètres et réutilisé pour toute la durée du processus.
+    """
+    settings = load_db_settings(os.path.abspath(env_path))
+    with _engines_lock:
+        engine = _engines.get(settings)
+        if engine is None:
+            user, password, host, db = settings
+            conn_text = f'mysql+pymysql://{user}:{password}@{host}/{db}'
+            engine = create_engine(conn_text, pool_size=SQL_POOL_SIZE, max_overflow=SQL_MAX_OVERFLOW,
+                                   pool_pre_ping=True, pool_recycle=SQL_POOL_RECYCLE)
+            event.listen(engine, 'connect', _mark_new_connection)
+            _engines[settings] = engine
+    return engine
+
+
+def dispose_engines():
+    """Ferme toutes les connexions des engines partagés."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
 
-    conn_text = f'mysql+pymysql://{user}:{password}@{host}/{db}'
-    engine = create_engine(conn_text)
+# Schéma (dates, types) appliqué au résultat de chaque fichier .sql, par nom de fichier
+SQL_SCHEMAS = {
+    'Mastersheet PTME.sql': {
+        'parse_dates': ['DPA_calculated', 'actual_delivery_date', 'delivery_date_merge',
+                        'delivery_probality_date_merge', 'ddr', 'dpa', 'infant_dob'],
+        'dtypes': {'office': 'category', 'network': 'category', 'departement': 'category',
+                   'commune': 'category', 'is_abandoned': 'float64'},
+    },
+    'Charges_virales_pediatriques.sql': {
+        'parse_dates': ['date_of_birth', 'arv_start_date', 'last_viral_load_collection_date',
+                        'viral_load_date', 'prev_viral_load_date', 'last_followup_date', 'weight_date'],
+        'dtypes': {'office': 'category', 'network': 'category', 'departement': 'category',
+                   'commune': 'category', 'sex': 'category', 'club_type': 'category',
+                   'age': 'float64', 'is_abandoned': 'float64'},
+    },
+}
+
+# Valeurs par défaut des paramètres (:nom) des fichiers .sql paramétrés ;
+# listes vides et None ne filtrent rien
+SQL_PARAMS = {
+    'Charges_virales_pediatriques.sql': {
+        'excluded_offices': [], 'excluded_networks': [], 'excluded_sites': [],
+        'min_age': None, 'max_age': None,
+    },
+}
+
+
+def _sql_statement(sql_query: str, params: dict):
+    """Requête SQLAlchemy avec paramètres liés (les listes sont développées pour IN)."""
+    expanding = [bindparam(name, expanding=True) for name, value in params.items() if isinstance(value, (list, tuple))]
+    return text(sql_query).bindparams(*expanding)
+
+
+def _apply_sql_schema(df: pd.DataFrame, schema: dict, columns=None) -> pd.DataFrame:
+    """Projette et type un bloc de résultat (par position : les requêtes h.*, v.* ont des colonnes en double)."""
+    if columns is not None:
+        df = df.loc[:, df.columns.isin(columns)]
+    parse_dates = set(schema.get('parse_dates', []))
+    dtypes = schema.get('dtypes', {})
+    for i, col in enumerate(df.columns):
+        if col in parse_dates:
+            df.isetitem(i, pd.to_datetime(df.iloc[:, i], errors='coerce'))
+        elif dtypes.get(col) == 'category':
+            df.isetitem(i, df.iloc[:, i].astype('category'))
+        elif col in dtypes:
+            df.isetitem(i, pd.to_numeric(df.iloc[:, i], errors='coerce').astype(dtypes[col]))
+    return df
+
+
+def _concat_chunks(chunks: list) -> pd.DataFrame:
+    """Concatène les blocs en gardant les colonnes catégorielles (catégories unifiées)."""
+    if len(chunks) == 1:
+        return chunks[0]
+    first = chunks[0]
+    for i in range(first.shape[1]):
+        if isinstance(first.iloc[:, i].dtype, pd.CategoricalDtype):
+            categories = pd.api.types.union_categoricals([c.iloc[:, i] for c in chunks]).categories
+            for chunk in chunks:
+                chunk.isetitem(i, chunk.iloc[:, i].cat.set_categories(categories))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _sql_cache_key(settings: tuple, sql_query: str, params: dict, columns, schema: dict) -> str:
+    """Empreinte du texte SQL et de ses paramètres, de la cible (sans mot de passe), de la projection et du schéma."""
+    user, _, host, db = settings
+    payload = json.dumps([f'{user}@{host}/{db}', sql_query, params, sorted(columns) if columns else None, schema],
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _read_sql_cache(key: str):
+    path = os.path.join(SQL_CACHE_DIR, f'{key}.parquet')
+    if not os.path.exists(path) or time.time() - os.path.getmtime(path) > SQL_CACHE_TTL:
+        return None
+    import pyarrow.parquet as pq
+    table = pq.read_table(path)
+    # Noms d'origine conservés dans les métadonnées (colonnes en double possibles)
+    names = json.loads(table.schema.metadata[b'caris_columns'])
+    df = table.to_pandas()
+    df.columns = names
+    # Dernier accès, pour l'éviction LRU (le TTL compte depuis l'écriture)
+    os.utime(path, (time.time(), os.path.getmtime(path)))
+    return df
+
+
+def _write_sql_cache(key: str, df: pd.DataFrame):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    os.makedirs(SQL_CACHE_DIR, exist_ok=True)
+    table = pa.Table.from_pandas(df.set_axis([f'c{i}' for i in range(df.shape[1])], axis=1), preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), b'caris_columns': json.dumps([str(c) for c in df.columns]).encode()}
+    tmp_path = os.path.join(SQL_CACHE_DIR, f'{key}.parquet.tmp')
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+    os.replace(tmp_path, os.path.join(SQL_CACHE_DIR, f'{key}.parquet'))
+    _evict_sql_cache()
+
+
+def _evict_sql_cache():
+    """Supprime les entrées les moins récemment lues tant que le cache dépasse SQL_CACHE_MAX_BYTES."""
+    entries = [entry for entry in os.scandir(SQL_CACHE_DIR) if entry.name.endswith('.parquet')]
+    entries.sort(key=lambda entry: entry.stat().st_atime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= SQL_CACHE_MAX_BYTES:
+            break
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+        print(f"Cache SQL : {entry.name} supprimé (taille maximale atteinte)")
+
+
+def execute_sql_query(env_path: str, sql_file_path: str, chunksize: int = None,
+                      columns: list = None, schema: dict = None, cache: bool = None,
+                      refresh: bool = None, params: dict = None) -> pd.DataFrame:
+    """
+    Exécute un fichier .sql et retourne le résultat typé.
+    Avec chunksize, les lignes sont lues par blocs via un curseur côté serveur,
+    chaque bloc étant projeté sur `columns` et typé selon le schéma du fichier
+    (SQL_SCHEMAS, ou `schema`) avant d'être conservé.
+    params complète les valeurs par défaut de SQL_PARAMS pour les fichiers
+    paramétrés (:start_date, :excluded_offices...), afin que le filtrage
+    soit fait par la base.
+    Avec cache (par défaut SQL_CACHE=1), le résultat est relu depuis
+    SQL_CACHE_DIR tant qu'il a moins de SQL_CACHE_TTL secondes ; refresh
+    (par défaut SQL_CACHE_REFRESH=1) force la relecture depuis la base.
+    """
+    if cache is None:
+        cache = os.getenv('SQL_CACHE') == '1'
+    if refresh is None:
+        refresh = os.getenv('SQL_CACHE_REFRESH') == '1'
+    engine = get_engine(env_path)
+    if schema is None:
+        schema = SQL_SCHEMAS.get(os.path.basename(sql_file_path), {})
 
     with open(sql_file_path, 'r') as file:
         sql_query = file.read().replace('use caris_db;', '')
+    params = {**SQL_PARAMS.get(os.path.basename(sql_file_path), {}), **(params or {})}
+    statement = _sql_statement(sql_query, params) if params else sql_query
+
+    if cache:
+        key = _sql_cache_key(load_db_settings(os.path.abspath(env_path)), sql_query, params, columns, schema)
+        df = None if refresh else _read_sql_cache(key)
+        if df is not None:
+            size = int(df.memory_usage(deep=True).sum())
+            _cache_stats['hits'] += 1
+            _cache_stats['bytes_saved'] += size
+            print(f"{os.path.basename(sql_file_path)}: cache SQL ({df.shape[0]} lignes, {size / 1e6:.1f} Mo évités ; "
+                  f"total {_cache_stats['hits']} hits / {_cache_stats['misses']} miss, "
+                  f"{_cache_stats['bytes_saved'] / 1e6:.1f} Mo)")
+            return df
+        _cache_stats['misses'] += 1
+
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        connected = time.perf_counter()
+        new_connection = conn.connection.info.pop('new', False)
+        if chunksize:
+            conn = conn.execution_options(stream_results=True)
+            chunks = [_apply_sql_schema(chunk, schema, columns)
+                      for chunk in pd.read_sql_query(statement, conn, params=params or None, chunksize=chunksize)]
+            df = _concat_chunks(chunks) if chunks else pd.DataFrame()
+        else:
+            df = _apply_sql_schema(pd.read_sql_query(statement, conn, params=params or None), schema, columns)
+    done = time.perf_counter()
+    print(f"{os.path.basename(sql_file_path)}: connexion {connected - start:.2f}s "
+          f"({'nouvelle' if new_connection else 'pool'}), requête {done - connected:.2f}s, {df.shape[0]} lignes")
 
-    df = pd.read_sql_query(sql_query, engine)
-    engine.dispose()
+    if cache:
+        _write_sql_cache(key, df)
+        print(f"{os.path.basename(sql_file_path)}: {'rafraîchi' if refresh else 'absent'} du cache SQL, résultat enregistré")
 
     return df
 
@@ -9,9 +9,15 @@ import os
 import re
 import time
 import glob
+import queue
+import shutil
 import logging
+import threading
 from datetime import datetime
 from typing import List, Dict, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 
 # Selenium imports
 from selenium.webdriver.common.by import By
@@ -21,7 +27,8 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
 from selenium.webdriver.common.action_chains import ActionChains
 
-from utils import file_matches_today
+from download_folder import DownloadWatcher, FolderIndex, DownloadManifest, pattern_for_date
+import commcare_http
 
 # ===================== CONFIG =====================
 DOWNLOAD_DIR = r"C:\Users\Downloads\caris-meal-app\data"
@@ -71,8 +78,21 @@ MAX_RETRIES_PER_FILE = 3
 MAX_GLOBAL_PASSES = 3
 VERIFICATION_TIMEOUT = 60
 HEAVY_FILE_TIMEOUT = 180  # 3 minutes pour les gros fichiers
+LINK_POLL_INTERVAL = 0.5  # balayage de la modale en attendant le lien du fichier
 HEADLESS = False
 
+# Sessions Chrome parallèles (1 = mode séquentiel sur un seul navigateur)
+PARALLEL_SESSIONS = int(os.getenv("COMMCARE_SESSIONS", "3"))
+# Sous-dossier de DOWNLOAD_DIR où chaque session télécharge (même volume => déplacement atomique)
+SESSIONS_SUBDIR = ".sessions"
+# Attente avant une nouvelle tentative : 10 s, 20 s, 40 s…
+RETRY_BACKOFF_SECONDS = 10
+
+# "http" : export préparé et téléchargé directement (repli Selenium en cas d'échec)
+# "selenium" : pilotage de l'interface uniquement
+DOWNLOAD_BACKEND = os.getenv("COMMCARE_BACKEND", "http")
+HTTP_MAX_ATTEMPTS = 2
+
 # Fichiers lourds nécessitant plus de temps
 HEAVY_FILES = [
     "muso_beneficiaries",
@@ -114,115 +134,150 @@ def cleanup_orphan_crdownload(folder: str) -> None:
         except Exception:
             pass
 
+_folder_index: Optional[FolderIndex] = None
+_folder_index_lock = threading.Lock()
+
+def folder_index(folder: Optional[str] = None, bases: Optional[List[str]] = None) -> FolderIndex:
+    """
+    Index partagé des exports du jour de `folder` (DOWNLOAD_DIR par défaut),
+    synchronisé avant d'être retourné. Recréé si le dossier ou les bases changent (GUI).
+    """
+    global _folder_index
+    folder = folder or DOWNLOAD_DIR
+    bases = tuple(EXPECTED_BASES if bases is None else bases)
+    with _folder_index_lock:
+        if _folder_index is None or _folder_index.folder != folder or _folder_index.bases != bases:
+            ensure_dir(folder)
+            _folder_index = FolderIndex(folder, bases)
+        index = _folder_index
+    return index.sync()
+
+_download_manifest: Optional[DownloadManifest] = None
+
+def download_manifest(folder: Optional[str] = None) -> DownloadManifest:
+    """Manifeste des téléchargements de `folder` (DOWNLOAD_DIR par défaut)."""
+    global _download_manifest
+    folder = folder or DOWNLOAD_DIR
+    with _folder_index_lock:
+        if _download_manifest is None or _download_manifest.folder != folder:
+            ensure_dir(folder)
+            _download_manifest = DownloadManifest(folder)
+        return _download_manifest
+
+def record_download(base: str, path: str, **info) -> bool:
+    """
+    Contrôle le fichier téléchargé (archive zip, SHA-256) et l'inscrit au manifeste.
+    Un fichier corrompu est supprimé pour être retéléchargé ; retourne False dans ce cas.
+    """
+    entry = download_manifest().finish(base, path, **info)
+    if entry["status"] == "verified":
+        folder_index().add(path)
+        return True
+    log.warning(f"⚠️ Archive invalide pour {base} ({entry.get('error')}) — fichier supprimé.")
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    folder_index().discard(path)
+    return False
+
+def verify_present_downloads(folder: str) -> None:
+    """
+    Reprise après interruption : les fichiers du jour déjà vérifiés et inchangés
+    sont conservés sans relecture, les autres sont contrôlés ; les corrompus
+    sont supprimés pour être retéléchargés.
+    """
+    index = folder_index(folder)
+    manifest = download_manifest(folder)
+    kept = rechecked = removed = 0
+    for base, names in index.present_map().items():
+        for name in names:
+            path = os.path.join(folder, name)
+            if manifest.is_verified(base, path):
+                kept += 1
+            elif manifest.verify_file(base, path, export_url=EXPORT_URLS.get(base)):
+                rechecked += 1
+            else:
+                log.warning(f"♻️ Export incomplet ou corrompu, à retélécharger: {name}")
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                index.discard(name)
+                removed += 1
+    log.info("Manifeste: %d vérifiés, %d contrôlés, %d corrompus supprimés", kept, rechecked, removed)
+
 def cleanup_duplicate_files(folder: str) -> None:
     """Nettoie les fichiers dupliqués en gardant le plus récent."""
     ensure_dir(folder)
-    files = list_xlsx(folder)
-    file_groups: Dict[str, List[str]] = {}
-    for filename in files:
-        for base in EXPECTED_BASES:
-            if file_matches_today(base, filename):
-                file_groups.setdefault(base, []).append(filename)
-                break
+    index = folder_index(folder)
+    for base, group_files in index.duplicates().items():
+        log.info(f"Fichiers dupliqués trouvés pour {base}: {group_files}")
+        group_files.sort(key=lambda f: os.path.getmtime(os.path.join(folder, f)))
+        for file_to_delete in group_files[:-1]:
+            try:
+                os.remove(os.path.join(folder, file_to_delete))
+                index.discard(file_to_delete)
+                log.info(f"Fichier dupliqué supprimé: {file_to_delete}")
+            except Exception as e:
+                log.warning(f"Impossible de supprimer {file_to_delete}: {e}")
 
-    for base, group_files in file_groups.items():
-        if len(group_files) > 1:
-            log.info(f"Fichiers dupliqués trouvés pour {base}: {group_files}")
-            group_files.sort(key=lambda f: os.path.getmtime(os.path.join(folder, f)))
-            for file_to_delete in group_files[:-1]:
-                try:
-                    os.remove(os.path.join(folder, file_to_delete))
-                    log.info(f"Fichier dupliqué supprimé: {file_to_delete}")
-                except Exception as e:
-                    log.warning(f"Impossible de supprimer {file_to_delete}: {e}")
+def session_download_dir(worker_id: int) -> str:
+    path = os.path.abspath(os.path.join(DOWNLOAD_DIR, SESSIONS_SUBDIR, f"session_{worker_id}"))
+    ensure_dir(path)
+    return path
+
+def move_into_place(path: str, folder: str) -> str:
+    """Déplace un export complet vers `folder` sans jamais y exposer de fichier partiel."""
+    target = os.path.join(folder, os.path.basename(path))
+    try:
+        os.replace(path, target)
+    except OSError:
+        # Volumes différents : copie sous un nom temporaire puis renommage atomique
+        tmp = target + ".part"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+        os.remove(path)
+    return target
 
 def human_list(items: List[str]) -> str:
     return "[" + ", ".join(items) + "]" if items else "[]"
 
 # ===================== PATTERN (matching des fichiers du jour) =====================
 def build_pattern_with_today(base: str) -> re.Pattern:
-    date = today_str()
-    base_esc = re.escape(base)
-
-    # Fichiers simplifiés (sans "(created ...)"), comparer en insensitive
-    simple_pattern_files = {
-        "household mother",
-        "ajout de menages ptme [officiel]",
-        "ptme with patient code",
-        "household_child",
-        "all_child_patientcode_caseid",
-        "all gardens",
-    }
-
-    # Fichiers avec "(created <DATE_FIXE>)"
-    special_pattern_files = {
-        "muso_groupes": r"muso_groupes\s*\(created\s+2025-03-25\)\s+",
-        "muso_beneficiaries": r"muso_beneficiaries\s*\(created\s+2025-03-25\)\s+",
-        "muso_household_2022": r"muso_household_2022\s*\(created\s+2025-03-25\)\s+",
-        "All Gardens": r"All Gardens\s*\(created\s+2025-03-25\)\s+",
-    }
-
-    if base.lower() in simple_pattern_files:
-        # ex: "household mother 2025-08-14.xlsx" (ou " (1).xlsx")
-        pat = rf"^{base_esc}\s+{re.escape(date)}(?:\s+\(\d+\))?\.xlsx$"
-    elif base in special_pattern_files:
-        special_prefix = special_pattern_files[base]
-        pat = rf"^{special_prefix}{re.escape(date)}(?:\s+\(\d+\))?\.xlsx$"
-    else:
-        # ex: "Caris Health Agent ... (created 2025-01-01) 2025-08-14.xlsx"
-        pat = rf"^{base_esc}\s*\(created\s+\d{{4}}-\d{{2}}-\d{{2}}\)\s+{re.escape(date)}\.xlsx$"
-
-    return re.compile(pat, re.IGNORECASE)
-
-def file_matches_today(base: str, filename: str) -> bool:
-    # Normalisation pour éviter les faux négatifs (casse, espaces)
-    today = today_str()
-    base_norm = base.lower().replace(" ", "_")
-    fname_norm = os.path.basename(filename).lower().replace(" ", "_")
-    # Pattern robuste pour tous les cas
-    pat = re.compile(rf"^{re.escape(base_norm)}(\s*\(created\s+\d{{4}}-\d{{2}}-\d{{2}}\))?\s+{today}(?:\s+\(\d+\))?\.xlsx$")
-    return bool(pat.match(fname_norm))
+    # Motif compilé une fois par jour et partagé avec FolderIndex / la GUI
+    return pattern_for_date(base, today_str())
 
 # ===================== VERIFICATION =====================
 def check_existing_files(expected_bases: List[str], folder_path: str) -> Tuple[List[str], Dict[str, List[str]]]:
     ensure_dir(folder_path)
-    present = list_xlsx(folder_path)
-    present_map: Dict[str, List[str]] = {}
-    missing_bases: List[str] = []
-    for base in expected_bases:
-        matches = [f for f in present if file_matches_today(base, f)]
-        present_map[base] = matches
-        if not matches:
-            missing_bases.append(base)
-    return missing_bases, present_map
-
-def _file_size_stable(path: str, wait_interval: float = 1.5) -> bool:
-    try:
-        s1 = os.path.getsize(path)
-        time.sleep(wait_interval)
-        s2 = os.path.getsize(path)
-        return s1 > 0 and s1 == s2
-    except Exception:
-        return False
+    index = folder_index(folder_path, expected_bases)
+    return index.missing(), index.present_map()
+
+def is_present_today(base: str) -> bool:
+    return folder_index().present(base)
 
-def verify_download_success_for_base(base: str, folder_path: str, timeout: int = VERIFICATION_TIMEOUT) -> Optional[str]:
+def verify_download_success_for_base(base: str, folder_path: str, timeout: int = VERIFICATION_TIMEOUT,
+                                     watcher: Optional[DownloadWatcher] = None) -> Optional[str]:
+    """
+    Attend que le .xlsx du jour pour `base` soit complet (renommé depuis le
+    .crdownload, taille stable). Réveillé par les événements du dossier si un
+    watcher est actif, sinon par un balayage périodique.
+    """
     actual_timeout = HEAVY_FILE_TIMEOUT if base in HEAVY_FILES else timeout
     log.info(f"Vérification du téléchargement pour {base} (timeout: {actual_timeout}s)")
     pat = build_pattern_with_today(base)
-    end = time.time() + actual_timeout
+    t_start = time.time()
 
-    while time.time() < end:
-        if list_partial_downloads(folder_path):
-            log.info(f"Téléchargement en cours pour {base}...")
-            time.sleep(2.0)
-
-        for f in list_xlsx(folder_path):
-            if pat.match(f):
-                full = os.path.join(folder_path, f)
-                if _file_size_stable(full, wait_interval=2.0):
-                    return full
-        time.sleep(2.0)
-    return None
+    if watcher is None:
+        with DownloadWatcher(folder_path) as tmp_watcher:
+            path = tmp_watcher.wait_for_file(pat, actual_timeout)
+    else:
+        path = watcher.wait_for_file(pat, actual_timeout)
+
+    if path:
+        log.info(f"Fichier complet pour {base} après {time.time() - t_start:.1f}s")
+    return path
 
 # ===================== SELENIUM HELPERS =====================
 def unfreeze_interface(driver):
@@ -262,54 +317,62 @@ def set_date_range(driver, start_date="2021-01-01", end_date=None):
         except Exception:
             pass
 
+def _is_visible(el) -> bool:
+    try:
+        return el.is_displayed() and el.is_enabled()
+    except StaleElementReferenceException:
+        return False
+
+def _ready_download_link(driver):
+    """
+    Lien du fichier prêt dans la modale #download-progress, ou None.
+    Seule la modale est examinée : les liens « Download » de la navigation
+    de la page sont toujours visibles et ne déclenchent pas l'export.
+    """
+    for el in driver.find_elements(By.CSS_SELECTOR, "#download-progress a[href$='.xlsx']"):
+        if _is_visible(el):
+            return el
+    # Le lien du formulaire de la modale n'est valable qu'une fois la génération terminée
+    bars = [b for b in driver.find_elements(By.CSS_SELECTOR, "#download-progress .progress-bar") if _is_visible(b)]
+    if any(b.get_attribute("aria-valuenow") != "100" and "width: 100%" not in (b.get_attribute("style") or "")
+           for b in bars):
+        return None
+    for el in driver.find_elements(By.CSS_SELECTOR, "#download-progress form a"):
+        if _is_visible(el):
+            return el
+    return None
+
 def click_any_download_link(driver, timeout_seconds: int) -> bool:
     """
-    Tente de cliquer un lien/bouton de téléchargement présent dans la modale #download-progress.
+    Clique le lien du fichier dans la modale #download-progress dès que
+    l'export est prêt (balayage toutes les LINK_POLL_INTERVAL secondes).
     Retourne True si un clic a pu être effectué, False sinon.
     """
-    candidates = [
-        (By.CSS_SELECTOR, "#download-progress a[href$='.xlsx']"),
-        (By.CSS_SELECTOR, "#download-progress form a"),
-        (By.CSS_SELECTOR, "#download-progress a"),
-        (By.XPATH, "//div[@id='download-progress']//a[contains(., 'Download') or contains(., 'Télécharger')]"),
-        (By.XPATH, "//a[contains(@href, 'download') and contains(@href, '.xlsx')]"),
-        (By.XPATH, "//button[contains(., 'Download') or contains(., 'Télécharger')]"),
-        (By.CSS_SELECTOR, "a[href*='download']"),
-    ]
-
     end = time.time() + timeout_seconds
     while time.time() < end:
-        for loc in candidates:
-            try:
-                a = WebDriverWait(driver, 10).until(EC.element_to_be_clickable(loc))
-            except TimeoutException:
-                continue
-
+        link = _ready_download_link(driver)
+        if link is not None:
             try:
                 # Scroll + click JS (fiable)
-                driver.execute_script("arguments[0].scrollIntoView({block:'center'});", a)
-                time.sleep(0.8)
-                driver.execute_script("arguments[0].click();", a)
-                log.info("✅ Lien/bouton de téléchargement cliqué.")
+                driver.execute_script("arguments[0].scrollIntoView({block:'center'});", link)
+                driver.execute_script("arguments[0].click();", link)
+                log.info("✅ Lien de téléchargement cliqué.")
                 return True
             except StaleElementReferenceException:
-                # Retenter une fois
-                try:
-                    a = WebDriverWait(driver, 5).until(EC.element_to_be_clickable(loc))
-                    driver.execute_script("arguments[0].click();", a)
-                    log.info("✅ Clic réussi après stale element.")
-                    return True
-                except Exception as e:
-                    log.debug(f"Clic après stale échoué: {e}")
+                # Modale redessinée entre la recherche et le clic : nouveau balayage
+                log.debug("Lien remplacé avant le clic, nouvel essai.")
             except Exception as e:
                 log.debug(f"Clic échoué: {e}")
-
-        # courte pause avant nouvel essai
-        time.sleep(2)
+        time.sleep(LINK_POLL_INTERVAL)
 
     return False
 
 # ===================== DÉCLENCHEUR DOWNLOAD =====================
+def preparation_timeout_for(export_base: str) -> int:
+    if export_base in ["muso_household_2022", "muso_beneficiaries"]:
+        return 600
+    return 300 if export_base in HEAVY_FILES else 180
+
 def trigger_download(export_base: str, driver) -> None:
     if export_base not in EXPORT_URLS:
         log.error(f"URL non trouvee pour l'export : {export_base}")
@@ -319,14 +382,12 @@ def trigger_download(export_base: str, driver) -> None:
     log.info(f"Acces a l'URL d'export : {export_url}")
 
     is_heavy_file = export_base in HEAVY_FILES
-    preparation_timeout = 600 if export_base in ["muso_household_2022", "muso_beneficiaries"] else (300 if is_heavy_file else 180)
+    preparation_timeout = preparation_timeout_for(export_base)
     log.info(f"Timeout de préparation: {preparation_timeout}s ({'GROS FICHIER' if is_heavy_file else 'fichier normal'})")
 
     try:
         driver.get(export_url)
-        time.sleep(3)
         set_date_range(driver, "2021-01-01")
-        time.sleep(2)
 
         # Bouton Prepare/Download
         prepare_locators = [
@@ -353,7 +414,6 @@ def trigger_download(export_base: str, driver) -> None:
             log.info("Attente de la modale de téléchargement…")
             WebDriverWait(driver, 120).until(EC.visibility_of_element_located((By.ID, "download-progress")))
             log.info("Modale détectée, attente de génération…")
-            time.sleep(60 if is_heavy_file else 30)
         except TimeoutException:
             log.warning("⚠️ Modale non détectée dans le délai — on continue quand même.")
 
@@ -375,18 +435,32 @@ def trigger_download(export_base: str, driver) -> None:
         raise
 
 # ===================== TÉLÉCHARGEMENT + VÉRIF =====================
-def download_with_verification(export_base: str, driver, max_retries: int = MAX_RETRIES_PER_FILE) -> bool:
+def download_with_verification(export_base: str, driver, max_retries: int = MAX_RETRIES_PER_FILE,
+                               watcher: Optional[DownloadWatcher] = None, session_dir: Optional[str] = None,
+                               backoff: float = 0) -> bool:
+    """
+    Télécharge `export_base` avec `driver`. Avec `session_dir`, le navigateur
+    télécharge dans son propre sous-dossier et le fichier vérifié est ensuite
+    déplacé atomiquement dans DOWNLOAD_DIR. `backoff` double à chaque nouvelle tentative.
+    """
     target_hint = expected_filename_for_today(export_base)
     actual_retries = 2 if export_base in HEAVY_FILES else max_retries
+    download_dir = session_dir or DOWNLOAD_DIR
 
     for attempt in range(1, actual_retries + 1):
         # Vérifie si le fichier existe déjà AVANT de tenter quoi que ce soit (sécurité renforcée)
-        if any(file_matches_today(export_base, f) for f in list_xlsx(DOWNLOAD_DIR)):
+        if is_present_today(export_base):
             log.info(f"⏩ Fichier déjà présent pour {export_base} (avant tentative {attempt}). Aucun téléchargement lancé.")
             return True
 
+        if attempt > 1 and backoff:
+            delay = backoff * 2 ** (attempt - 2)
+            log.info(f"Nouvelle tentative pour {export_base} dans {delay:.0f}s…")
+            time.sleep(delay)
+
         log.info(f"Téléchargement de {target_hint} (tentative {attempt}/{actual_retries})…")
-        cleanup_orphan_crdownload(DOWNLOAD_DIR)
+        cleanup_orphan_crdownload(download_dir)
+        download_manifest().start(export_base, EXPORT_URLS.get(export_base), backend="selenium")
 
         try:
             trigger_download(export_base, driver)
@@ -398,14 +472,19 @@ def download_with_verification(export_base: str, driver, max_retries: int = MAX_
             timeout = 600
         else:
             timeout = HEAVY_FILE_TIMEOUT if export_base in HEAVY_FILES else VERIFICATION_TIMEOUT
-        path = verify_download_success_for_base(export_base, DOWNLOAD_DIR, timeout=timeout)
+        path = verify_download_success_for_base(export_base, download_dir, timeout=timeout, watcher=watcher)
         if path:
-            size_mb = os.path.getsize(path) / (1024 * 1024)
-            log.info("🎉 Téléchargement vérifié: %s (%.1f MB)", os.path.basename(path), size_mb)
-            return True
+            if session_dir:
+                path = move_into_place(path, DOWNLOAD_DIR)
+            if record_download(export_base, path):
+                size_mb = os.path.getsize(path) / (1024 * 1024)
+                log.info("🎉 Téléchargement vérifié: %s (%.1f MB)", os.path.basename(path), size_mb)
+                return True
+        else:
+            download_manifest().fail(export_base, "fichier non reçu")
 
         log.warning("Non confirmé pour %s (tentative %d)", target_hint, attempt)
-        cleanup_orphan_crdownload(DOWNLOAD_DIR)
+        cleanup_orphan_crdownload(download_dir)
 
     log.error("Échec après %d tentatives pour %s", actual_retries, target_hint)
     return False
@@ -460,6 +539,155 @@ def commcare_login(driver, email: str, password: str, first_export_url: str):
     except TimeoutException:
         raise RuntimeError("Échec d'authentification")
 
+# ===================== BACKEND HTTP =====================
+def download_via_http(export_base: str) -> bool:
+    """Prépare, attend et télécharge `export_base` par HTTP directement dans DOWNLOAD_DIR."""
+    if is_present_today(export_base):
+        log.info(f"⏩ Fichier déjà présent pour {export_base}. Aucun téléchargement lancé.")
+        return True
+
+    for attempt in range(1, HTTP_MAX_ATTEMPTS + 1):
+        if attempt > 1:
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 2))
+        t_start = time.time()
+        export_url = EXPORT_URLS[export_base]
+        manifest = download_manifest()
+        manifest.start(export_base, export_url, backend="http")
+        try:
+            download_id = commcare_http.prepare_export(export_url)
+            download_url = commcare_http.poll_export(export_url, download_id, timeout=preparation_timeout_for(export_base))
+            path = commcare_http.stream_to_disk(download_url, DOWNLOAD_DIR)
+        except (TimeoutError, requests.ConnectionError, requests.Timeout) as e:
+            log.warning(f"[http] {export_base} (tentative {attempt}/{HTTP_MAX_ATTEMPTS}): {e}")
+            manifest.fail(export_base, e)
+            continue
+        except Exception as e:
+            # Réponse inattendue du serveur : inutile d'insister, Selenium prendra le relais
+            log.warning(f"[http] {export_base}: {e}")
+            manifest.fail(export_base, e)
+            return False
+
+        if not build_pattern_with_today(export_base).match(os.path.basename(path)):
+            log.warning(f"[http] Nom inattendu pour {export_base}: {os.path.basename(path)}")
+            manifest.fail(export_base, f"nom inattendu: {os.path.basename(path)}")
+            return False
+        if not record_download(export_base, path, download_url=download_url):
+            continue
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        log.info("🎉 [http] %s (%.1f MB) en %.1fs", os.path.basename(path), size_mb, time.time() - t_start)
+        return True
+    return False
+
+def run_http_downloads(bases: List[str], email: str, password: str) -> Tuple[List[str], List[str]]:
+    """
+    Télécharge `bases` par HTTP (connexion unique, PARALLEL_SESSIONS exports
+    en parallèle). Retourne (réussies, échouées) ; les échouées passent à Selenium.
+    """
+    try:
+        root = commcare_http.parse_export_url(EXPORT_URLS[bases[0]])["root"]
+        commcare_http.login(email, password, root)
+    except Exception as e:
+        log.warning(f"Connexion HTTP impossible ({e}) — repli sur Selenium.")
+        return [], list(bases)
+
+    ordered = sorted(bases, key=lambda b: b not in HEAVY_FILES)
+    with ThreadPoolExecutor(max_workers=max(1, min(PARALLEL_SESSIONS, len(bases)))) as executor:
+        results = dict(zip(ordered, executor.map(download_via_http, ordered)))
+    succeeded = [b for b in bases if results.get(b)]
+    failed = [b for b in bases if not results.get(b)]
+    return succeeded, failed
+
+# ===================== SESSIONS PARALLÈLES =====================
+def _session_worker(worker_id: int, work: "queue.Queue[str]", results: Dict[str, bool],
+                    email: str, password: str) -> None:
+    """Une session Chrome connectée qui vide la file partagée des bases à télécharger."""
+    session_dir = session_download_dir(worker_id)
+    cleanup_orphan_crdownload(session_dir)
+    driver = None
+    logged_in = False
+    try:
+        driver = start_chrome(session_dir, headless=HEADLESS)
+        with DownloadWatcher(session_dir) as watcher:
+            while True:
+                try:
+                    base = work.get_nowait()
+                except queue.Empty:
+                    return
+                if not logged_in:
+                    try:
+                        commcare_login(driver, email, password, EXPORT_URLS[base])
+                        logged_in = True
+                    except Exception:
+                        # Rendre la base aux autres sessions avant d'abandonner celle-ci
+                        work.put(base)
+                        raise
+                log.info(f"[session {worker_id}] 📥 {expected_filename_for_today(base)}")
+                try:
+                    ok = download_with_verification(base, driver, max_retries=MAX_RETRIES_PER_FILE, watcher=watcher,
+                                                    session_dir=session_dir, backoff=RETRY_BACKOFF_SECONDS)
+                except Exception as e:
+                    log.error(f"[session {worker_id}] Erreur pour {base}: {e}")
+                    ok = False
+                results[base] = ok
+    except Exception as e:
+        log.error(f"[session {worker_id}] Session arrêtée: {e}")
+    finally:
+        if driver:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+def run_parallel_downloads(bases: List[str], email: str, password: str,
+                           sessions: Optional[int] = None) -> Tuple[List[str], List[str]]:
+    """
+    Télécharge `bases` avec `sessions` navigateurs en parallèle, chacun dans son
+    sous-dossier. Retourne (réussies, échouées).
+    """
+    work: "queue.Queue[str]" = queue.Queue()
+    # Gros exports en tête de file : la passe est bornée par l'export le plus lent
+    for base in sorted(bases, key=lambda b: b not in HEAVY_FILES):
+        work.put(base)
+
+    results: Dict[str, bool] = {}
+    n = max(1, min(sessions or PARALLEL_SESSIONS, len(bases)))
+    log.info("Lancement de %d sessions Chrome parallèles…", n)
+    threads = [
+        threading.Thread(target=_session_worker, args=(i, work, results, email, password),
+                         name=f"session-{i}", daemon=True)
+        for i in range(1, n + 1)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    succeeded = [b for b in bases if results.get(b)]
+    failed = [b for b in bases if not results.get(b)]
+    return succeeded, failed
+
+def run_serial_downloads(bases: List[str], driver, watcher: Optional[DownloadWatcher] = None) -> Tuple[List[str], List[str]]:
+    """Télécharge `bases` une à une avec un seul navigateur. Retourne (réussies, échouées)."""
+    succeeded: List[str] = []
+    failed: List[str] = []
+    for base in bases:
+        # Vérification stricte AVANT chaque tentative, même en cas de relance
+        if is_present_today(base):
+            log.info(f"⏩ Fichier déjà présent pour {base}. Aucun téléchargement lancé.")
+            succeeded.append(base)
+            continue
+
+        log.info(f"📥 Début du téléchargement: {expected_filename_for_today(base)}")
+        ok = download_with_verification(base, driver, max_retries=MAX_RETRIES_PER_FILE, watcher=watcher)
+        if ok:
+            succeeded.append(base)
+            log.info(f"✅ Téléchargement réussi pour: {base}")
+            cleanup_duplicate_files(DOWNLOAD_DIR)
+        else:
+            failed.append(base)
+            log.warning(f"❌ Téléchargement échoué pour: {base}")
+    return succeeded, failed
+
 # ===================== MAIN =====================
 def main_enhanced(driver=None):
     from dotenv import load_dotenv
@@ -474,6 +702,9 @@ def main_enhanced(driver=None):
     log.info("Nettoyage des fichiers dupliqués…")
     cleanup_duplicate_files(DOWNLOAD_DIR)
 
+    log.info("Contrôle des fichiers déjà présents (manifeste)…")
+    verify_present_downloads(DOWNLOAD_DIR)
+
     missing_bases, present_map = check_existing_files(EXPECTED_BASES, DOWNLOAD_DIR)
     nb_present = sum(1 for v in present_map.values() if v)
 
@@ -487,9 +718,7 @@ def main_enhanced(driver=None):
         return
 
     own_driver = False
-    if driver is None:
-        driver = start_chrome(DOWNLOAD_DIR, headless=HEADLESS)
-        own_driver = True
+    watcher = None
 
     try:
         # Login
@@ -499,41 +728,43 @@ def main_enhanced(driver=None):
         if not email or not password:
             raise RuntimeError("EMAIL / PASSWORD introuvables dans id_cc.env")
 
-        first_url = EXPORT_URLS[missing_bases[0]]
-        commcare_login(driver, email, password, first_url)
-
-        # Passes globales
         total_success = 0
         files_to_download = missing_bases[:]
+
+        # Backend HTTP d'abord (sauf si l'appelant fournit son propre driver)
+        if DOWNLOAD_BACKEND == "http" and driver is None:
+            log.info("=== TÉLÉCHARGEMENT HTTP DIRECT ===")
+            succeeded, files_to_download = run_http_downloads(files_to_download, email, password)
+            total_success += len(succeeded)
+            if files_to_download:
+                log.info("Repli Selenium pour: %s", human_list(files_to_download))
+
+        # Un driver fourni par l'appelant impose le mode séquentiel
+        parallel = driver is None and PARALLEL_SESSIONS > 1 and len(files_to_download) > 1
+
+        if files_to_download and not parallel:
+            if driver is None:
+                driver = start_chrome(DOWNLOAD_DIR, headless=HEADLESS)
+                own_driver = True
+            # Surveillance du dossier : chaque attente dure le temps réel du téléchargement
+            watcher = DownloadWatcher(DOWNLOAD_DIR, index=folder_index()).start()
+            first_url = EXPORT_URLS[files_to_download[0]]
+            commcare_login(driver, email, password, first_url)
+
+        # Passes globales (Selenium)
         current_pass = 1
 
         while files_to_download and current_pass <= MAX_GLOBAL_PASSES:
             log.info("=== PASSE %d ===", current_pass)
-            successful_downloads = 0
-            failed_files: List[str] = []
-
-            for base in files_to_download:
-                # Vérification stricte AVANT chaque tentative, même en cas de relance
-                if any(file_matches_today(base, f) for f in list_xlsx(DOWNLOAD_DIR)):
-                    log.info(f"⏩ Fichier déjà présent pour {base}. Aucun téléchargement lancé.")
-                    successful_downloads += 1
-                    continue
-
-                log.info(f"📥 Début du téléchargement: {expected_filename_for_today(base)}")
-                ok = download_with_verification(base, driver, max_retries=MAX_RETRIES_PER_FILE)
-                if ok:
-                    successful_downloads += 1
-                    log.info(f"✅ Téléchargement réussi pour: {base}")
-                    cleanup_duplicate_files(DOWNLOAD_DIR)
-                else:
-                    failed_files.append(base)
-                    log.warning(f"❌ Téléchargement échoué pour: {base}")
+            if parallel:
+                succeeded, failed_files = run_parallel_downloads(files_to_download, email, password)
+                cleanup_duplicate_files(DOWNLOAD_DIR)
+            else:
+                succeeded, failed_files = run_serial_downloads(files_to_download, driver, watcher)
+            successful_downloads = len(succeeded)
 
             # Filtrer à nouveau les bases déjà téléchargées pour la prochaine passe
-            files_to_download = [
-                b for b in failed_files
-                if not any(file_matches_today(b, f) for f in list_xlsx(DOWNLOAD_DIR))
-            ]
+            files_to_download = folder_index().missing(failed_files)
             log.info("Résultats Passe %d:", current_pass)
             log.info("   Réussis: %d", successful_downloads)
             log.info("   Échoués: %d", len(files_to_download))
@@ -584,9 +815,10 @@ def main_enhanced(driver=None):
             log.info("   📈 Temps moyen par fichier: %.1fs", dt / total_success)
 
         log.info("🔚 Fermeture du navigateur et fin du processus…")
-        time.sleep(2)
 
     finally:
+        if watcher:
+            watcher.stop()
         if own_driver and driver:
             try:
                 log.info("🔒 Fermeture du navigateur Chrome…")
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Téléchargement direct des exports CommCare par HTTP, sans piloter l'interface.
+
+Flux (le même que celui déclenché par les boutons de la page d'export) :
+  1. connexion unique : les cookies de session restent dans la session HTTP
+     partagée de utils (keep-alive, pool de connexions) ;
+  2. POST prepare_custom_export -> download_id ;
+  3. GET poll_custom_export_download jusqu'à ce que le fichier soit prêt ;
+  4. GET du fichier en flux, écrit par blocs dans un .crdownload puis renommé.
+
+commcare_downloader se replie sur Selenium pour toute base qui échoue ici.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+from urllib.parse import urljoin, urlsplit, unquote
+
+from utils import get_commcare_session, commcare_get, HTTP_TIMEOUT
+from download_folder import PARTIAL_SUFFIX
+
+# ex: https://www.commcarehq.org/a/caris-test/data/export/custom/new/form/download/<id>/
+EXPORT_URL_RE = re.compile(
+    r"^(?P<root>https?://[^/]+)/a/(?P<domain>[^/]+)/data/export/custom/new/"
+    r"(?P<kind>form|case)/download/(?P<export_id>[0-9a-fA-F]+)/?$"
+)
+LOGIN_PATH = "/accounts/login/"
+PREPARE_PATH = "/a/{domain}/data/export/custom/prepare_custom_export/"
+POLL_PATH = "/a/{domain}/data/export/custom/poll_custom_export_download/"
+
+DEFAULT_START_DATE = "2021-01-01"
+POLL_INTERVAL = 2.0
+CHUNK_SIZE = 1024 * 1024
+
+_FILENAME_STAR_RE = re.compile(r"filename\*\s*=\s*(?:UTF-8|utf-8)''([^;]+)")
+_FILENAME_RE = re.compile(r'filename\s*=\s*"?([^";]+)"?')
+
+log = logging.getLogger("commcare-downloader")
+
+
+def parse_export_url(export_url: str) -> Dict[str, str]:
+    m = EXPORT_URL_RE.match(export_url)
+    if not m:
+        raise ValueError(f"URL d'export CommCare non reconnue : {export_url}")
+    return m.groupdict()
+
+
+def _csrf_token(session) -> str:
+    return session.cookies.get("csrftoken", "")
+
+
+def login(email: str, password: str, root: str) -> None:
+    """Ouvre une session CommCare (cookies conservés dans la session HTTP partagée)."""
+    session = get_commcare_session()
+    login_url = root + LOGIN_PATH
+    session.get(login_url, timeout=HTTP_TIMEOUT).raise_for_status()
+    data = {
+        "csrfmiddlewaretoken": _csrf_token(session),
+        "hq_login_view-current_step": "auth",
+        "auth-username": email.strip(),
+        "auth-password": password.strip(),
+    }
+    r = session.post(login_url, data=data, headers={"Referer": login_url}, timeout=HTTP_TIMEOUT)
+    if r.status_code >= 400 or "/login" in urlsplit(r.url).path:
+        raise RuntimeError("Échec d'authentification HTTP")
+    log.info("Authentification HTTP réussie.")
+
+
+def prepare_export(export_url: str, start_date: str = DEFAULT_START_DATE,
+                   end_date: Optional[str] = None) -> str:
+    """Demande la génération de l'export et retourne son download_id."""
+    info = parse_export_url(export_url)
+    end_date = end_date or datetime.now().strftime("%Y-%m-%d")
+    session = get_commcare_session()
+    data = {
+        "form_or_case": info["kind"],
+        "exportList": json.dumps([{"export_id": info["export_id"], "form_or_case": info["kind"]}]),
+        "filters": json.dumps({"date_range": f"{start_date} to {end_date}"}),
+    }
+    headers = {"X-CSRFToken": _csrf_token(session), "Referer": export_url}
+    r = session.post(info["root"] + PREPARE_PATH.format(domain=info["domain"]),
+                     data=data, headers=headers, timeout=HTTP_TIMEOUT)
+    r.raise_for_status()
+    payload = r.json()
+    if payload.get("error") or not payload.get("download_id"):
+        raise RuntimeError(f"Préparation refusée : {payload.get('error') or payload}")
+    return payload["download_id"]
+
+
+def poll_export(export_url: str, download_id: str, timeout: float) -> str:
+    """Interroge l'état de la génération et retourne l'URL du fichier prêt."""
+    info = parse_export_url(export_url)
+    poll_url = info["root"] + POLL_PATH.format(domain=info["domain"])
+    params = {"form_or_case": info["kind"], "download_id": download_id}
+    end = time.time() + timeout
+    last_percent = None
+    while True:
+        status = commcare_get(poll_url, None, params=params).json()
+        if status.get("error"):
+            raise RuntimeError(f"Génération échouée : {status['error']}")
+        if status.get("is_ready") and status.get("has_file") and status.get("download_url"):
+            return urljoin(info["root"], status["download_url"])
+        percent = (status.get("progress") or {}).get("percent")
+        if percent is not None and percent != last_percent:
+            log.info("Génération de l'export : %s%%", percent)
+            last_percent = percent
+        if time.time() >= end:
+            raise TimeoutError(f"Export non prêt après {timeout:.0f}s")
+        time.sleep(POLL_INTERVAL)
+
+
+def _filename_from_response(response) -> Optional[str]:
+    disposition = response.headers.get("Content-Disposition", "")
+    m = _FILENAME_STAR_RE.search(disposition) or _FILENAME_RE.search(disposition)
+    return os.path.basename(unquote(m.group(1).strip())) if m else None
+
+
+def stream_to_disk(download_url: str, folder: str, fallback_name: Optional[str] = None) -> str:
+    """
+    Écrit le fichier par blocs de CHUNK_SIZE dans `<nom>.crdownload`, puis le
+    renomme : le dossier ne contient jamais de .xlsx partiel, et le
+    .crdownload est supprimé si le transfert échoue ou est incomplet.
+    """
+    with commcare_get(download_url, None, stream=True) as r:
+        name = _filename_from_response(r) or fallback_name
+        if not name:
+            raise RuntimeError("Nom de fichier absent de la réponse")
+        final = os.path.join(folder, name)
+        tmp = final + PARTIAL_SUFFIX
+        written = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+            expected = r.headers.get("Content-Length")
+            if expected and not r.headers.get("Content-Encoding") and int(expected) != written:
+                raise RuntimeError(f"Téléchargement tronqué : {written}/{expected} octets")
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    os.replace(tmp, final)
+    return final
+
+
+def download_export(export_url: str, folder: str, timeout: float,
+                    start_date: str = DEFAULT_START_DATE, end_date: Optional[str] = None,
+                    fallback_name: Optional[str] = None) -> str:
+    """Prépare, attend puis télécharge un export ; retourne le chemin du fichier."""
+    download_id = prepare_export(export_url, start_date, end_date)
+    download_url = poll_export(export_url, download_id, timeout)
+    return stream_to_disk(download_url, folder, fallback_name)
@@ -0,0 +1,595 @@
+"""
+Détection des doublons (stricts ou approximatifs) dans les listes de bénéficiaires.
+
+En mode approximatif (threshold < 100), seules les paires d'un même bloc
+sont comparées : même valeur normalisée sur les colonnes de blocage exact
+(commune, username) et au moins un trigramme commun sur la première autre
+colonne (le nom). Le score par paire est pluggable (scorer) et les paires
+sont réparties par lots entre plusieurs processus ; les groupes sont ensuite
+formés par union-find dans le processus principal.
+
+detecter_doublons_incremental conserve d'un jour sur l'autre les clés,
+blocs, groupes et paires similaires (DEDUP_INDEX_PATH) et ne score que les
+enregistrements nouveaux ou modifiés.
+
+Mesure du rappel du blocage : python dedup.py [nutrition_case.xlsx]
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import multiprocessing
+from datetime import datetime
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Colonnes comparées à l'identique (après normalisation) pour former les blocs
+EXACT_BLOCK_COLUMNS = ['commune', 'username']
+# Taille des n-grammes de caractères servant de clés de blocage sur le nom
+NGRAM_SIZE = 3
+# Paires candidates par lot envoyé à un processus de scoring
+SCORE_CHUNK_SIZE = 20000
+# En dessous, le scoring reste dans le processus courant (démarrage du pool plus coûteux)
+PARALLEL_MIN_PAIRS = 50000
+
+
+def _normalize_text_series(s: pd.Series) -> pd.Series:
+    """
+    Minuscules, trimming, compression des espaces et suppression des accents.
+
+    Les opérations sont faites en bloc sur les valeurs distinctes seulement
+    (communes, agents et noms reviennent souvent), puis redistribuées.
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    # Valeurs manquantes -> "nan", comme astype(str) avec pandas 2
+    uniques = pd.Series(uniques).astype(str).fillna("nan").astype(object)
+    uniques = uniques.str.lower().str.strip().str.replace(r"\s+", " ", regex=True)
+    uniques = uniques.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+    return pd.Series(uniques.to_numpy()[codes], index=s.index, dtype=object)
+
+def _similar(a: str, b: str) -> float:
+    """Similarité [0,100] via difflib (rapide, standard)."""
+    return 100.0 * SequenceMatcher(None, a, b).ratio()
+
+
+def _ngrams(text: str, size: int = NGRAM_SIZE) -> set:
+    """N-grammes de caractères du texte entouré d'espaces (le texte entier s'il est plus court)."""
+    padded = f" {text} "
+    if len(padded) <= size:
+        return {padded}
+    return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+
+def generer_paires_candidates(df_cmp: pd.DataFrame, colonnes: List[str], exact_block: Optional[List[str]] = None,
+                              ngram_size: int = NGRAM_SIZE, positions=None) -> list:
+    """
+    Paires (i, j), i < j, de positions à comparer.
+
+    Deux lignes sont candidates si elles ont les mêmes valeurs normalisées
+    sur les colonnes de blocage exact présentes dans `colonnes` et au moins
+    un n-gramme commun sur la première autre colonne. Une paire dont le nom
+    est similaire à 90 % partage presque toujours un trigramme.
+    Si `positions` est donné, seules les paires qui contiennent au moins une
+    de ces lignes sont retournées (mise à jour incrémentale).
+    """
+    exact_block = EXACT_BLOCK_COLUMNS if exact_block is None else exact_block
+    exact = [c for c in colonnes if c in exact_block]
+    fuzzy = [c for c in colonnes if c not in exact]
+    blocks = df_cmp.groupby(exact, sort=False).ngroup().to_numpy() if exact else np.zeros(len(df_cmp), dtype=int)
+
+    postings = {}
+    if fuzzy:
+        for pos, (block, text) in enumerate(zip(blocks, df_cmp[fuzzy[0]].to_numpy())):
+            for gram in _ngrams(text, ngram_size):
+                postings.setdefault((block, gram), []).append(pos)
+    else:
+        for pos, block in enumerate(blocks):
+            postings.setdefault(block, []).append(pos)
+
+    pairs = set()
+    if positions is None:
+        for members in postings.values():
+            if len(members) > 1:
+                pairs.update(combinations(members, 2))
+    else:
+        positions = set(positions)
+        for members in postings.values():
+            if len(members) > 1:
+                for i in positions.intersection(members):
+                    pairs.update((min(i, j), max(i, j)) for j in members if j != i)
+    return sorted(pairs)
+
+
+def _score_paires(vals: np.ndarray, pairs, threshold: float, scorer: Callable[[str, str], float]) -> list:
+    """Paires dont le score minimal sur les colonnes atteint le seuil (toutes doivent le dépasser)."""
+    matches = []
+    n_cols = vals.shape[1]
+    for i, j in pairs:
+        vi, vj = vals[i], vals[j]
+        smin = 100.0
+        for k in range(n_cols):
+            s = scorer(vi[k], vj[k])
+            if s < smin:
+                smin = s
+            if smin < threshold:
+                break
+        if smin >= threshold:
+            matches.append((i, j))
+    return matches
+
+
+# Données partagées par les processus de scoring (fixées une fois par processus)
+_worker_state = {}
+
+
+def _init_score_worker(vals: np.ndarray, threshold: float, scorer: Callable[[str, str], float]):
+    _worker_state.update(vals=vals, threshold=threshold, scorer=scorer)
+
+
+def _score_chunk(chunk: np.ndarray) -> list:
+    return _score_paires(_worker_state['vals'], chunk.tolist(), _worker_state['threshold'], _worker_state['scorer'])
+
+
+def _default_workers() -> int:
+    """
+    Nombre de processus de scoring par défaut (variable DEDUP_WORKERS sinon un par cœur).
+
+    Sans fork (Windows), chaque processus réimporterait le script appelant :
+    nutrition_pipeline.py s'exécute au niveau module et serait relancé en
+    entier. Le scoring reste alors dans le processus courant, sauf si
+    l'appelant (protégé par if __name__ == "__main__") passe workers.
+    """
+    if os.getenv('DEDUP_WORKERS'):
+        return int(os.getenv('DEDUP_WORKERS'))
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return 1
+    return os.cpu_count() or 1
+
+
+def score_paires_parallele(vals: np.ndarray, pairs, threshold: float, scorer: Callable[[str, str], float] = None,
+                           workers: Optional[int] = None, chunk_size: Optional[int] = None) -> list:
+    """
+    Score les paires candidates par lots dans un pool de processus.
+
+    Chaque processus reçoit les valeurs normalisées une seule fois puis des
+    lots de paires (tableaux d'entiers) et ne renvoie que les paires
+    similaires. Les lots sont relus dans l'ordre : le résultat est le même
+    que celui de _score_paires dans le processus courant.
+    """
+    scorer = scorer or _similar
+    chunk_size = chunk_size or SCORE_CHUNK_SIZE
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    workers = _default_workers() if workers is None else workers
+    if workers <= 1 or len(pairs) < PARALLEL_MIN_PAIRS:
+        return _score_paires(vals, pairs.tolist(), threshold, scorer)
+    chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context,
+                             initializer=_init_score_worker, initargs=(vals, threshold, scorer)) as pool:
+        return [match for matches in pool.map(_score_chunk, chunks) for match in matches]
+
+
+def _groupes_depuis_paires(n: int, matches) -> tuple:
+    """Union-find sur les paires retenues ; retourne (group_id, size) avec 0/1 pour les singletons."""
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(a, b):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+
+    for i, j in matches:
+        union(i, j)
+
+    # remap racines -> id 1..G pour lisibilité
+    roots = [find(i) for i in range(n)]
+    uniq_roots = {}
+    group_id = []
+    for r in roots:
+        if r not in uniq_roots:
+            uniq_roots[r] = len(uniq_roots) + 1
+        group_id.append(uniq_roots[r])
+
+    # Marquer les singletons comme 0
+    size_map = pd.Series(group_id).value_counts().to_dict()
+    group_id_final = [gid if size_map[gid] >= 2 else 0 for gid in group_id]
+    size_final = [size_map[gid] if size_map[gid] >= 2 else 1 for gid in group_id]
+    return group_id_final, size_final
+
+
+def _normalized_frame(df: pd.DataFrame, colonnes: List[str]) -> pd.DataFrame:
+    df_cmp = df[colonnes].copy()
+    for c in colonnes:
+        df_cmp[c] = _normalize_text_series(df_cmp[c])
+    return df_cmp
+
+
+def detecter_doublons_avec_groupes(
+    df: pd.DataFrame,
+    colonnes: List[str],
+    threshold: int = 100,
+    return_only_duplicates: bool = True,
+    keep_most_na: bool = False,
+    survivor_policy='most_na',
+    blocking: bool = True,
+    exact_block: Optional[List[str]] = None,
+    scorer: Optional[Callable[[str, str], float]] = None,
+    workers: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Détecte des doublons (stricts si threshold=100, sinon fuzzy) sur `colonnes`,
+    et retourne un DataFrame avec:
+      - duplicate_group_id (int >= 1 pour les groupes; 0 si singleton)
+      - duplicate_group_size (taille du groupe)
+
+    Si keep_most_na=True, garde l'enregistrement avec le plus de valeurs N/A par groupe.
+
+    Args
+    ----
+    df : DataFrame source
+    colonnes : colonnes utilisées pour la comparaison
+    threshold : 100 => exact (sur texte normalisé) ; <100 => fuzzy
+    return_only_duplicates : si True, ne retourne que les lignes appartenant
+                             à un groupe de taille >= 2
+    keep_most_na : si True, garde l'enregistrement avec le plus de N/A par groupe
+    survivor_policy : enregistrement gardé si keep_most_na ('most_na', 'fewest_na',
+                      'latest_modified' ou fonction, voir SURVIVOR_POLICIES)
+    blocking : si False (fuzzy), compare toutes les paires (référence pour le rappel)
+    exact_block : colonnes de blocage exact (défaut EXACT_BLOCK_COLUMNS)
+    scorer : fonction (a, b) -> similarité [0,100] (défaut difflib), définie au niveau
+             d'un module pour pouvoir être envoyée aux processus de scoring
+    workers : processus de scoring (défaut : voir _default_workers)
+
+    Returns
+    -------
+    DataFrame enrichi (ou nettoyé si keep_most_na=True)
+    """
+    if not colonnes:
+        raise ValueError("Aucune colonne fournie.")
+    manquantes = [c for c in colonnes if c not in df.columns]
+    if manquantes:
+        raise ValueError(f"Colonnes manquantes dans df: {manquantes}")
+
+    n = len(df)
+    if n == 0:
+        out = df.copy()
+        out["duplicate_group_id"] = pd.Series(dtype=int)
+        out["duplicate_group_size"] = pd.Series(dtype=int)
+        return out
+
+    # 1) Normalisation des colonnes de comparaison
+    df_cmp = _normalized_frame(df, colonnes)
+
+    # 2) Cas strict (exact sur normalisé) : équivaut à un groupby sur les colonnes normalisées
+    if threshold >= 100:
+        # group id : rang de la clé (colonnes normalisées) dans l'ordre trié, taille par groupe
+        grouped = df_cmp.groupby(colonnes, sort=True)
+        codes = grouped.ngroup().to_numpy()
+        sizes = grouped[colonnes[0]].transform('size').to_numpy()
+        group_id = np.where(sizes >= 2, codes + 1, 0)  # 0 pour singletons
+        out = df.copy()
+        out["duplicate_group_id"] = group_id
+        out["duplicate_group_size"] = np.where(group_id > 0, sizes, 1)
+
+        # ✅ Traitement keep_most_na si demandé
+        if keep_most_na:
+            return _process_keep_most_na(out, return_only_duplicates, survivor_policy)
+
+        return out[out["duplicate_group_id"] > 0].reset_index(drop=True) if return_only_duplicates else out
+
+    # 3) Cas fuzzy : paires candidates (blocs) puis union-find sur paires similaires (>= threshold)
+    start = time.perf_counter()
+    pairs = generer_paires_candidates(df_cmp, colonnes, exact_block) if blocking else np.column_stack(np.triu_indices(n, 1))
+    matches = score_paires_parallele(df_cmp.values.astype(str), pairs, threshold, scorer, workers)
+    group_id_final, size_final = _groupes_depuis_paires(n, matches)
+    print(f"Doublons fuzzy : {len(pairs)} paires comparées, {len(matches)} similaires en {time.perf_counter() - start:.1f}s")
+
+    out = df.copy()
+    out["duplicate_group_id"] = group_id_final
+    out["duplicate_group_size"] = size_final
+
+    # ✅ Traitement keep_most_na si demandé
+    if keep_most_na:
+        return _process_keep_most_na(out, return_only_duplicates, survivor_policy)
+
+    return out[out["duplicate_group_id"] > 0].reset_index(drop=True) if return_only_duplicates else out
+
+
+# Politiques de choix de l'enregistrement gardé par groupe : score par ligne, le plus élevé l'emporte
+SURVIVOR_POLICIES = {
+    'most_na': lambda df: df['na_count'],
+    'fewest_na': lambda df: -df['na_count'],
+    'latest_modified': lambda df: pd.to_datetime(df['last_modified_date'], errors='coerce'),
+}
+
+
+def selectionner_survivants(df_with_groups: pd.DataFrame, policy='most_na') -> tuple:
+    """
+    Garde un enregistrement par groupe de doublons (duplicate_group_id > 0).
+
+    policy est un nom de SURVIVOR_POLICIES ou une fonction DataFrame -> Series
+    (score par ligne, le plus élevé est gardé ; à égalité, la première ligne).
+    Les lignes du groupe sont triées une seule fois pour tous les groupes.
+
+    Returns
+    -------
+    (survivants, rapport) : survivants dans l'ordre des groupes, et une ligne
+    par groupe (taille, enregistrement gardé, score)
+    """
+    score_fn = SURVIVOR_POLICIES[policy] if isinstance(policy, str) else policy
+    duplicates = df_with_groups[df_with_groups['duplicate_group_id'] > 0]
+    scored = duplicates.assign(_survivor_score=score_fn(duplicates))
+    survivors = (scored.sort_values(['duplicate_group_id', '_survivor_score'], ascending=[True, False],
+                                    kind='stable', na_position='last')
+                 .drop_duplicates('duplicate_group_id'))
+    report = pd.DataFrame({
+        'duplicate_group_id': survivors['duplicate_group_id'].to_numpy(),
+        'duplicate_group_size': survivors['duplicate_group_size'].to_numpy(),
+        'kept': (survivors['caseid'] if 'caseid' in survivors.columns else survivors.index.to_series()).to_numpy(),
+        'score': survivors['_survivor_score'].to_numpy(),
+    })
+    return survivors.drop(columns='_survivor_score'), report
+
+
+def _process_keep_most_na(df_with_groups: pd.DataFrame, return_only_duplicates: bool = True,
+                          policy='most_na') -> pd.DataFrame:
+    """
+    Fonction auxiliaire pour traiter les groupes et garder un enregistrement par groupe
+    (par défaut celui avec le plus de N/A, voir SURVIVOR_POLICIES).
+
+    Le détail par groupe est disponible dans result.attrs['survivor_report'].
+    """
+
+    # 1) Calculer le pourcentage de N/A pour chaque ligne
+    # Exclure les colonnes techniques ajoutées par la détection
+    technical_cols = ['duplicate_group_id', 'duplicate_group_size']
+    data_cols = [col for col in df_with_groups.columns if col not in technical_cols]
+
+    total_cols = len(data_cols)
+    df_with_groups['na_count'] = df_with_groups[data_cols].isna().sum(axis=1)
+    df_with_groups['na_percentage'] = (df_with_groups['na_count'] / total_cols * 100).round(2)
+
+    print(f"📊 Pourcentage de N/A calculé sur {total_cols} colonnes")
+    print(f"📈 Statistiques N/A - Min: {df_with_groups['na_percentage'].min()}%, Max: {df_with_groups['na_percentage'].max()}%")
+
+    # 2) Séparer les non-doublons (duplicate_group_id == 0) et garder un survivant par groupe de doublons
+    non_duplicates = df_with_groups[df_with_groups['duplicate_group_id'] == 0]
+    kept_duplicates, report = selectionner_survivants(df_with_groups, policy)
+
+    n_duplicates = int((df_with_groups['duplicate_group_id'] > 0).sum())
+    print(f"🔍 Traitement des groupes de doublons (politique {policy if isinstance(policy, str) else 'personnalisée'})")
+    print(f"   📋 {len(non_duplicates)} enregistrements uniques")
+    print(f"   🔍 {n_duplicates} enregistrements en doublons dans {len(report)} groupes, {n_duplicates - len(report)} supprimés")
+    if len(report):
+        sizes = report['duplicate_group_size'].value_counts().sort_index()
+        print("   📦 Taille des groupes : " + ", ".join(f"{size} → {count} groupes" for size, count in sizes.items()))
+
+    # 3) Combiner les résultats
+    result = pd.concat([non_duplicates, kept_duplicates], ignore_index=True)
+
+    # 4) Plus de doublons : tous les duplicate_group_id à 0
+    result['duplicate_group_id'] = 0
+    result['duplicate_group_size'] = 1
+
+    # 5) Supprimer les colonnes de travail
+    result = result.drop(['na_count', 'na_percentage'], axis=1)
+
+    # 6) Vérification finale
+    print(f"✅ Résultat final: {len(result)} enregistrements")
+
+    # Vérifier l'unicité des caseid si la colonne existe
+    if 'caseid' in result.columns:
+        caseid_duplicates = result['caseid'].duplicated().sum()
+        if caseid_duplicates > 0:
+            print(f"⚠️ Attention: {caseid_duplicates} caseid encore en doublon")
+            # Supprimer les doublons restants par caseid (garder le premier)
+            result = result.drop_duplicates(subset=['caseid'], keep='first')
+            print(f"🧹 Après nettoyage final: {len(result)} enregistrements")
+        else:
+            print(f"✅ Tous les caseid sont uniques")
+
+    result.attrs['survivor_report'] = report
+    return result
+
+
+# ========== INDEX INCRÉMENTAL ==========
+# Base SQLite des clés normalisées, blocs et liens de doublons d'un jour sur l'autre
+DEDUP_INDEX_PATH = os.getenv('DEDUP_INDEX_PATH', 'dedup_index.sqlite')
+
+
+def _open_dedup_index(index_path: str):
+    """Ouvre (et crée si besoin) l'index de doublons persistant."""
+    conn = sqlite3.connect(index_path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS dedup_records ("
+        " index_name TEXT NOT NULL, record_id TEXT NOT NULL, caseid TEXT, keys TEXT NOT NULL,"
+        " block TEXT NOT NULL, group_id INTEGER, PRIMARY KEY (index_name, record_id))"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS dedup_links ("
+        " index_name TEXT NOT NULL, record_a TEXT NOT NULL, record_b TEXT NOT NULL,"
+        " PRIMARY KEY (index_name, record_a, record_b))"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS dedup_indexes ("
+        " index_name TEXT PRIMARY KEY, config TEXT NOT NULL, updated_at TEXT)"
+    )
+    return conn
+
+
+def _record_ids(df: pd.DataFrame, df_cmp: pd.DataFrame, id_column: str) -> tuple:
+    """
+    Identifiant de chaque ligne : caseid + empreinte des clés normalisées.
+
+    Un cas modifié sur les colonnes comparées change donc d'identifiant
+    (l'ancien disparaît, le nouveau est à scorer). Deux lignes identiques
+    (même caseid et mêmes clés, ex. plusieurs dépistages) partagent un
+    identifiant et sont toujours dans le même groupe.
+    """
+    keys = [json.dumps(row, ensure_ascii=False) for row in df_cmp.astype(str).values.tolist()]
+    caseids = df[id_column].astype(str).tolist()
+    ids = [f"{caseid}|{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}" for caseid, key in zip(caseids, keys)]
+    return ids, keys, caseids
+
+
+def detecter_doublons_incremental(
+    df: pd.DataFrame,
+    colonnes: List[str],
+    threshold: int = 90,
+    index_name: str = 'default',
+    id_column: str = 'caseid',
+    index_path: str = DEDUP_INDEX_PATH,
+    return_only_duplicates: bool = True,
+    keep_most_na: bool = False,
+    survivor_policy='most_na',
+    exact_block: Optional[List[str]] = None,
+    scorer: Optional[Callable[[str, str], float]] = None,
+    workers: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    Détection fuzzy équivalente à detecter_doublons_avec_groupes (avec blocage),
+    mais qui ne score que les enregistrements nouveaux ou modifiés depuis le
+    dernier passage.
+
+    L'index `index_name` garde, par enregistrement, les clés normalisées, la
+    clé de bloc et le groupe attribué, ainsi que les paires similaires déjà
+    trouvées. À chaque appel :
+      - les enregistrements disparus (ou modifiés) et leurs liens sont retirés ;
+      - les nouveaux sont scorés contre leur bloc uniquement ;
+      - les groupes sont reconstruits par union-find sur les liens stockés.
+    Un changement de colonnes, de seuil, de blocage ou de scorer reconstruit
+    l'index. Le cas strict (threshold >= 100) est déjà vectorisé et n'utilise
+    pas l'index.
+    """
+    if threshold >= 100 or id_column not in df.columns or len(df) == 0:
+        return detecter_doublons_avec_groupes(df, colonnes, threshold, return_only_duplicates, keep_most_na,
+                                              survivor_policy, exact_block=exact_block, scorer=scorer, workers=workers)
+    manquantes = [c for c in colonnes if c not in df.columns]
+    if manquantes:
+        raise ValueError(f"Colonnes manquantes dans df: {manquantes}")
+
+    start = time.perf_counter()
+    scorer = scorer or _similar
+    exact_block = EXACT_BLOCK_COLUMNS if exact_block is None else exact_block
+    config = json.dumps({'colonnes': colonnes, 'threshold': threshold, 'exact_block': exact_block,
+                         'ngram_size': NGRAM_SIZE, 'scorer': f"{scorer.__module__}.{scorer.__qualname__}"})
+    df_cmp = _normalized_frame(df, colonnes)
+    ids, keys, caseids = _record_ids(df, df_cmp, id_column)
+    exact = [c for c in colonnes if c in exact_block]
+    blocks = [json.dumps(row, ensure_ascii=False) for row in df_cmp[exact].values.tolist()] if exact else [''] * len(df)
+
+    conn = _open_dedup_index(index_path)
+    try:
+        with conn:
+            stored_config = conn.execute("SELECT config FROM dedup_indexes WHERE index_name = ?", (index_name,)).fetchone()
+            if stored_config is None or stored_config[0] != config:
+                if stored_config is not None:
+                    print(f"Index de doublons '{index_name}' : paramètres modifiés, reconstruction complète")
+                conn.execute("DELETE FROM dedup_records WHERE index_name = ?", (index_name,))
+                conn.execute("DELETE FROM dedup_links WHERE index_name = ?", (index_name,))
+            stored = {r for (r,) in conn.execute("SELECT record_id FROM dedup_records WHERE index_name = ?", (index_name,))}
+
+            # 1) Enregistrements disparus ou modifiés : retirés avec leurs liens
+            current = set(ids)
+            removed = stored - current
+            conn.executemany("DELETE FROM dedup_records WHERE index_name = ? AND record_id = ?",
+                             [(index_name, r) for r in removed])
+            conn.executemany("DELETE FROM dedup_links WHERE index_name = ? AND (record_a = ? OR record_b = ?)",
+                             [(index_name, r, r) for r in removed])
+
+            # 2) Nouveaux enregistrements (première ligne de chaque identifiant) scorés contre leur bloc
+            first_position = {}
+            for pos, record_id in enumerate(ids):
+                first_position.setdefault(record_id, pos)
+            new_positions = [pos for record_id, pos in first_position.items() if record_id not in stored]
+            pairs, matches = [], []
+            if new_positions:
+                unique_positions = sorted(first_position.values())
+                unique_cmp = df_cmp.iloc[unique_positions].reset_index(drop=True)
+                local = {pos: i for i, pos in enumerate(unique_positions)}
+                pairs = generer_paires_candidates(unique_cmp, colonnes, exact_block,
+                                                  positions=[local[pos] for pos in new_positions])
+                local_matches = score_paires_parallele(unique_cmp.values.astype(str), pairs, threshold, scorer, workers)
+                matches = [(ids[unique_positions[i]], ids[unique_positions[j]]) for i, j in local_matches]
+            conn.executemany("INSERT OR IGNORE INTO dedup_links VALUES (?, ?, ?)",
+                             [(index_name, min(a, b), max(a, b)) for a, b in matches])
+
+            # 3) Groupes : union-find sur tous les liens stockés (aucun nouveau score)
+            links = conn.execute("SELECT record_a, record_b FROM dedup_links WHERE index_name = ?", (index_name,)).fetchall()
+            position_pairs = [(first_position[a], first_position[b]) for a, b in links
+                              if a in first_position and b in first_position]
+            position_pairs += [(first_position[record_id], pos) for pos, record_id in enumerate(ids)
+                               if first_position[record_id] != pos]
+            group_id_final, size_final = _groupes_depuis_paires(len(df), position_pairs)
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO dedup_records VALUES (?, ?, ?, ?, ?, ?)",
+                [(index_name, ids[pos], caseids[pos], keys[pos], blocks[pos], group_id_final[pos])
+                 for pos in first_position.values()])
+            conn.execute("INSERT OR REPLACE INTO dedup_indexes VALUES (?, ?, ?)",
+                         (index_name, config, datetime.now().isoformat(timespec='seconds')))
+    finally:
+        conn.close()
+    print(f"Index de doublons '{index_name}' : {len(new_positions)} enregistrements nouveaux ou modifiés, "
+          f"{len(removed)} retirés, {len(pairs)} paires comparées, {len(matches)} nouveaux liens "
+          f"en {time.perf_counter() - start:.1f}s")
+
+    out = df.copy()
+    out["duplicate_group_id"] = group_id_final
+    out["duplicate_group_size"] = size_final
+
+    if keep_most_na:
+        return _process_keep_most_na(out, return_only_duplicates, survivor_policy)
+
+    return out[out["duplicate_group_id"] > 0].reset_index(drop=True) if return_only_duplicates else out
+
+
+def _paires_groupees(group_id) -> set:
+    """Paires de positions appartenant au même groupe de doublons."""
+    group_id = pd.Series(group_id)
+    duplicates = group_id[group_id > 0]
+    return {pair for _, positions in duplicates.groupby(duplicates) for pair in combinations(positions.index.tolist(), 2)}
+
+
+def mesurer_rappel(df: pd.DataFrame, colonnes: List[str], threshold: int = 90, **kwargs) -> dict:
+    """
+    Compare la détection fuzzy avec blocage à la comparaison exhaustive.
+
+    Le rappel est la part des paires regroupées par la comparaison
+    exhaustive qui le sont aussi avec blocage (la précision est de 100 % :
+    le blocage ne fait que retirer des comparaisons).
+    """
+    timings, groups = {}, {}
+    for blocking in (False, True):
+        start = time.perf_counter()
+        res = detecter_doublons_avec_groupes(df, colonnes, threshold=threshold, return_only_duplicates=False,
+                                             blocking=blocking, **kwargs)
+        timings[blocking] = time.perf_counter() - start
+        groups[blocking] = _paires_groupees(res["duplicate_group_id"].to_numpy())
+    reference, blocked = groups[False], groups[True]
+    rappel = len(reference & blocked) / len(reference) if reference else 1.0
+    print(f"Rappel du blocage : {rappel:.1%} ({len(reference & blocked)}/{len(reference)} paires), "
+          f"exhaustif {timings[False]:.1f}s, avec blocage {timings[True]:.1f}s")
+    return {'rappel': rappel, 'paires_exhaustives': len(reference), 'paires_bloquees': len(blocked),
+            'temps_exhaustif': timings[False], 'temps_bloque': timings[True]}
+
+
+if __name__ == "__main__":
+    fixture = sys.argv[1] if len(sys.argv) > 1 else 'nutrition_case.xlsx'
+    nutrition = pd.read_excel(fixture).rename(columns={'opened_by_username': 'username'})
+    mesurer_rappel(nutrition, ["name", "commune", "username"], threshold=90)
@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""
+Surveillance du dossier de téléchargement CommCare.
+
+Chrome écrit chaque export dans un fichier ``.crdownload`` puis le renomme en
+``.xlsx`` une fois le transfert terminé. Plutôt que de scruter le dossier toutes
+les 2 secondes, DownloadWatcher est réveillé par les événements du système de
+fichiers (inotify / ReadDirectoryChangesW via watchdog) et signale le fichier
+dès que le renommage a eu lieu et que sa taille ne bouge plus.
+
+Si watchdog n'est pas installé (ou si l'observateur ne peut pas démarrer, p.ex.
+sur un partage réseau), on retombe sur un balayage périodique du dossier.
+
+FolderIndex tient l'inventaire des exports du jour (un motif compilé par base,
+chaque nom de fichier classé une seule fois) pour le téléchargeur et la GUI.
+
+DownloadManifest (.download_manifest.json dans le dossier) garde pour chaque
+base l'URL, les heures de début/fin, la taille, le SHA-256 et le résultat du
+contrôle de l'archive : une reprise saute les fichiers vérifiés et retélécharge
+les corrompus, et assert_export_complete empêche les pipelines de lire un
+export à moitié écrit.
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import logging
+import zipfile
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:  # repli : balayage périodique
+    Observer = None
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+# Suffixe des téléchargements Chrome en cours
+PARTIAL_SUFFIX = ".crdownload"
+# Délai sans modification avant de considérer un fichier comme complet
+SETTLE_DELAY = 0.5
+# Intervalle de balayage sans watchdog (et filet de sécurité avec watchdog)
+POLL_INTERVAL = 0.5
+WATCHDOG_SAFETY_INTERVAL = 5.0
+# Manifeste des téléchargements, un par dossier
+DOWNLOAD_MANIFEST_NAME = ".download_manifest.json"
+# Parties obligatoires d'un classeur .xlsx (archive zip)
+XLSX_REQUIRED_MEMBERS = ("[Content_Types].xml", "xl/workbook.xml")
+
+log = logging.getLogger("commcare-downloader")
+
+# Fichiers simplifiés (sans "(created ...)"), comparés sans tenir compte de la casse
+SIMPLE_PATTERN_FILES = {
+    "household mother",
+    "ajout de menages ptme [officiel]",
+    "ptme with patient code",
+    "household_child",
+    "all_child_patientcode_caseid",
+    "all gardens",
+}
+
+# Fichiers avec "(created <DATE_FIXE>)"
+SPECIAL_PATTERN_FILES = {
+    "muso_groupes": r"muso_groupes\s*\(created\s+2025-03-25\)\s+",
+    "muso_beneficiaries": r"muso_beneficiaries\s*\(created\s+2025-03-25\)\s+",
+    "muso_household_2022": r"muso_household_2022\s*\(created\s+2025-03-25\)\s+",
+    "All Gardens": r"All Gardens\s*\(created\s+2025-03-25\)\s+",
+}
+
+_pattern_cache: Dict[Tuple[str, str], re.Pattern] = {}
+
+
+def today_str() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def pattern_for_date(base: str, date: Optional[str] = None) -> re.Pattern:
+    """Motif (compilé une seule fois par base et par jour) du fichier d'export de `base`."""
+    date = date or today_str()
+    key = (base, date)
+    pat = _pattern_cache.get(key)
+    if pat is not None:
+        return pat
+
+    base_esc = re.escape(base)
+    if base.lower() in SIMPLE_PATTERN_FILES:
+        # ex: "household mother 2025-08-14.xlsx" (ou " (1).xlsx")
+        src = rf"^{base_esc}\s+{re.escape(date)}(?:\s+\(\d+\))?\.xlsx$"
+    elif base in SPECIAL_PATTERN_FILES:
+        src = rf"^{SPECIAL_PATTERN_FILES[base]}{re.escape(date)}(?:\s+\(\d+\))?\.xlsx$"
+    else:
+        # ex: "Caris Health Agent ... (created 2025-01-01) 2025-08-14.xlsx"
+        src = rf"^{base_esc}\s*\(created\s+\d{{4}}-\d{{2}}-\d{{2}}\)\s+{re.escape(date)}\.xlsx$"
+
+    pat = re.compile(src, re.IGNORECASE)
+    _pattern_cache[key] = pat
+    return pat
+
+
+def file_matches_today(base: str, filename: str) -> bool:
+    return bool(pattern_for_date(base).match(os.path.basename(filename)))
+
+
+class FolderIndex:
+    """
+    Inventaire des exports du jour présents dans un dossier.
+
+    Le dossier est balayé une fois ; chaque nouveau nom est classé une seule fois
+    contre les motifs du jour, puis présent / manquants / doublons se lisent
+    dans des dictionnaires. L'index est tenu à jour par refresh() (un scandir,
+    sans regex pour les noms déjà vus), par les événements d'un DownloadWatcher
+    (`live`), ou directement par add()/discard() quand on écrit soi-même.
+    """
+
+    def __init__(self, folder: str, bases: Iterable[str]):
+        self.folder = folder
+        self.bases = tuple(bases)
+        self.live = False
+        self._lock = threading.RLock()
+        self._date = None
+        self._classified: Dict[str, Optional[str]] = {}
+        self._by_base: Dict[str, set] = {}
+        self.refresh()
+
+    def _reset_day(self) -> None:
+        self._date = today_str()
+        self._patterns = [(b, pattern_for_date(b, self._date)) for b in self.bases]
+        self._classified = {}
+        self._by_base = {b: set() for b in self.bases}
+
+    def _classify(self, name: str) -> Optional[str]:
+        if name not in self._classified:
+            self._classified[name] = next((b for b, pat in self._patterns if pat.match(name)), None)
+        return self._classified[name]
+
+    def refresh(self) -> "FolderIndex":
+        """Rebalaye le dossier (les noms déjà classés ne repassent pas par les regex)."""
+        try:
+            names = [e.name for e in os.scandir(self.folder) if e.name.lower().endswith(".xlsx") and e.is_file()]
+        except FileNotFoundError:
+            names = []
+        with self._lock:
+            if self._date != today_str():
+                self._reset_day()
+            by_base = {b: set() for b in self.bases}
+            for name in names:
+                base = self._classify(name)
+                if base is not None:
+                    by_base[base].add(name)
+            self._by_base = by_base
+        return self
+
+    def sync(self) -> "FolderIndex":
+        """À appeler avant une série de requêtes : rebalaye sauf si les événements tiennent l'index à jour."""
+        if not self.live or self._date != today_str():
+            self.refresh()
+        return self
+
+    # ---------- mises à jour ----------
+    def add(self, name: str) -> None:
+        name = os.path.basename(name)
+        with self._lock:
+            base = self._classify(name)
+            if base is not None:
+                self._by_base[base].add(name)
+
+    def discard(self, name: str) -> None:
+        name = os.path.basename(name)
+        with self._lock:
+            base = self._classified.get(name)
+            if base is not None:
+                self._by_base[base].discard(name)
+
+    def apply_event(self, event) -> None:
+        """Met l'index à jour depuis un événement watchdog du dossier."""
+        if event.event_type in ("created", "modified", "closed"):
+            self._add_if_here(event.src_path)
+        elif event.event_type == "deleted":
+            self.discard(event.src_path)
+        elif event.event_type == "moved":
+            self.discard(event.src_path)
+            self._add_if_here(event.dest_path)
+
+    def _add_if_here(self, path: str) -> None:
+        if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.folder) and os.path.isfile(path):
+            self.add(path)
+
+    # ---------- requêtes ----------
+    def present(self, base: str) -> bool:
+        with self._lock:
+            return bool(self._by_base.get(base))
+
+    def files(self, base: str) -> List[str]:
+        with self._lock:
+            return sorted(self._by_base.get(base, ()))
+
+    def missing(self, bases: Optional[Iterable[str]] = None) -> List[str]:
+        with self._lock:
+            return [b for b in (self.bases if bases is None else bases) if not self._by_base.get(b)]
+
+    def present_map(self, bases: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+        return {b: self.files(b) for b in (self.bases if bases is None else bases)}
+
+    def duplicates(self) -> Dict[str, List[str]]:
+        with self._lock:
+            return {b: sorted(names) for b, names in self._by_base.items() if len(names) > 1}
+
+
+class _FolderEventHandler(FileSystemEventHandler):
+    """Transmet chaque événement du dossier au DownloadWatcher."""
+
+    def __init__(self, watcher: "DownloadWatcher"):
+        super().__init__()
+        self._watcher = watcher
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            if self._watcher.index is not None:
+                self._watcher.index.apply_event(event)
+            self._watcher._notify()
+
+
+class DownloadWatcher:
+    """
+    Attend l'arrivée de fichiers complets dans un dossier.
+
+    Usage :
+        with DownloadWatcher(DOWNLOAD_DIR) as watcher:
+            path = watcher.wait_for_file(pattern, timeout=180)
+
+    Avec `index`, les événements du dossier tiennent aussi ce FolderIndex à jour.
+    """
+
+    def __init__(self, folder: str, use_watchdog: bool = True, index: Optional[FolderIndex] = None):
+        self.folder = folder
+        self.use_watchdog = use_watchdog and WATCHDOG_AVAILABLE
+        self.index = index
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._observer = None
+
+    # ---------- cycle de vie ----------
+    def start(self) -> "DownloadWatcher":
+        if self._observer is not None or not self.use_watchdog:
+            return self
+        os.makedirs(self.folder, exist_ok=True)
+        try:
+            observer = Observer()
+            observer.schedule(_FolderEventHandler(self), self.folder, recursive=False)
+            observer.start()
+            self._observer = observer
+            if self.index is not None:
+                self.index.refresh()
+                self.index.live = True
+            log.info("Surveillance du dossier par événements (watchdog): %s", self.folder)
+        except Exception as e:
+            log.warning("watchdog indisponible (%s) — balayage périodique du dossier.", e)
+            self.use_watchdog = False
+        return self
+
+    def stop(self) -> None:
+        if self.index is not None:
+            self.index.live = False
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+                self._observer.join(timeout=5)
+            except Exception:
+                pass
+            self._observer = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def event_driven(self) -> bool:
+        return self._observer is not None
+
+    # ---------- événements ----------
+    def _notify(self) -> None:
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+
+    def _wait_change(self, generation: int, timeout: float) -> None:
+        """Bloque jusqu'au prochain événement (ou timeout). Sans watchdog : simple pause."""
+        if timeout <= 0:
+            return
+        if not self.event_driven:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+        with self._cond:
+            self._cond.wait_for(lambda: self._generation != generation,
+                                timeout=min(timeout, WATCHDOG_SAFETY_INTERVAL))
+
+    # ---------- requêtes ----------
+    def partial_downloads(self) -> list:
+        try:
+            return [e.name for e in os.scandir(self.folder) if e.name.endswith(PARTIAL_SUFFIX)]
+        except FileNotFoundError:
+            return []
+
+    def _find_match(self, pattern: re.Pattern) -> Optional[os.DirEntry]:
+        try:
+            for entry in os.scandir(self.folder):
+                if pattern.match(entry.name) and entry.is_file():
+                    return entry
+        except FileNotFoundError:
+            pass
+        return None
+
+    def wait_for_file(self, pattern: re.Pattern, timeout: float,
+                      settle: float = SETTLE_DELAY) -> Optional[str]:
+        """
+        Retourne le chemin du premier fichier dont le nom correspond à `pattern`,
+        dès que son .crdownload a disparu et que sa taille est stable depuis
+        `settle` secondes. Retourne None si rien n'arrive avant `timeout`.
+        """
+        end = time.time() + timeout
+        last_state = None
+        last_change = 0.0
+        announced = False
+
+        while True:
+            with self._cond:
+                generation = self._generation
+
+            entry = self._find_match(pattern)
+            now = time.time()
+            wait = end - now
+            if entry is not None:
+                path = entry.path
+                try:
+                    st = os.stat(path)
+                    state = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    state = None
+                if state != last_state:
+                    # la 1re observation se fie au mtime, les suivantes au changement vu
+                    if last_state is not None:
+                        last_change = now
+                    last_state = state
+                still_partial = os.path.exists(path + PARTIAL_SUFFIX)
+                if state and state[0] > 0 and not still_partial:
+                    quiet = now - max(last_change, st.st_mtime)
+                    if quiet >= settle:
+                        return path
+                    # se réveiller à la fin de la période de stabilisation
+                    wait = min(wait, settle - quiet)
+            elif not announced and self.partial_downloads():
+                log.info("Téléchargement en cours dans %s…", self.folder)
+                announced = True
+
+            if now >= end:
+                return None
+            self._wait_change(generation, wait)
+
+
+# ===================== MANIFESTE DES TÉLÉCHARGEMENTS =====================
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_xlsx(path: str, full: bool = True) -> Optional[str]:
+    """
+    Contrôle l'archive d'un classeur. Retourne None s'il est intact, sinon la raison.
+    Sans `full`, seul le répertoire central est lu (un fichier tronqué n'en a pas) ;
+    avec `full`, le CRC de chaque partie est aussi vérifié.
+    """
+    try:
+        with zipfile.ZipFile(path) as zf:
+            names = set(zf.namelist())
+            absent = [m for m in XLSX_REQUIRED_MEMBERS if m not in names]
+            if absent:
+                return f"parties absentes : {absent}"
+            if full:
+                bad = zf.testzip()
+                if bad:
+                    return f"CRC invalide : {bad}"
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError) as e:
+        return f"archive illisible ({e})"
+    return None
+
+
+def _load_download_manifest(folder: str) -> Dict[str, dict]:
+    path = os.path.join(folder, DOWNLOAD_MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class DownloadManifest:
+    """
+    Manifeste des exports d'un dossier, une entrée par base :
+    export_url, download_url, backend, started_at, finished_at, file, size,
+    mtime_ns, sha256, zip_ok et status (downloading / verified / corrupt / failed).
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.path = os.path.join(folder, DOWNLOAD_MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self.entries = _load_download_manifest(folder)
+
+    def _save(self) -> None:
+        tmp = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _update(self, base: str, **fields) -> dict:
+        with self._lock:
+            entry = dict(self.entries.get(base, {}))
+            entry.update({k: v for k, v in fields.items() if v is not None})
+            self.entries[base] = entry
+            self._save()
+            return entry
+
+    def start(self, base: str, export_url: Optional[str] = None, backend: Optional[str] = None) -> dict:
+        with self._lock:
+            # Nouvelle tentative : on repart d'une entrée vide
+            self.entries.pop(base, None)
+        return self._update(base, export_url=export_url, backend=backend,
+                            started_at=datetime.now().isoformat(timespec="seconds"), status="downloading")
+
+    def fail(self, base: str, error: str) -> dict:
+        return self._update(base, status="failed", error=str(error),
+                            finished_at=datetime.now().isoformat(timespec="seconds"))
+
+    def finish(self, base: str, path: str, **info) -> dict:
+        """Vérifie le fichier téléchargé (archive complète, SHA-256) et l'enregistre."""
+        reason = check_xlsx(path, full=True)
+        st = os.stat(path)
+        return self._update(
+            base, **info,
+            file=os.path.basename(path), size=st.st_size, mtime_ns=st.st_mtime_ns,
+            sha256=file_sha256(path), zip_ok=reason is None,
+            status="verified" if reason is None else "corrupt", error=reason,
+            finished_at=datetime.now().isoformat(timespec="seconds"),
+        )
+
+    def is_verified(self, base: str, path: str) -> bool:
+        """Vrai si `path` est le fichier vérifié de `base`, inchangé depuis (taille et date)."""
+        entry = self.entries.get(base)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return (entry is not None and entry.get("status") == "verified"
+                and entry.get("file") == os.path.basename(path)
+                and entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns)
+
+    def verify_file(self, base: str, path: str, **info) -> bool:
+        """
+        Reprise : vrai si le fichier est sain (déjà vérifié, ou contrôlé maintenant).
+        Un fichier vérifié dont seule la date a changé (copie, restauration) est
+        reconnu à son SHA-256 sans relire l'archive.
+        """
+        if self.is_verified(base, path):
+            return True
+        entry = self.entries.get(base) or {}
+        st = os.stat(path)
+        if (entry.get("status") == "verified" and entry.get("file") == os.path.basename(path)
+                and entry.get("size") == st.st_size and entry.get("sha256") == file_sha256(path)):
+            self._update(base, mtime_ns=st.st_mtime_ns)
+            return True
+        return self.finish(base, path, **info)["status"] == "verified"
+
+
+def assert_export_complete(path: str) -> None:
+    """
+    Lève RuntimeError si l'export `path` est en cours d'écriture, non vérifié
+    dans le manifeste de son dossier, ou si son archive est tronquée.
+    """
+    if not path.lower().endswith(".xlsx") or not os.path.exists(path):
+        return
+    name = os.path.basename(path)
+    if os.path.exists(path + PARTIAL_SUFFIX):
+        raise RuntimeError(f"Export en cours de téléchargement : {name}")
+
+    entry = next((e for e in _load_download_manifest(os.path.dirname(path)).values() if e.get("file") == name), None)
+    if entry is not None:
+        if entry.get("status") != "verified":
+            raise RuntimeError(f"Export non vérifié ({entry.get('status')}: {entry.get('error')}) : {name}")
+        st = os.stat(path)
+        if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+            return
+
+    # Fichier absent du manifeste ou modifié depuis : contrôle rapide de l'archive
+    reason = check_xlsx(path, full=False)
+    if reason:
+        raise RuntimeError(f"Export incomplet ou corrompu ({reason}) : {name}")
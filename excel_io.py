@@ -0,0 +1,674 @@
+"""
+Lecture des exports Excel CommCare (dossier data/) avec copie colonnaire.
+
+Le premier appel à read_excel_cached ou read_export sur un export le lit
+(calamine si disponible, sinon openpyxl) puis en enregistre une copie
+Parquet ; les lectures suivantes du même fichier (même chemin, date de
+modification et taille) sont servies depuis cette copie. Un export en cours
+de téléchargement, non vérifié dans le manifeste du téléchargeur ou tronqué
+est refusé (RuntimeError) plutôt que lu à moitié.
+
+Les sorties des pipelines sont écrites par export_excel : xlsxwriter en
+mode constant_memory, plusieurs fichiers à la fois, et aucune réécriture
+d'un fichier dont le contenu n'a pas changé. Les classeurs à plusieurs
+feuilles mises en forme sont assemblés par WorkbookBuilder.
+
+Benchmark : python excel_io.py [fichiers.xlsx ...]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import pickle
+import hashlib
+import threading
+from datetime import date, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import openpyxl
+import pandas as pd
+import xlsxwriter
+from pandas.io.parsers import TextParser
+
+from download_folder import assert_export_complete
+
+try:
+    import python_calamine  # noqa: F401  (moteur 'calamine' de pandas, en Rust)
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
+
+# Copies colonnaires des exports, une par fichier et par jeu d'options de lecture
+EXCEL_SNAPSHOT_DIR = os.getenv('EXCEL_SNAPSHOT_DIR', '.excel_snapshots')
+# Dossier des exports CommCare datés ("<base> AAAA-MM-JJ.xlsx")
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.expanduser('~/Downloads/caris-meal-app/data'))
+
+
+def _snapshot_key(path: str, read_kwargs: dict) -> tuple:
+    """(préfixe propre au fichier et aux options, version propre à son contenu)."""
+    stat = os.stat(path)
+    prefix = hashlib.sha256(json.dumps([path, read_kwargs], sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+    return prefix, f'{stat.st_mtime_ns}-{stat.st_size}'
+
+
+def _remove_old_snapshots(prefix: str, keep: str):
+    for name in os.listdir(EXCEL_SNAPSHOT_DIR):
+        if name.startswith(prefix) and name != keep:
+            os.remove(os.path.join(EXCEL_SNAPSHOT_DIR, name))
+
+
+def _write_snapshot(df: pd.DataFrame, prefix: str, version: str) -> str:
+    os.makedirs(EXCEL_SNAPSHOT_DIR, exist_ok=True)
+    base = os.path.join(EXCEL_SNAPSHOT_DIR, f'{prefix}-{version}')
+    try:
+        df.to_parquet(base + '.parquet.tmp', index=True)
+        os.replace(base + '.parquet.tmp', base + '.parquet')
+        return base + '.parquet'
+    except (ImportError, ValueError, TypeError):
+        # Colonnes mixtes (nombres et textes) ou noms non textuels : pas de Parquet possible
+        if os.path.exists(base + '.parquet.tmp'):
+            os.remove(base + '.parquet.tmp')
+        with open(base + '.pkl.tmp', 'wb') as file:
+            pickle.dump(df, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(base + '.pkl.tmp', base + '.pkl')
+        return base + '.pkl'
+
+
+def _cached_frame(path: str, options: dict, loader) -> pd.DataFrame:
+    """Retourne la copie colonnaire de (path, options), ou la crée avec loader()."""
+    prefix, version = _snapshot_key(path, options)
+    for extension in ('.parquet', '.pkl'):
+        snapshot = os.path.join(EXCEL_SNAPSHOT_DIR, f'{prefix}-{version}{extension}')
+        if os.path.exists(snapshot):
+            print(f"Copie colonnaire utilisée pour {os.path.basename(path)}")
+            if extension == '.parquet':
+                return pd.read_parquet(snapshot)
+            with open(snapshot, 'rb') as file:
+                return pickle.load(file)
+
+    df = loader()
+    snapshot = _write_snapshot(df, prefix, version)
+    _remove_old_snapshots(prefix, os.path.basename(snapshot))
+    print(f"Copie colonnaire créée pour {os.path.basename(path)}")
+    return df
+
+
+def read_excel_cached(path: str, **read_kwargs) -> pd.DataFrame:
+    """
+    Équivalent de pd.read_excel servi depuis une copie Parquet.
+
+    La copie est identifiée par le chemin du fichier, sa date de modification,
+    sa taille et les options de lecture ; un export retéléchargé est donc relu
+    avec openpyxl une seule fois, puis les anciennes copies sont supprimées.
+    Lève RuntimeError si le fichier est un export incomplet (voir assert_export_complete).
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    assert_export_complete(path)
+    if read_kwargs.get('sheet_name', 0) is None or isinstance(read_kwargs.get('sheet_name'), list):
+        # Plusieurs feuilles : dictionnaire de DataFrames, pas de copie
+        return pd.read_excel(path, **read_kwargs)
+    return _cached_frame(path, read_kwargs, lambda: pd.read_excel(path, **read_kwargs))
+
+
+def _header_names(row) -> list:
+    """Noms de colonnes comme pd.read_excel : "Unnamed: i" pour les vides, suffixes .1, .2 pour les doublons."""
+    names, counts = [], {}
+    for i, value in enumerate(row):
+        name = f'Unnamed: {i}' if value is None or value == '' else value
+        if name in counts:
+            counts[name] += 1
+            name = f'{name}.{counts[name]}'
+        else:
+            counts[name] = 0
+        names.append(name)
+    return names
+
+
+def _read_openpyxl_projected(path: str, columns=None, sheet_name=0) -> pd.DataFrame:
+    """
+    Lecture openpyxl en mode read_only qui ne convertit que les colonnes demandées ;
+    l'inférence de types est celle de pd.read_excel (TextParser).
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = _header_names(next(rows, ()))
+        indices = range(len(header)) if columns is None else [header.index(c) for c in columns if c in header]
+        data, last_row = [], 0
+        for row in rows:
+            values = [row[i] if i < len(row) else None for i in indices]
+            data.append([int(v) if isinstance(v, float) and v.is_integer() else v for v in values])
+            if any(v not in (None, '') for v in row):
+                last_row = len(data)
+    finally:
+        workbook.close()
+    # Comme pd.read_excel : les lignes vides en fin de feuille sont ignorées
+    return TextParser([[header[i] for i in indices]] + data[:last_row], header=0).read()
+
+
+def resolve_export(base: str, date: str = None, export_dir: str = None) -> str:
+    """Chemin de l'export daté "<base> AAAA-MM-JJ.xlsx" (aujourd'hui par défaut)."""
+    date = date or datetime.today().strftime('%Y-%m-%d')
+    return os.path.join(os.path.expanduser(export_dir or EXPORT_DIR), f"{base} {date}.xlsx")
+
+
+def read_export(base: str, columns: list = None, dtypes: dict = None, date: str = None,
+                export_dir: str = None, optional: bool = False, engine: str = None,
+                snapshot: bool = True) -> pd.DataFrame:
+    """
+    Charge un export CommCare daté en ne gardant que `columns`.
+
+    base est le nom de l'export sans la date (ex. "muso_groupes (created 2025-03-25)"),
+    ou un chemin de fichier .xlsx. Le fichier est lu avec calamine si le
+    paquet python-calamine est installé, sinon avec openpyxl en mode read_only
+    en ne convertissant que les colonnes demandées ; dtypes est appliqué
+    ensuite (les types datetime avec pd.to_datetime(errors='coerce')).
+    Une colonne demandée absente lève une KeyError, sauf avec optional=True.
+    Un export incomplet ou non vérifié lève une RuntimeError.
+    """
+    path = base if base.lower().endswith('.xlsx') else resolve_export(base, date, export_dir)
+    path = os.path.abspath(os.path.expanduser(path))
+    assert_export_complete(path)
+    engine = engine or EXCEL_ENGINE
+
+    def load():
+        if engine == 'calamine':
+            df = pd.read_excel(path, engine='calamine')
+            df = df[[c for c in columns if c in df.columns]] if columns is not None else df
+        else:
+            df = _read_openpyxl_projected(path, columns)
+        if columns is not None:
+            missing = [c for c in columns if c not in df.columns]
+            if missing and not optional:
+                raise KeyError(f"Colonnes absentes de {os.path.basename(path)} : {missing}")
+            if missing:
+                print(f"⚠️ Colonnes absentes de {os.path.basename(path)} : {missing}")
+        for col, dtype in (dtypes or {}).items():
+            if col in df.columns:
+                if str(dtype).startswith('datetime'):
+                    df[col] = pd.to_datetime(df[col], errors='coerce')
+                else:
+                    df[col] = df[col].astype(dtype)
+        return df
+
+    if not snapshot:
+        return load()
+    return _cached_frame(path, {'columns': columns, 'dtypes': dtypes, 'optional': optional}, load)
+
+
+def _frame_to_ipc(df: pd.DataFrame) -> tuple:
+    """Sérialise un DataFrame au format Arrow IPC (repli pickle si Arrow ne peut pas le représenter)."""
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df.set_axis([f'c{i}' for i in range(df.shape[1])], axis=1), preserve_index=False)
+        metadata = {**(table.schema.metadata or {}), b'caris_columns': json.dumps(list(df.columns), default=str).encode()}
+        table = table.replace_schema_metadata(metadata)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return 'arrow', sink.getvalue().to_pybytes()
+    except (ImportError, ValueError, TypeError):
+        return 'pickle', pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _frame_from_ipc(payload: tuple) -> pd.DataFrame:
+    kind, data = payload
+    if kind == 'pickle':
+        return pickle.loads(data)
+    import pyarrow as pa
+    table = pa.ipc.open_stream(data).read_all()
+    df = table.to_pandas()
+    df.columns = json.loads(table.schema.metadata[b'caris_columns'])
+    return df
+
+
+def _load_export_worker(read_kwargs: dict) -> tuple:
+    return _frame_to_ipc(read_export(**read_kwargs))
+
+
+def read_exports_parallel(exports: dict, max_workers: int = None) -> dict:
+    """
+    Charge plusieurs exports indépendants dans un pool de processus.
+
+    exports associe un nom aux arguments de read_export (base, columns...).
+    Chaque processus renvoie son DataFrame sérialisé en Arrow IPC, bien plus
+    compact à transférer qu'un DataFrame picklé. Les scripts appelants
+    doivent être protégés par if __name__ == "__main__" (Windows).
+
+    Returns:
+        dict: nom -> DataFrame, dans l'ordre de exports
+    """
+    max_workers = max_workers or min(len(exports), os.cpu_count() or 1)
+    start = time.perf_counter()
+    if max_workers <= 1:
+        frames = {name: read_export(**kwargs) for name, kwargs in exports.items()}
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {name: pool.submit(_load_export_worker, kwargs) for name, kwargs in exports.items()}
+            frames = {name: _frame_from_ipc(future.result()) for name, future in futures.items()}
+    print(f"{len(frames)} exports chargés en {time.perf_counter() - start:.1f}s ({max_workers} processus)")
+    return frames
+
+
+# ========== ÉCRITURE DES SORTIES ==========
+# Empreintes des fichiers déjà écrits (chemin -> empreinte du contenu, taille, date)
+EXCEL_EXPORT_MANIFEST = os.getenv('EXCEL_EXPORT_MANIFEST', '.excel_exports.json')
+EXCEL_EXPORT_WORKERS = int(os.getenv('EXCEL_EXPORT_WORKERS', '4'))
+# Mise en forme des en-têtes et de l'index écrits par to_excel (pandas 2.2)
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+DATE_FORMAT = 'yyyy-mm-dd'
+
+_manifest_lock = threading.Lock()
+_export_pool = None
+_pending_exports = {}
+
+
+def _frame_digest(df: pd.DataFrame, index: bool, sheet_name: str):
+    """Empreinte SHA-256 du contenu écrit (None si une colonne n'est pas hachable)."""
+    try:
+        values = pd.util.hash_pandas_object(df, index=index).to_numpy()
+    except TypeError:
+        # Listes ou dictionnaires dans une colonne : toujours réécrire
+        return None
+    digest = hashlib.sha256(json.dumps([sheet_name, list(map(str, df.columns)), list(map(str, df.dtypes)),
+                                        list(map(str, df.index.names)) if index else None]).encode('utf-8'))
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def _load_manifest() -> dict:
+    if not os.path.exists(EXCEL_EXPORT_MANIFEST):
+        return {}
+    try:
+        with open(EXCEL_EXPORT_MANIFEST, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _is_unchanged(path: str, digest: str) -> bool:
+    if digest is None or not os.path.exists(path):
+        return False
+    with _manifest_lock:
+        entry = _load_manifest().get(path)
+    stat = os.stat(path)
+    return entry is not None and entry == {'digest': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _record_export(path: str, digest: str):
+    stat = os.stat(path)
+    with _manifest_lock:
+        manifest = _load_manifest()
+        if digest is None:
+            manifest.pop(path, None)
+        else:
+            manifest[path] = {'digest': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        with open(EXCEL_EXPORT_MANIFEST + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+        os.replace(EXCEL_EXPORT_MANIFEST + '.tmp', EXCEL_EXPORT_MANIFEST)
+
+
+def _cell_values(column: pd.Series) -> list:
+    """Valeurs Python d'une colonne, prêtes pour xlsxwriter (NaN/NaT -> cellule vide)."""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(object)
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        if getattr(column.dtype, 'tz', None) is not None:
+            column = column.dt.tz_localize(None)
+        values = column.astype(object).to_numpy()
+        return [None if pd.isna(v) else v.to_pydatetime() for v in values]
+    if pd.api.types.is_timedelta64_dtype(column.dtype):
+        return [None if pd.isna(v) else v.total_seconds() / 86400 for v in column.to_numpy(dtype=object)]
+    values = column.astype(object).where(column.notna(), None).tolist()
+    if column.dtype == object:
+        return [v if v is None or isinstance(v, (str, int, float, bool, datetime, date)) else str(v) for v in values]
+    return values
+
+
+def write_excel(df: pd.DataFrame, path: str, index: bool = False, sheet_name: str = 'Sheet1'):
+    """
+    Écrit df dans path ligne par ligne avec xlsxwriter en mode constant_memory.
+
+    Même contenu et même mise en forme que df.to_excel(path, index=index,
+    sheet_name=sheet_name) avec pandas 2.2 (en-têtes et index en gras,
+    encadrés et centrés, dates au format AAAA-MM-JJ HH:MM:SS), mais sans
+    garder toute la feuille en mémoire. Les index et colonnes à plusieurs
+    niveaux, que pandas écrit avec des cellules fusionnées, passent par to_excel.
+    """
+    if isinstance(df.columns, pd.MultiIndex) or (index and isinstance(df.index, pd.MultiIndex)):
+        df.to_excel(path, index=index, sheet_name=sheet_name)
+        return
+    header = [str(c) for c in df.columns]
+    index_values = _cell_values(df.index.to_series(index=range(len(df)))) if index else None
+    columns = [_cell_values(df.iloc[:, i]) for i in range(df.shape[1])]
+
+    tmp_path = f'{path}.tmp.xlsx'
+    workbook = xlsxwriter.Workbook(tmp_path, {'constant_memory': True, 'nan_inf_to_errors': True,
+                                              'default_date_format': DATETIME_FORMAT})
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format(HEADER_FORMAT)
+    offset = 1 if index else 0
+    if index and df.index.name:
+        worksheet.write(0, 0, str(df.index.name), header_format)
+    worksheet.write_row(0, offset, header, header_format)
+    if index:
+        # Cellules d'index : format d'en-tête, avec le format de date pour les dates
+        index_formats = {datetime: workbook.add_format({**HEADER_FORMAT, 'num_format': DATETIME_FORMAT}),
+                         date: workbook.add_format({**HEADER_FORMAT, 'num_format': DATE_FORMAT})}
+    rows = zip(*columns) if columns else [()] * len(df)
+    for row, values in enumerate(rows, start=1):
+        if index:
+            value = index_values[row - 1]
+            fmt = index_formats[datetime] if isinstance(value, datetime) else (
+                index_formats[date] if isinstance(value, date) else header_format)
+            if value is None:
+                worksheet.write_blank(row, 0, None, fmt)
+            else:
+                worksheet.write(row, 0, value, fmt)
+        worksheet.write_row(row, offset, values)
+    workbook.close()
+    os.replace(tmp_path, path)
+
+
+def _export_task(df: pd.DataFrame, path: str, index: bool, sheet_name: str) -> bool:
+    start = time.perf_counter()
+    digest = _frame_digest(df, index, sheet_name)
+    if _is_unchanged(path, digest):
+        print(f"{os.path.basename(path)} inchangé, non réécrit")
+        return False
+    write_excel(df, path, index=index, sheet_name=sheet_name)
+    _record_export(path, digest)
+    print(f"{os.path.basename(path)} écrit ({df.shape[0]} lignes) en {time.perf_counter() - start:.1f}s")
+    return True
+
+
+def export_excel(df: pd.DataFrame, path: str, index: bool = False, sheet_name: str = 'Sheet1', wait: bool = False):
+    """
+    Programme l'écriture de df dans path sur un fil d'exportation.
+
+    Le fichier n'est pas réécrit si son contenu (empreinte de df) est le même
+    qu'à la dernière écriture et que le fichier n'a pas été modifié depuis.
+    Les écritures indépendantes se font en parallèle ; appeler
+    wait_for_exports() avant de relire un fichier ou de quitter le script.
+
+    Returns:
+        Future: True si le fichier a été écrit, False s'il était à jour
+    """
+    global _export_pool
+    path = os.path.abspath(path)
+    if _export_pool is None:
+        _export_pool = ThreadPoolExecutor(max_workers=EXCEL_EXPORT_WORKERS, thread_name_prefix='excel-export')
+    if path in _pending_exports:
+        # Même fichier demandé deux fois : la dernière version doit l'emporter
+        _pending_exports.pop(path).result()
+    # Copie : le script peut modifier df pendant l'écriture
+    future = _export_pool.submit(_export_task, df.copy(), path, index, sheet_name)
+    _pending_exports[path] = future
+    if wait:
+        future.result()
+    return future
+
+
+def wait_for_exports() -> int:
+    """Attend la fin des écritures programmées et relance la première erreur. Retourne le nombre de fichiers écrits."""
+    written = 0
+    while _pending_exports:
+        written += bool(_pending_exports.pop(next(iter(_pending_exports))).result())
+    return written
+
+
+class _Cell(NamedTuple):
+    """Cellule (ou plage fusionnée jusqu'à last_row, last_col) ; style : propriétés de format xlsxwriter."""
+    row: int
+    col: int
+    value: object
+    style: Optional[dict] = None
+    last_row: Optional[int] = None
+    last_col: Optional[int] = None
+
+
+def _excel_value(value) -> tuple:
+    """Valeur et format numérique d'une cellule, convertis comme le fait to_excel (NaN -> vide)."""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None, None
+    if pd.api.types.is_bool(value):
+        return bool(value), None
+    if pd.api.types.is_integer(value):
+        return int(value), None
+    if pd.api.types.is_float(value):
+        value = float(value)
+        return ('inf' if value > 0 else '-inf', None) if math.isinf(value) else (value, None)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            raise ValueError("Excel n'accepte pas les dates avec fuseau horaire")
+        return (value.to_pydatetime() if isinstance(value, pd.Timestamp) else value), DATETIME_FORMAT
+    if isinstance(value, date):
+        return value, DATE_FORMAT
+    if isinstance(value, timedelta):
+        return value.total_seconds() / 86400, '0'
+    return (value if isinstance(value, str) else str(value)), None
+
+
+def _level_spans(index: pd.Index) -> list:
+    """
+    Pour chaque niveau de index, {position de départ: longueur} des libellés
+    fusionnés : un libellé répété n'est fusionné que si les niveaux
+    supérieurs le sont aussi, et le dernier niveau ne l'est jamais.
+    """
+    n = len(index)
+    if not isinstance(index, pd.MultiIndex):
+        return [{i: 1 for i in range(n)}]
+    codes = [list(c) for c in index.codes]
+    spans = []
+    breaks = [i == 0 for i in range(n)]
+    for level, level_codes in enumerate(codes):
+        last = level == len(codes) - 1
+        starts = [i for i in range(n) if last or breaks[i] or level_codes[i] != level_codes[i - 1]]
+        for i in starts:
+            breaks[i] = True
+        bounds = starts + [n]
+        spans.append({start: end - start for start, end in zip(bounds, bounds[1:])})
+    return spans
+
+
+def _frame_cells(df: pd.DataFrame, index: bool, header: bool) -> list:
+    """Cellules de df disposées comme to_excel(merge_cells=True) les place, à partir de A1."""
+    columns = df.columns
+    row_index = df.index.to_timestamp() if isinstance(df.index, pd.PeriodIndex) else df.index
+    index_levels = row_index.nlevels if index else 0
+    cells = []
+    rowcounter = 0
+
+    if isinstance(columns, pd.MultiIndex):
+        if not index:
+            raise NotImplementedError("Colonnes à plusieurs niveaux sans index : non géré (comme to_excel)")
+        if header:
+            coloffset = index_levels - 1
+            for level, name in enumerate(columns.names):
+                cells.append(_Cell(level, coloffset, name, HEADER_FORMAT))
+            for level, spans in enumerate(_level_spans(columns)):
+                values = columns.get_level_values(level)
+                for i, span in spans.items():
+                    col = coloffset + i + 1
+                    cells.append(_Cell(level, col, values[i], HEADER_FORMAT,
+                                       *((level, col + span - 1) if span > 1 else (None, None))))
+            rowcounter = columns.nlevels - 1
+    elif header:
+        cells.extend(_Cell(0, i + index_levels, name, HEADER_FORMAT) for i, name in enumerate(columns))
+
+    if header:
+        rowcounter += 1
+    if index:
+        if isinstance(columns, pd.MultiIndex):
+            rowcounter += 1
+        names = list(row_index.names)
+        if header and any(name is not None for name in names):
+            cells.extend(_Cell(rowcounter - 1, level, name, HEADER_FORMAT) for level, name in enumerate(names)
+                         if isinstance(row_index, pd.MultiIndex) or name)
+        for level, spans in enumerate(_level_spans(row_index)):
+            values = row_index.get_level_values(level)
+            for i, span in spans.items():
+                row = rowcounter + i
+                cells.append(_Cell(row, level, values[i], HEADER_FORMAT,
+                                   *((row + span - 1, level) if span > 1 else (None, None))))
+
+    for j in range(df.shape[1]):
+        cells.extend(_Cell(rowcounter + i, index_levels + j, value)
+                     for i, value in enumerate(df.iloc[:, j].tolist()))
+    return cells
+
+
+class WorkbookBuilder:
+    """
+    Classeur à plusieurs feuilles assemblé en mémoire puis écrit une seule fois.
+
+    Les tableaux (add_frame), titres fusionnés (add_title), suppressions de
+    lignes (delete_row) et largeurs de colonnes (set_column_width) sont
+    collectés par feuille ; save() écrit toutes les cellules avec xlsxwriter,
+    sans relecture intermédiaire. Les tableaux sont disposés comme par
+    to_excel (en-têtes et index en gras et encadrés, libellés des niveaux
+    fusionnés). Les lignes et colonnes sont numérotées à partir de 0, comme
+    dans to_excel.
+    """
+
+    def __init__(self):
+        self.sheets = {}
+
+    def _sheet(self, sheet_name: str) -> dict:
+        return self.sheets.setdefault(sheet_name, {'cells': [], 'deleted_rows': [], 'widths': {}})
+
+    def add_frame(self, sheet_name: str, df: pd.DataFrame, startrow: int = 0, startcol: int = 0,
+                  index: bool = True, header: bool = True):
+        self._sheet(sheet_name)['cells'].extend(
+            cell._replace(row=cell.row + startrow, col=cell.col + startcol,
+                          last_row=None if cell.last_row is None else cell.last_row + startrow,
+                          last_col=None if cell.last_col is None else cell.last_col + startcol)
+            for cell in _frame_cells(df, index, header))
+        return self
+
+    def add_title(self, sheet_name: str, row: int, text: str, last_col: int = 9, font_size: int = None,
+                  alignment: str = 'center'):
+        """Titre en gras fusionné de la colonne A à last_col sur la ligne row."""
+        style = {'bold': True, 'align': alignment, 'valign': 'vcenter'}
+        if font_size is not None:
+            style['font_size'] = font_size
+        self._sheet(sheet_name)['cells'].append(_Cell(row, 0, text, style, row, last_col))
+        return self
+
+    def delete_row(self, sheet_name: str, row: int):
+        """Supprime la ligne row (numérotée à partir de 1, comme worksheet.delete_rows) à l'écriture."""
+        self._sheet(sheet_name)['deleted_rows'].append(row - 1)
+        return self
+
+    def set_column_width(self, sheet_name: str, col: int, width: float):
+        self._sheet(sheet_name)['widths'][col] = width
+        return self
+
+    @staticmethod
+    def _shift(row: int, deleted: list) -> int:
+        return row - sum(1 for d in deleted if d < row)
+
+    def _final_cells(self, sheet: dict) -> list:
+        deleted = sorted(sheet['deleted_rows'])
+        return [c._replace(row=self._shift(c.row, deleted),
+                           last_row=None if c.last_row is None else self._shift(c.last_row, deleted))
+                for c in sheet['cells'] if c.row not in deleted]
+
+    def save(self, path: str):
+        workbook = xlsxwriter.Workbook(path, {'nan_inf_to_errors': True})
+        formats = {}
+
+        def cell_format(style, num_format):
+            props = dict(style or {})
+            if num_format:
+                props['num_format'] = num_format
+            if not props:
+                return None
+            key = tuple(sorted(props.items()))
+            if key not in formats:
+                formats[key] = workbook.add_format(props)
+            return formats[key]
+
+        try:
+            for sheet_name, sheet in self.sheets.items():
+                worksheet = workbook.add_worksheet(sheet_name)
+                for cell in self._final_cells(sheet):
+                    value, num_format = _excel_value(cell.value)
+                    fmt = cell_format(cell.style, num_format)
+                    if cell.last_row is not None and cell.last_col is not None:
+                        worksheet.merge_range(cell.row, cell.col, cell.last_row, cell.last_col,
+                                              '' if value is None else value, fmt)
+                    elif value is None:
+                        if fmt is not None:
+                            worksheet.write_blank(cell.row, cell.col, None, fmt)
+                    else:
+                        worksheet.write(cell.row, cell.col, value, fmt)
+                for col, width in sheet['widths'].items():
+                    worksheet.set_column(col, col, width)
+        finally:
+            workbook.close()
+        print(f"Classeur '{path}' écrit ({len(self.sheets)} feuilles)")
+        return path
+
+
+def benchmark_read_export(paths: list, n_columns: int = 7, repeat: int = 3):
+    """
+    Compare pd.read_excel(parse_dates=True) suivi d'une sélection de colonnes
+    (lecture actuelle des pipelines) à read_export sur les `n_columns`
+    premières colonnes, sans copie colonnaire.
+    """
+    engines = ['openpyxl'] + (['calamine'] if EXCEL_ENGINE == 'calamine' else [])
+    for path in paths:
+        columns = list(pd.read_excel(path, nrows=0).columns[:n_columns])
+        timings = {}
+        start = time.perf_counter()
+        for _ in range(repeat):
+            reference = pd.read_excel(path, parse_dates=True)[columns]
+        timings['pd.read_excel'] = (time.perf_counter() - start) / repeat
+        for engine in engines:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                df = read_export(path, columns=columns, engine=engine, snapshot=False)
+            timings[f'read_export[{engine}]'] = (time.perf_counter() - start) / repeat
+            if not df.astype(str).equals(reference.astype(str)):
+                print(f"⚠️ {engine} : résultat différent de pd.read_excel pour {os.path.basename(path)}")
+        base_time = timings['pd.read_excel']
+        print(f"{os.path.basename(path)} ({reference.shape[0]} lignes, {len(columns)} colonnes) : " +
+              ", ".join(f"{name} {t:.2f}s (x{base_time / t:.1f})" for name, t in timings.items()))
+
+
+def benchmark_write_excel(paths: list, repeat: int = 1):
+    """Compare df.to_excel (openpyxl) à write_excel sur le contenu des fichiers donnés."""
+    import tempfile
+    import tracemalloc
+    for path in paths:
+        df = pd.read_excel(path, engine=EXCEL_ENGINE)
+        timings = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            target = os.path.join(tmp, 'out.xlsx')
+            for name, write in [('to_excel', lambda: df.to_excel(target, index=False, engine='openpyxl')),
+                                ('write_excel', lambda: write_excel(df, target))]:
+                tracemalloc.start()
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    write()
+                elapsed = (time.perf_counter() - start) / repeat
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                timings[name] = (elapsed, peak)
+        print(f"{os.path.basename(path)} ({df.shape[0]} lignes, {df.shape[1]} colonnes) : " +
+              ", ".join(f"{name} {t:.2f}s / {m:.0f} Mo" for name, (t, m) in timings.items()))
+
+
+if __name__ == "__main__":
+    # Par défaut, les exports de taille réelle présents à la racine du dépôt
+    fixtures = sys.argv[1:] or [f for f in ['nutrition_case.xlsx', 'nutrition_depistage.xlsx',
+                                            'nutrition_visite.xlsx', 'garden_household.xlsx']
+                                if os.path.exists(f)]
+    benchmark_read_export(fixtures)
+    benchmark_write_excel(fixtures)
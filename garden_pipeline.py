@@ -4,6 +4,7 @@
 import pandas as pd
 import os
 from datetime import datetime
+from excel_io import read_excel_cached, export_excel
 
 def main():
     # Étape 1 : Définir le nom du fichier
@@ -22,7 +23,7 @@ def main():
         return
 
     # Étape 3 : Lecture du fichier Garden
-    df = pd.read_excel(garden_path)
+    df = read_excel_cached(garden_path)
 
     # Étape 4 : Renommer la colonne info.owner_name en username
     if 'info.owner_name' in df.columns:
@@ -79,7 +80,7 @@ def main():
 
     # Étape 13 : Résultat
     print(f"✅ {len(filtered_df)} lignes sélectionnées après filtrage.")
-    filtered_df.to_excel("all_gardens.xlsx", index=False)
+    export_excel(filtered_df, "all_gardens.xlsx", wait=True)
     print(f"📁 Résultat exporté")
 
 if __name__ == "__main__":
@@ -4,7 +4,6 @@ import os, sys, threading, queue, logging
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from datetime import datetime
 
 MODULE_NAME = "commcare_downloader"
 ID_ENV_FILENAME = "id_cc.env"
@@ -47,8 +46,11 @@ class App(tk.Tk):
         default_dir = getattr(downloader, "DOWNLOAD_DIR", str(Path.home() / "Downloads"))
         self.dir_var = tk.StringVar(value=default_dir)
         self.base_vars = []
+        self.base_checkbuttons = {}
         self._build_ui()
         self._load_expected_bases()
+        self._refresh_presence()
+        self.dir_var.trace_add('write', lambda *args: self._refresh_presence())
         self._poll_log_queue()
 
     def _build_ui(self):
@@ -205,12 +207,24 @@ class App(tk.Tk):
                         update_program_var(cat)
                     return cb
                 var.trace_add('write', make_child_callback(cat, var))
-                ttk.Checkbutton(lf, text=b, variable=var).pack(anchor="w")
+                cb = ttk.Checkbutton(lf, text=b, variable=var); cb.pack(anchor="w")
+                self.base_checkbuttons[b] = cb
                 self.base_vars.append((b, var))
                 self.program_base_vars[cat].append((b, var))
         for c in range(n_col):
             grid_frame.grid_columnconfigure(c, weight=1)
 
+    def _refresh_presence(self):
+        # Marque les exports du jour déjà présents, via l'index partagé avec le téléchargeur
+        if str(self.run_btn["state"]) == "disabled": return
+        folder = self.dir_var.get().strip()
+        if not folder or not os.path.isdir(folder):
+            for b, cb in self.base_checkbuttons.items(): cb.config(text=b)
+            return
+        index = downloader.folder_index(folder, [b for b, _ in self.base_vars])
+        for b, cb in self.base_checkbuttons.items():
+            cb.config(text=f"{b}  ✓" if index.present(b) else b)
+
     def _toggle_all(self):
         for _, v in self.base_vars: v.set(self.select_all_var.get())
 
@@ -270,6 +284,7 @@ class App(tk.Tk):
                     try: Path(env_path).unlink(missing_ok=True); logging.getLogger().info("Fichier id_cc.env temporaire supprimé.")
                     except Exception: pass
                 self.after(0, lambda: self.run_btn.config(state="normal")); self.after(0, lambda: self.status.config(text="Terminé."))
+                self.after(0, self._refresh_presence)
         self.running_thread = threading.Thread(target=worker, daemon=True); self.running_thread.start()
 
     def _on_quit(self):
@@ -277,12 +292,5 @@ class App(tk.Tk):
             if not messagebox.askyesno("Quitter ?", "Un traitement est en cours. Quitter quand même ?"): return
         self.destroy()
 
-def file_matches_today(base, fname):
-    today = datetime.today().strftime('%Y-%m-%d')
-    base_norm = base.lower().replace(" ", "_")
-    fname_norm = os.path.basename(fname).lower().replace(" ", "_")
-    pat = re.compile(rf"^{re.escape(base_norm)}(\s*\(created\s+\d{{4}}-\d{{2}}-\d{{2}}\))?\s+{today}(?:\s+\(\d+\))?\.xlsx$")
-    return bool(pat.match(fname_norm))
-
 if __name__ == "__main__":
     App().mainloop()
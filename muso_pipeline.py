@@ -37,6 +37,7 @@ from dotenv import load_dotenv
 try:
     from utils import get_commcare_odata
     from caris_fonctions import execute_sql_query
+    from excel_io import read_exports_parallel, export_excel, wait_for_exports
 except ImportError as e:
     print(f"Warning: Could not import some functions: {e}")
 
@@ -56,28 +57,46 @@ def main():
         print("Chargement des données...")
         today_str = datetime.today().strftime('%Y-%m-%d')
         
-        # Chargement des fichiers Excel
-        muso_group = pd.read_excel(
-            f"~/Downloads/caris-meal-app/data/muso_groupes (created 2025-03-25) {today_str}.xlsx", 
-            parse_dates=True
-        )
-        
-        muso_ben = pd.read_excel(
-            f"~/Downloads/caris-meal-app/data/muso_beneficiaries (created 2025-03-25) {today_str}.xlsx", 
-            parse_dates=True
-        )
-        
-        muso_household = pd.read_excel(
-            f"~/Downloads/caris-meal-app/data/muso_household_2022 (created 2025-03-25) {today_str}.xlsx", 
-            parse_dates=True
-        )
-        
-        muso_ppi = pd.read_excel(
-            f"~/Downloads/caris-meal-app/data/MUSO - Members - PPI Questionnaires (created 2025-04-23) {today_str}.xlsx", 
-            parse_dates=True
-        )
+        # Colonnes utilisées pour les groupes et les bénéficiaires : seules celles-ci sont chargées
+        colonnes = [
+            "caseid", "is_graduated", "office", "graduation_date", "commune_name",
+            "code", "creation_date", "officer_name", "gps_date", "gps", "office_name", "adress",
+            "section_name", "departement_name", "name", "present", "credit", "balance", "absent",
+            "cotisation", "date_suivi", "date_prochain_suivi", "closed", "closed_by_username",
+            "last_modified_date", "username", "opened_date", "owner_name", "case_link"
+        ]
+        # Sélection des colonnes pour les bénéficiaires - SANS officer_fullname et officer_name
+        columns = [
+            "caseid", "household_number", "group_code", "dob", "patient_code",
+            "first_name", "group_commune", "phone", "is_inactive", "group_departement",
+            "inactive_date", "graduated", "abandoned_date", "is_abandoned", "last_name",
+            "graduation_date", "gender", "rank", "group_name", "address",
+            "is_pvvih", "is_caris_member", "name", "household_number_2022", "muso_start_date",
+            "patient_code_pv", "date_enquete_ppi", "score_total_ppi", "close_reason", "test",
+            "test_result", "date_du_test", "institution_ou_centre_hospitalier_qui_a_fait_le_test", 
+            "est_sous_arv", "proche_decede_du_vih", "hospitalisation_dans_les_3_derniers_mois", 
+            "lien_de_parent_avec_proche_decede_du_vih", "probleme_de_sante_regulier", "refere", 
+            "owner_id", "caseid_group", "closed", "last_modified_by_user_username", 
+            "last_modified_date", "opened_date", "owner_name"
+        ]
         
-        muso_actif = pd.read_excel("./group_muso_actif.xlsx", parse_dates=True)
+        # Chargement des fichiers Excel (en parallèle dans un pool de processus)
+        exports = read_exports_parallel({
+            'muso_group': dict(
+                base="muso_groupes (created 2025-03-25)",
+                columns=[c for c in colonnes if c != "username"] + ["opened_by_username"], date=today_str, optional=True
+            ),
+            'muso_ben': dict(
+                base="muso_beneficiaries (created 2025-03-25)",
+                columns=[c for c in columns if c != "caseid_group"] + ["indices.muso_groupes", "removing_date"],
+                date=today_str, optional=True
+            ),
+            'muso_household': dict(base="muso_household_2022 (created 2025-03-25)", date=today_str),
+            'muso_ppi': dict(base="MUSO - Members - PPI Questionnaires (created 2025-04-23)", date=today_str),
+            'muso_actif': dict(base="./group_muso_actif.xlsx"),
+        })
+        muso_group, muso_ben = exports['muso_group'], exports['muso_ben']
+        muso_household, muso_ppi, muso_actif = exports['muso_household'], exports['muso_ppi'], exports['muso_actif']
         
         print("✓ Données chargées avec succès")
         
@@ -87,13 +106,6 @@ def main():
         muso_group_after = muso_group.copy(deep=True)
         muso_group_after = muso_group_after.rename(columns={"opened_by_username": "username"})
         
-        colonnes = [
-            "caseid", "is_graduated", "office", "graduation_date", "commune_name",
-            "code", "creation_date", "officer_name", "gps_date", "gps", "office_name", "adress",
-            "section_name", "departement_name", "name", "present", "credit", "balance", "absent",
-            "cotisation", "date_suivi", "date_prochain_suivi", "closed", "closed_by_username",
-            "last_modified_date", "username", "opened_date", "owner_name", "case_link"
-        ]
         muso_group_after = muso_group_after[colonnes].reset_index(drop=True)
         
         # Filtrage des groupes actifs
@@ -172,21 +184,7 @@ def main():
             muso_pvvih = muso_ben_actif[muso_ben_actif["is_pvvih"] == "1"]
             print(f"Nombre de PVVIH dans muso: {muso_pvvih.shape[0]}")
         
-        # Sélection des colonnes pour les bénéficiaires - SANS officer_fullname et officer_name
-        columns = [
-            "caseid", "household_number", "group_code", "dob", "patient_code",
-            "first_name", "group_commune", "phone", "is_inactive", "group_departement",
-            "inactive_date", "graduated", "abandoned_date", "is_abandoned", "last_name",
-            "graduation_date", "gender", "rank", "group_name", "address",
-            "is_pvvih", "is_caris_member", "name", "household_number_2022", "muso_start_date",
-            "patient_code_pv", "date_enquete_ppi", "score_total_ppi", "close_reason", "test",
-            "test_result", "date_du_test", "institution_ou_centre_hospitalier_qui_a_fait_le_test", 
-            "est_sous_arv", "proche_decede_du_vih", "hospitalisation_dans_les_3_derniers_mois", 
-            "lien_de_parent_avec_proche_decede_du_vih", "probleme_de_sante_regulier", "refere", 
-            "owner_id", "caseid_group", "closed", "last_modified_by_user_username", 
-            "last_modified_date", "opened_date", "owner_name"
-        ]
-        
+        # Sélection des colonnes pour les bénéficiaires (columns, définie au chargement)
         # Garder seulement les colonnes qui existent
         columns_existantes = [col for col in columns if col in muso_ben_actif.columns]
         
@@ -341,11 +339,11 @@ def main():
         print("\n5. SAUVEGARDE DES FICHIERS")
         
         try:
-            muso_group_actif.to_excel("muso_group_actif.xlsx", index=False)
-            muso_group_final.to_excel("muso_group_final.xlsx", index=False)
-            muso_ben_actif.to_excel("muso_ben_actif.xlsx", index=False)
+            export_excel(muso_group_actif, "muso_group_actif.xlsx")
+            export_excel(muso_group_final, "muso_group_final.xlsx")
+            export_excel(muso_ben_actif, "muso_ben_actif.xlsx")
             # Nouveau fichier avec le merge PPI
-            muso_ben_with_ppi.to_excel("muso_ben_with_ppi.xlsx", index=False)
+            export_excel(muso_ben_with_ppi, "muso_ben_with_ppi.xlsx")
             print("✓ Fichiers sauvegardés avec succès")
             print(f"✓ Nouveau fichier créé: muso_ben_with_ppi.xlsx")
             
@@ -355,8 +353,9 @@ def main():
             if doublon is not None:
                 print(f"✓ Doublons filtrés à partir du sheet2")
                 # Optionnel: sauvegarder les doublons identifiés
-                doublon.to_excel("doublons_identifies.xlsx", index=False)
+                export_excel(doublon, "doublons_identifies.xlsx")
                 print(f"✓ Fichier doublons_identifies.xlsx créé")
+            wait_for_exports()
                 
         except Exception as e:
             print(f"Erreur lors de la sauvegarde: {e}")
@@ -21,6 +21,8 @@ import xlsxwriter
 import pymysql
 from sqlalchemy import create_engine
 from selenium import webdriver
+from excel_io import read_excel_cached, export_excel, wait_for_exports
+from dedup import detecter_doublons_avec_groupes, detecter_doublons_incremental
 
 
 print("="*60)
@@ -323,7 +325,7 @@ def age_range(age):
 #==================================================================================
 #========================================================================================================================
 today_str = datetime.today().strftime('%Y-%m-%d')
-enroled = pd.read_excel(f"~/Downloads/caris-meal-app/data/Nutrition (created 2025-04-25) {today_str}.xlsx",
+enroled = read_excel_cached(f"~/Downloads/caris-meal-app/data/Nutrition (created 2025-04-25) {today_str}.xlsx",
                           parse_dates=True)
 enroled_col = [
     "caseid", "name", "eligible", "manutrition_type", "date_of_birth",
@@ -337,7 +339,7 @@ enroled_col = [
 enroled = enroled[enroled_col]
 print(f"Fichier enrollement Télechargé avec {enroled.shape[0]} lignes")
 #=======================================================================================================================
-depistage = pd.read_excel(f"~/Downloads/caris-meal-app/data/Caris Health Agent - NUTRITON[HIDDEN] - Dépistage Nutritionnel (created 2025-06-26) {today_str}.xlsx",
+depistage = read_excel_cached(f"~/Downloads/caris-meal-app/data/Caris Health Agent - NUTRITON[HIDDEN] - Dépistage Nutritionnel (created 2025-06-26) {today_str}.xlsx",
                           parse_dates=True)
 dep_col = [
     "form.depistage.date_de_visite", "form.depistage.last_name", "form.depistage.first_name", "form.depistage.gender",
@@ -370,10 +372,10 @@ print(f"{depistage_week.shape[0]} dépistage réalisés pour la semaine")
 print("=== Nombre depistage de mai 2025 à aujourd'hui ===")
 depistage_nut = extraire_data(df=depistage_clean, start_date=start_date, end_date=end_date, date_col='date_de_visite')
 print(f"{depistage_nut.shape[0]} dépistage réalisés pour la periode")
-depistage_nut.to_excel("depistage_nutritionel.xlsx", sheet_name="Mai_a_aujourdhui", index=False)
+export_excel(depistage_nut, "depistage_nutritionel.xlsx", sheet_name="Mai_a_aujourdhui")
 #===============================================================================================
 depistage_index=create_binary_symptom_columns(depistage_nut, 'autres_symptomes')
-depistage_index.to_excel("depistage_index.xlsx", sheet_name="index", index=False)
+export_excel(depistage_index, "depistage_index.xlsx", sheet_name="index")
 # Ajouter l'âge au DataFrame de dépistage
 depistage_nut = get_age_in_year(depistage_nut, 'date_of_birth')
 depistage_nut = get_age_in_months(depistage_nut, 'date_of_birth')
@@ -381,7 +383,7 @@ depistage_nut['age_range'] = depistage_nut['age_months'].map(age_range)
 print(f"Colonne âge ajoutée. Échantillon:")
 #print(depistage_nut[['date_of_birth', 'age_years']].head())
 depistage_indice = create_normalized_health_index(depistage_nut)
-depistage_indice.to_excel("depistage_indice.xlsx", sheet_name="indice", index=False)
+export_excel(depistage_indice, "depistage_indice.xlsx", sheet_name="indice")
 #nut_filtered = filter_patients(enroled, date_threshold="2025-05-01")
 
 enroled["enrollement_date_de_visite"] = pd.to_datetime(enroled["enrollement_date_de_visite"], errors="coerce")
@@ -398,7 +400,7 @@ condition = (
 )
 # Application du filtre
 nut_filtered = enroled[condition]
-nut_filtered.to_excel("Nutrition_all.xlsx")
+export_excel(nut_filtered, "Nutrition_all.xlsx", index=True)
 print(f"Nombre d'enrollement avec doublons possibles {nut_filtered.shape[0]} lignes")
 #==========================================================================================
 
@@ -407,245 +409,25 @@ print(f"Nombre d'enrollement avec doublons possibles {nut_filtered.shape[0]} lig
 nut_filtered = get_age_in_year(nut_filtered, 'date_of_birth')
 nut_filtered = get_age_in_months(nut_filtered, 'date_of_birth')
 nut_filtered['age_range'] = nut_filtered['age_months'].map(age_range)
-nut_filtered.to_excel("Enroled.xlsx", sheet_name="enroled", index=False)
+export_excel(nut_filtered, "Enroled.xlsx", sheet_name="enroled")
 
 #========================================================================
 depistage = depistage.rename(columns={'form.case.@case_id': 'caseid','form.depistage.date_de_visite':'date_de_visite'})
 nutrition = pd.merge(nut_filtered, depistage[['date_de_visite','caseid','username']])
-nutrition.to_excel("nutrition.xlsx", sheet_name="enroled", index=False)
+export_excel(nutrition, "nutrition.xlsx", sheet_name="enroled")
 
 print("=== Alertes doublons ===")
-import pandas as pd
-from difflib import SequenceMatcher
-
-import pandas as pd
-import numpy as np
-import unicodedata
-from difflib import SequenceMatcher
-from typing import List
-
-def _normalize_text_series(s: pd.Series) -> pd.Series:
-    """Minuscules, trimming, compression des espaces et suppression des accents."""
-    s = s.astype(str).str.lower().str.strip().str.replace(r"\s+", " ", regex=True)
-    return s.apply(lambda x: unicodedata.normalize("NFKD", x).encode("ascii","ignore").decode("ascii"))
-
-def _similar(a: str, b: str) -> float:
-    """Similarité [0,100] via difflib (rapide, standard)."""
-    return 100.0 * SequenceMatcher(None, a, b).ratio()
-
-def detecter_doublons_avec_groupes(
-    df: pd.DataFrame,
-    colonnes: List[str],
-    threshold: int = 100,
-    return_only_duplicates: bool = True,
-    keep_most_na: bool = False  # ✅ Nouveau paramètre
-) -> pd.DataFrame:
-    """
-    Détecte des doublons (stricts si threshold=100, sinon fuzzy) sur `colonnes`,
-    et retourne un DataFrame avec:
-      - duplicate_group_id (int >= 1 pour les groupes; 0 si singleton)
-      - duplicate_group_size (taille du groupe)
-    
-    Si keep_most_na=True, garde l'enregistrement avec le plus de valeurs N/A par groupe.
-    
-    Args
-    ----
-    df : DataFrame source
-    colonnes : colonnes utilisées pour la comparaison
-    threshold : 100 => exact (sur texte normalisé) ; <100 => fuzzy
-    return_only_duplicates : si True, ne retourne que les lignes appartenant
-                             à un groupe de taille >= 2
-    keep_most_na : si True, garde l'enregistrement avec le plus de N/A par groupe
-    
-    Returns
-    -------
-    DataFrame enrichi (ou nettoyé si keep_most_na=True)
-    """
-    if not colonnes:
-        raise ValueError("Aucune colonne fournie.")
-    manquantes = [c for c in colonnes if c not in df.columns]
-    if manquantes:
-        raise ValueError(f"Colonnes manquantes dans df: {manquantes}")
-
-    n = len(df)
-    if n == 0:
-        out = df.copy()
-        out["duplicate_group_id"] = pd.Series(dtype=int)
-        out["duplicate_group_size"] = pd.Series(dtype=int)
-        return out
-
-    # 1) Normalisation des colonnes de comparaison
-    df_cmp = df[colonnes].copy()
-    for c in colonnes:
-        df_cmp[c] = _normalize_text_series(df_cmp[c])
-
-    # 2) Cas strict (exact sur normalisé) : équivaut à un groupby sur les colonnes normalisées
-    if threshold >= 100:
-        # clé exacte
-        keys = df_cmp.apply(lambda r: tuple(r.values.tolist()), axis=1)
-        # group id via factorize
-        codes, uniques = pd.factorize(keys, sort=True)
-        # taille par groupe
-        sizes = pd.Series(codes).map(pd.Series(pd.Series(codes).value_counts()))
-        group_id = np.where(sizes.values >= 2, codes + 1, 0)  # 0 pour singletons
-        out = df.copy()
-        out["duplicate_group_id"] = group_id
-        out["duplicate_group_size"] = np.where(group_id > 0, sizes.values, 1)
-        
-        # ✅ Traitement keep_most_na si demandé
-        if keep_most_na:
-            return _process_keep_most_na(out, return_only_duplicates)
-        
-        return out[out["duplicate_group_id"] > 0].reset_index(drop=True) if return_only_duplicates else out
-
-    # 3) Cas fuzzy : union-find sur paires similaires (>= threshold)
-    parent = list(range(n))
-
-    def find(x):
-        while parent[x] != x:
-            parent[x] = parent[parent[x]]
-            x = parent[x]
-        return x
-
-    def union(a, b):
-        ra, rb = find(a), find(b)
-        if ra != rb:
-            parent[rb] = ra
-
-    # Comparaison naïve toutes paires (optimisez avec un blocking si besoin)
-    vals = df_cmp.values.astype(str)
-    for i in range(n):
-        vi = vals[i]
-        for j in range(i+1, n):
-            vj = vals[j]
-            # score minimal sur les colonnes (toutes doivent dépasser le seuil)
-            smin = 100.0
-            for k in range(len(colonnes)):
-                s = _similar(vi[k], vj[k])
-                if s < smin:
-                    smin = s
-                if smin < threshold:
-                    break
-            if smin >= threshold:
-                union(i, j)
-
-    # Construire les groupes
-    roots = [find(i) for i in range(n)]
-    # remap racines -> id 1..G pour lisibilité
-    uniq_roots = {}
-    next_id = 1
-    group_id = []
-    for r in roots:
-        if r not in uniq_roots:
-            uniq_roots[r] = next_id
-            next_id += 1
-        group_id.append(uniq_roots[r])
-
-    # Taille des groupes
-    counts = pd.Series(group_id).value_counts()
-    size_map = counts.to_dict()
-    size_vec = [size_map[g] for g in group_id]
-
-    # Marquer les singletons comme 0
-    group_id_final = [gid if size_map[gid] >= 2 else 0 for gid in group_id]
-    size_final = [size_map[gid] if size_map[gid] >= 2 else 1 for gid in group_id]
-
-    out = df.copy()
-    out["duplicate_group_id"] = group_id_final
-    out["duplicate_group_size"] = size_final
-
-    # ✅ Traitement keep_most_na si demandé
-    if keep_most_na:
-        return _process_keep_most_na(out, return_only_duplicates)
-
-    return out[out["duplicate_group_id"] > 0].reset_index(drop=True) if return_only_duplicates else out
-
-def _process_keep_most_na(df_with_groups: pd.DataFrame, return_only_duplicates: bool = True) -> pd.DataFrame:
-    """
-    Fonction auxiliaire pour traiter les groupes et garder l'enregistrement avec le plus de N/A.
-    """
-    
-    # 1) Calculer le pourcentage de N/A pour chaque ligne
-    # Exclure les colonnes techniques ajoutées par la détection
-    technical_cols = ['duplicate_group_id', 'duplicate_group_size']
-    data_cols = [col for col in df_with_groups.columns if col not in technical_cols]
-    
-    total_cols = len(data_cols)
-    df_with_groups['na_count'] = df_with_groups[data_cols].isna().sum(axis=1)
-    df_with_groups['na_percentage'] = (df_with_groups['na_count'] / total_cols * 100).round(2)
-    
-    print(f"📊 Pourcentage de N/A calculé sur {total_cols} colonnes")
-    print(f"📈 Statistiques N/A - Min: {df_with_groups['na_percentage'].min()}%, Max: {df_with_groups['na_percentage'].max()}%")
-    
-    # 2) Fonction pour garder l'enregistrement avec le plus de N/A par groupe
-    def keep_most_na_per_group(group):
-        if len(group) == 1:
-            return group  # Pas de doublon, garder tel quel
-        
-        # Trier par pourcentage N/A décroissant, puis par na_count pour tie-breaking
-        group_sorted = group.sort_values(['na_percentage', 'na_count'], ascending=[False, False])
-        most_na = group_sorted.iloc[0:1]  # Garder le premier (plus de N/A)
-        
-        # Afficher uniquement pour les vrais groupes de doublons
-        if 'caseid' in group.columns:
-            print(f"   Groupe {group['duplicate_group_id'].iloc[0]}: {len(group)} doublons → gardé caseid {most_na['caseid'].iloc[0]} ({most_na['na_percentage'].iloc[0]}% N/A)")
-        else:
-            print(f"   Groupe {group['duplicate_group_id'].iloc[0]}: {len(group)} doublons → gardé index {most_na.index[0]} ({most_na['na_percentage'].iloc[0]}% N/A)")
-        
-        return most_na
-    
-    # 3) Traiter les groupes
-    print("🔍 Traitement des groupes de doublons...")
-    
-    # Séparer les non-doublons (duplicate_group_id == 0) et les doublons
-    non_duplicates = df_with_groups[df_with_groups['duplicate_group_id'] == 0].copy()
-    duplicates = df_with_groups[df_with_groups['duplicate_group_id'] > 0].copy()
-    
-    print(f"   📋 {len(non_duplicates)} enregistrements uniques")
-    print(f"   🔍 {len(duplicates)} enregistrements en doublons dans {duplicates['duplicate_group_id'].nunique()} groupes")
-    
-    # Appliquer la fonction de sélection sur chaque groupe de doublons
-    if len(duplicates) > 0:
-        kept_duplicates = duplicates.groupby('duplicate_group_id').apply(keep_most_na_per_group).reset_index(drop=True)
-    else:
-        kept_duplicates = pd.DataFrame()
-    
-    # 4) Combiner les résultats
-    result = pd.concat([non_duplicates, kept_duplicates], ignore_index=True)
-    
-    # 5) Nettoyer les duplicate_group_id pour qu'ils soient uniques
-    # Réinitialiser duplicate_group_id à 0 pour tous (plus de doublons maintenant)
-    result['duplicate_group_id'] = 0
-    result['duplicate_group_size'] = 1
-    
-    # 6) Supprimer les colonnes de travail
-    result = result.drop(['na_count', 'na_percentage'], axis=1)
-    
-    # 7) Vérification finale
-    print(f"✅ Résultat final: {len(result)} enregistrements")
-    print(f"🎯 Tous les duplicate_group_id sont à 0 (uniques): {(result['duplicate_group_id'] == 0).all()}")
-    
-    # Vérifier l'unicité des caseid si la colonne existe
-    if 'caseid' in result.columns:
-        caseid_duplicates = result['caseid'].duplicated().sum()
-        if caseid_duplicates > 0:
-            print(f"⚠️ Attention: {caseid_duplicates} caseid encore en doublon")
-            # Supprimer les doublons restants par caseid (garder le premier)
-            result = result.drop_duplicates(subset=['caseid'], keep='first')
-            print(f"🧹 Après nettoyage final: {len(result)} enregistrements")
-        else:
-            print(f"✅ Tous les caseid sont uniques")
-    
-    return result
 
 # ✅ REMPLACEMENT DE VOTRE CODE EXISTANT (lignes 551-565)
 print("\n=== TRAITEMENT AVANCÉ DES DOUBLONS AVEC FONCTION INTÉGRÉE ===")
 
 # Appliquer la détection avec traitement automatique des N/A
-nutrition_clean = detecter_doublons_avec_groupes(
+# (index persistant : seuls les enfants nouveaux ou modifiés depuis la veille sont comparés)
+nutrition_clean = detecter_doublons_incremental(
     nutrition, 
     colonnes=["name", "commune", "username"], 
     threshold=90,
+    index_name="nutrition",
     return_only_duplicates=False,  # Garder tous les enregistrements
     keep_most_na=True  # ✅ Activer le traitement N/A intégré
 )
@@ -656,7 +438,7 @@ nutrition_clean['manutrition_type'] = (
     .replace('---', 'MAM')
     .fillna('MAM')
 )
-nutrition_clean.to_excel("nutrition_sans_doublon_integrated.xlsx", index=False)
+export_excel(nutrition_clean, "nutrition_sans_doublon_integrated.xlsx")
 
 # ✅ Vérification supplémentaire avec isin() pour s'assurer de la suppression
 print("\n🔍 Vérification avec isin()...")
@@ -688,7 +470,7 @@ if 'caseid' in nutrition_clean.columns:
     # Sauvegarder aussi la liste des caseid supprimés pour audit
     if removed_caseids:
         removed_df = pd.DataFrame({'removed_caseid': list(removed_caseids)})
-        removed_df.to_excel("caseids_supprimes_integrated.xlsx", index=False)
+        export_excel(removed_df, "caseids_supprimes_integrated.xlsx")
 
 # ✅ BONUS: Analyse des N/A par colonne
 print("\n📈 Analyse des valeurs manquantes par colonne dans le résultat final:")
@@ -703,11 +485,11 @@ for col, count in na_analysis.head(10).items():
 #==============================================================
 # 1) Doublons STRICTS (casse/accents/espaces ignorés)
 res_fuzzy = detecter_doublons_avec_groupes(nutrition, colonnes=["name","commune","username","date_of_birth"], threshold=100)
-res_fuzzy.to_excel("doublon_nut_strict.xlsx")
+export_excel(res_fuzzy, "doublon_nut_strict.xlsx", index=True)
 
 # 2) Doublons FUZZY (tolère petites fautes/variantes)
-nut_fuzzy = detecter_doublons_avec_groupes(nutrition, colonnes=["name","commune","username"], threshold=90)
-nut_fuzzy.to_excel("doublon_nut_fuzzy.xlsx")
+nut_fuzzy = detecter_doublons_incremental(nutrition, colonnes=["name","commune","username"], threshold=90, index_name="nutrition_fuzzy")
+export_excel(nut_fuzzy, "doublon_nut_fuzzy.xlsx", index=True)
 
 # Exemple : on suppose que df contient déjà les colonnes citées
 #============================================================================================
@@ -937,6 +719,7 @@ if __name__ == "__main__":
     )
     print("Fichier généré:", out)
 
+wait_for_exports()
 print("\n" + "="*60)
 print("FIN DU SCRIPT AVEC COPIE CORRIGÉE")
 print("="*60)
\ No newline at end of file
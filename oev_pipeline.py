@@ -1,5 +1,6 @@
 # Standard library imports
 import os
+from functools import partial
 import re
 import time
 import warnings
@@ -26,22 +27,30 @@ from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 from dotenv import load_dotenv
 # import functions
-from utils import get_commcare_odata
+from utils import get_commcare_odata, sync_commcare_odata, print_request_metrics, fetch_sources
 # Download charges virales database from "Charges_virales_pediatriques.sql file"
 from caris_fonctions import execute_sql_query
+from excel_io import read_excel_cached, export_excel, wait_for_exports
 
 
 
 # ========== FILTRAGE OEV ==========
+# Exclusions appliquées par Charges_virales_pediatriques.sql (paramètres liés)
+# et revérifiées par filter_oev_data
+EXCLUDED_OFFICES = ['BOM', 'PDP']
+EXCLUDED_NETWORKS = ['PIH', 'UGP', 'MSPP']
+EXCLUDED_SITES = ['PAP/CHAP', 'PAP/OBCG', 'PAP/OGRE', 'PEG/HNDP', 'PAP/SMFO', 'LEG/HSCL', 'PAP/HAHD', 'ARC/SADA']
+OEV_MIN_AGE, OEV_MAX_AGE = 0, 17
+
+
 def filter_oev_data(df):
     print(f"Initial dataset: {df.shape[0]} rows")
-    df = df[~df['office'].isin(['BOM', 'PDP'])]
-    df = df[~df['network'].isin(['PIH', 'UGP', 'MSPP'])]
+    df = df[~df['office'].isin(EXCLUDED_OFFICES)]
+    df = df[~df['network'].isin(EXCLUDED_NETWORKS)]
     df['age'] = pd.to_numeric(df['age'], errors='coerce')
-    df = df[df['age'].between(0, 17)]
+    df = df[df['age'].between(OEV_MIN_AGE, OEV_MAX_AGE)]
 
-    sites_to_exclude = ['PAP/CHAP', 'PAP/OBCG', 'PAP/OGRE', 'PEG/HNDP', 'PAP/SMFO', 'LEG/HSCL', 'PAP/HAHD', 'ARC/SADA']
-    df = df[~df['site'].isin(sites_to_exclude)]
+    df = df[~df['site'].isin(EXCLUDED_SITES)]
 
     df['is_abandoned'] = pd.to_numeric(df['is_abandoned'], errors='coerce')
     df = df[df['is_abandoned'] != 1]
@@ -50,7 +59,7 @@ def filter_oev_data(df):
     df = df.drop_duplicates(subset='patient_code', keep='last')
 
     print(f"Filtered dataset: {df.shape[0]} rows")
-    df.to_excel("TX_CURR.xlsx", index=False)
+    export_excel(df, "TX_CURR.xlsx")
     return df
 
 
@@ -97,10 +106,26 @@ def main():
     # Ou encore mieux, utiliser une structure plus flexible :
     base_path = "C:\\Users\\moise\\Downloads\\caris-meal-app\\data"
     path = f"{base_path}\\All_child_PatientCode_CaseID {today_str}.xlsx"
-    caseid = pd.read_excel(os.path.expanduser(path))
+    caseid = read_excel_cached(path)
+
+    # Étape 3 : Sources distantes (charges virales + CommCare OData), chargées en parallèle
+    ajout_url = 'https://www.commcarehq.org/a/caris-test/api/odata/forms/v1/41b99d862f48b671c2b2880b6e2c4cea/feed'
+    child_url = 'https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/41b99d862f48b671c2b2880b6e2c74cb/feed'
+    hh_child_url ='https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/e7c7fb14a8fd38961090d420c3fb64c2/feed'
+    auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
+    params = {}
 
-    # Étape 3 : Charger la base de données charges virales
-    oev_data = execute_sql_query('dot.env', './Charges_virales_pediatriques.sql')
+    sources = fetch_sources({
+        'oev_data': partial(execute_sql_query, 'dot.env', './Charges_virales_pediatriques.sql', chunksize=50000,
+                            params={'excluded_offices': EXCLUDED_OFFICES, 'excluded_networks': EXCLUDED_NETWORKS,
+                                    'excluded_sites': EXCLUDED_SITES, 'min_age': OEV_MIN_AGE, 'max_age': OEV_MAX_AGE}),
+        'ajout': partial(sync_commcare_odata, ajout_url, auth, params, key_field='formid', modified_field='received_on',
+                         feed_name='oev_ajout', as_frame=True, strip_form_prefix=True),
+        'child': partial(sync_commcare_odata, child_url, auth, params, feed_name='oev_child', as_frame=True),
+        'hh_child': partial(sync_commcare_odata, hh_child_url, auth, params, feed_name='oev_hh_child', as_frame=True),
+    })
+    print_request_metrics()
+    oev_data = sources['oev_data']
 
     # Étape 4 : Nettoyer les doublons
     oev_data = oev_data.loc[:, ~oev_data.columns.duplicated()]
@@ -121,28 +146,18 @@ def main():
     print(f"En club: {oev_in_club.shape[0]}")
     print(f"Hors club: {not_in_club.shape[0]}")
     print(f"Hors catégorie (pas 9-17): {not_in_club_anymore.shape[0]}")
-    oev_in_club.to_excel("oev_in_club.xlsx", index=False)
+    export_excel(oev_in_club, "oev_in_club.xlsx")
     print("DataFrame oev_in_club sauvegardé dans oev_in_club.xlsx")
-    not_in_club.to_excel("oev_not_in_club.xlsx", index=False)
+    export_excel(not_in_club, "oev_not_in_club.xlsx")
     print("DataFrame not_in_club sauvegardé dans oev_not_in_club.xlsx")
-    filtered_df.to_excel('oev_data_final.xlsx', index=False)
+    export_excel(filtered_df, 'oev_data_final.xlsx')
     print("DataFrame final sauvegardé dans oev_data_final.xlsx")
     # ========== EXTRACTION AJOUT + CHILD ==========
 
-    ajout_url = 'https://www.commcarehq.org/a/caris-test/api/odata/forms/v1/41b99d862f48b671c2b2880b6e2c4cea/feed'
-    child_url = 'https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/41b99d862f48b671c2b2880b6e2c74cb/feed'
-    hh_child_url ='https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/e7c7fb14a8fd38961090d420c3fb64c2/feed'
-    auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
-    params = {}
-    # Lire le fichier avec pd.read_excel
-
-    # Extraction depuis CommCare OData
-    ajout = pd.DataFrame(get_commcare_odata(ajout_url, auth, params))
-    child = pd.DataFrame(get_commcare_odata(child_url, auth, params))
-    hh_child = pd.DataFrame(get_commcare_odata(hh_child_url, auth, params))
+    # Extraction depuis CommCare OData (synchronisation incrémentale, étape 3)
+    ajout, child, hh_child = sources['ajout'], sources['child'], sources['hh_child']
 
     # Nettoyage des colonnes
-    ajout.columns = ajout.columns.str.replace(' ', '_').str.replace('form_', '', regex=False)
     ajout.rename(columns={'case_case_id': 'caseid'}, inplace=True)
     # Assurez-vous que les DataFrames ont bien la colonne 'caseid'
     if 'caseid' not in caseid.columns:
@@ -151,18 +166,19 @@ def main():
         print("❌ Colonne 'caseid' non trouvée dans le DataFrame 'ajout'.")
 
     # Fusion des données avec contrôle et affichage
-    ajout_comptage = pd.merge(oev_in_club, caseid, on='patient_code', how='left').drop_duplicates('patient_code').fillna(0)
+    # Seules les colonnes apportées par caseid reçoivent 0 : les colonnes catégorielles
+    # du SQL (office, commune...) refusent une nouvelle catégorie 0
+    ajout_comptage = pd.merge(oev_in_club, caseid, on='patient_code', how='left').drop_duplicates('patient_code')
+    ajout_comptage = ajout_comptage.fillna({c: 0 for c in ajout_comptage.columns.difference(oev_in_club.columns)})
     
     print(f"✅ Le jeu de données fusionné comptage_ajout contient {ajout_comptage.shape[0]} observations.")
-    ajout_comptage.to_excel("ajout_comptage.xlsx", index=False)
+    export_excel(ajout_comptage, "ajout_comptage.xlsx")
 
 
-    child.columns = child.columns.str.replace(' ', '_')
-    hh_child.columns = [col.replace(' ', '_') for col in hh_child.columns]
     hh_child = hh_child.drop(columns=['patient_code'], errors='ignore')
     # Rename column in hh_child DataFrame
     hh_child.rename(columns={'main_infant_code': 'patient_code'}, inplace=True)
-    hh_child.to_excel("hh_child.xlsx", index=False)
+    export_excel(hh_child, "hh_child.xlsx")
     hh_child = hh_child[['first_name', 'last_name','name',
     'age_in_year', 'caregiver_yes_no', 'caseid', 'dob', 'full_code_patient_menage',
     'gender', 'hiv_test', 'hiv_test_date', 'hiv_test_result',
@@ -178,11 +194,12 @@ def main():
 
     # Merge des deux
     merged_df_ajout_child = pd.merge(ajout, child, on='caseid', how='left')
-    merged_df_ajout_child = merged_df_ajout_child.drop_duplicates(subset='caseid').fillna(0)
+    merged_df_ajout_child = merged_df_ajout_child.drop_duplicates(subset='caseid')
+    merged_df_ajout_child = merged_df_ajout_child.fillna({c: 0 for c in merged_df_ajout_child.columns.difference(ajout.columns)})
     print(f"The merged dataset has {merged_df_ajout_child.shape[0]} observations")
 
     # Sauvegarde
-    ajout.to_excel("new_ajout.xlsx", index=False)
+    export_excel(ajout, "new_ajout.xlsx")
 
     # Comptage des OEV en club avec ou sans ajout dans CommCare
     oev_avec_comptage = oev_in_club[
@@ -197,12 +214,13 @@ def main():
     oev_sans_comptage['patient_code'] = oev_sans_comptage['patient_code'].str.upper()
     print(f"OEV sans comptage: {oev_sans_comptage.shape[0]}")
 
-    oev_avec_comptage.to_excel("oev_avec_comptage.xlsx", index=False)
-    oev_sans_comptage.to_excel("oev_sans_comptage.xlsx", index=False)
+    export_excel(oev_avec_comptage, "oev_avec_comptage.xlsx")
+    export_excel(oev_sans_comptage, "oev_sans_comptage.xlsx")
     
     hhm_club = hh_child[hh_child['patient_code'].str.lower().isin(oev_in_club['patient_code'].str.lower())]
     hhm_club['patient_code'] = hhm_club['patient_code'].str.upper()
-    hhm_club.to_excel('hhm_club.xlsx', index=False)
+    export_excel(hhm_club, 'hhm_club.xlsx')
+    wait_for_exports()
 
 if __name__ == "__main__":
     main()
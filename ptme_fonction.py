@@ -1,25 +1,5 @@
-import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-import pandas as pd
-
-def execute_sql_query(env_path: str, sql_file_path: str) -> pd.DataFrame:
-    load_dotenv(env_path)
-    user = os.getenv('MYSQL_USER')
-    password = os.getenv('MYSQL_PASSWORD')
-    host = os.getenv('MYSQL_HOST')
-    db = os.getenv('MYSQL_DB')
-
-    conn_text = f'mysql+pymysql://{user}:{password}@{host}/{db}'
-    engine = create_engine(conn_text)
-
-    with open(sql_file_path, 'r') as file:
-        sql_query = file.read().replace('use caris_db;', '')
-
-    df = pd.read_sql_query(sql_query, engine)
-    engine.dispose()
-
-    return df
+# execute_sql_query partage le pool de connexions de caris_fonctions
+from caris_fonctions import execute_sql_query
 
 #===========================================================================================================================
 #========================================================================================================================= 
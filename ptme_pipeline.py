@@ -26,13 +26,13 @@ from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 from dotenv import load_dotenv
 # import functions
-from utils import get_commcare_odata
+from utils import sync_commcare_odata, print_request_metrics
 # Download charges virales database from "Charges_virales_pediatriques.sql file"
 from caris_fonctions import execute_sql_query
 
 # In[2]:
-from utils import get_commcare_odata
 from ptme_fonction import creer_colonne_match_conditional
+from excel_io import read_excel_cached, export_excel, wait_for_exports
 # In[3]:
 
 def filter_ptme_data(
@@ -71,7 +71,7 @@ def filter_ptme_data(
     df['site'] = df['site'].str.upper()
     print(f"After excluding closed site: {df.shape[0]} observations")
     # Export to Excel
-    df.to_excel(output_file, index=False)
+    export_excel(df, output_file)
     print(f"Filtered data exported to {output_file}")
 
     return df
@@ -85,9 +85,7 @@ pregnancy_url ='https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/8d0dd
 auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
 # Define parameters to filter inactive, non-graduated groups
 params = {}
-pregnancy_woman = get_commcare_odata(pregnancy_url, auth, params)
-pregnancy_woman = pd.DataFrame(pregnancy_woman)
-pregnancy_woman.columns = [col.replace(' ', '_') for col in pregnancy_woman.columns]
+pregnancy_woman = sync_commcare_odata(pregnancy_url, auth, params, feed_name='ptme_pregnancy', as_frame=True)
 print(f'This Household dataset has {pregnancy_woman.shape[0]} observations')
 pregnancy_woman.head(2)
 
@@ -155,7 +153,8 @@ print(ptme_enceinte.head(2))
 env_path = 'dot.env'
 sql_file_path = './Mastersheet PTME.sql'
 
-ptme = execute_sql_query(env_path, sql_file_path)
+# Lecture par blocs : dates et codes arrivent typés (caris_fonctions.SQL_SCHEMAS)
+ptme = execute_sql_query(env_path, sql_file_path, chunksize=50000)
 duplicates = ptme.columns[ptme.columns.duplicated()].tolist()
 if duplicates:
     print("Attention : des colonnes en double ont été trouvées dans le DataFrame.")
@@ -169,10 +168,6 @@ print(ptme.shape[0])
 print(ptme.head(2))
 
 
-# Conversion des colonnes en datetime
-ptme['DPA_calculated'] = pd.to_datetime(ptme['DPA_calculated'], errors='coerce')
-ptme['actual_delivery_date'] = pd.to_datetime(ptme['actual_delivery_date'], errors='coerce')
-
 # Définir les bornes de date
 start_date = pd.to_datetime("2024-01-01")
 end_date = pd.to_datetime(datetime.today().date())
@@ -187,7 +182,6 @@ delinquency = ptme[
 
 # Nombre de cas trouvés
 delinquency.shape[0]
-delinquency.to_excel("delinquency.xlsx", index=False)
 
 
 # In[8]:
@@ -222,7 +216,7 @@ ptme_enceinte['patient_code'] = ptme_enceinte['patient_code'].str.upper()
 ptme_enceinte = filter_ptme_data(ptme_enceinte)
 
 delinquency = filter_ptme_data(delinquency)
-delinquency.to_excel("delinquency.xlsx",index=True)
+export_excel(delinquency, "delinquency.xlsx", index=True)
 
 # In[ ]:
 
@@ -259,9 +253,9 @@ print(ptme_enceinte["is_in_club"].value_counts())
 # In[12]:
 
 
-ptme_enceinte.to_excel('ptme_enceinte.xlsx', index=False)
-woman_in_club.to_excel('woman_in_club.xlsx', index=False)
-ptme_not_in_club.to_excel('ptme_not_in_club.xlsx', index=False)
+export_excel(ptme_enceinte, 'ptme_enceinte.xlsx')
+export_excel(woman_in_club, 'woman_in_club.xlsx')
+export_excel(ptme_not_in_club, 'ptme_not_in_club.xlsx')
 
 
 # ##### **COMPTAGE DE MENAGE**
@@ -278,7 +272,7 @@ path = f"C:\\Users\\moise\\Downloads\\caris-meal-app\\data\\PTME WITH PATIENT CO
 base_path = "C:\\Users\\moise\\Downloads\\caris-meal-app\\data"
 path = f"{base_path}\\PTME WITH PATIENT CODE {today_str}.xlsx"
 
-caseid = pd.read_excel(os.path.expanduser(path))
+caseid = read_excel_cached(path)
 caseid = caseid.rename(columns={
     'caseid': 'case_id',
     'health_id': 'patient_code'
@@ -295,11 +289,8 @@ ajout_url ='https://www.commcarehq.org/a/caris-test/api/odata/forms/v1/9387f1f83
 auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
 # Define parameters to filter inactive, non-graduated groups
 params = {}
-ajout = get_commcare_odata(ajout_url, auth, params)
-ajout = pd.DataFrame(ajout)
-ajout.columns = [col.replace(' ', '_') for col in ajout.columns]
-# Assuming 'df' is your DataFrame
-ajout.columns = ajout.columns.str.replace('form_', '', regex=False)
+ajout = sync_commcare_odata(ajout_url, auth, params, key_field='formid', modified_field='received_on', feed_name='ptme_ajout',
+                            as_frame=True, strip_form_prefix=True)
 print(f'This dataset dataset has {ajout.shape[0]} observations')
 ajout.head(1)
 
@@ -315,13 +306,14 @@ ajout.rename(columns={'full_code_patient_menage': 'patient_code'}, inplace=True)
 # In[17]:
 
 
-ajout.to_excel('ajout.xlsx', index = False)
+export_excel(ajout, 'ajout.xlsx')
 
 
 # In[30]:
 
 
-merged_df_ajout_child = pd.merge(ajout, caseid[['caseid', 'patient_code']], on='caseid', how='left', suffixes=('_x', '_y')).drop_duplicates('caseid').fillna(0)
+merged_df_ajout_child = pd.merge(ajout, caseid[['caseid', 'patient_code']], on='caseid', how='left', suffixes=('_x', '_y')).drop_duplicates('caseid')
+merged_df_ajout_child = merged_df_ajout_child.fillna({c: 0 for c in merged_df_ajout_child.columns.difference(ajout.columns)})
 print(f'The merged dataset has {merged_df_ajout_child.shape[0]} observations')
 merged_df_ajout_child = merged_df_ajout_child.iloc[:, :-1]
 merged_df_ajout_child.head(2)
@@ -330,7 +322,10 @@ merged_df_ajout_child.head(2)
 # In[31]:
 
 
-woman_in_club_with_casied = pd.merge(woman_in_club, caseid[['caseid', 'patient_code']], on='patient_code', how='left', suffixes=('_x', '_y')).drop_duplicates('patient_code').fillna(0)
+# Seules les colonnes apportées par caseid reçoivent 0 : les colonnes catégorielles
+# du SQL (office, commune...) refusent une nouvelle catégorie 0
+woman_in_club_with_casied = pd.merge(woman_in_club, caseid[['caseid', 'patient_code']], on='patient_code', how='left', suffixes=('_x', '_y')).drop_duplicates('patient_code')
+woman_in_club_with_casied = woman_in_club_with_casied.fillna({c: 0 for c in woman_in_club_with_casied.columns.difference(woman_in_club.columns)})
 print(f'The merged dataset has {woman_in_club_with_casied.shape[0]} observations')
 woman_in_club_with_casied.head(2)
 
@@ -339,7 +334,7 @@ ptme_sans_comptage = woman_in_club[~woman_in_club['patient_code'].str.lower().is
 ptme_sans_comptage['patient_code'] = ptme_sans_comptage['patient_code'].str.upper()
 ptme_sans_comptage.shape[0]
 
-ptme_sans_comptage.to_excel('ptme_sans_comptage.xlsx', index=False)
+export_excel(ptme_sans_comptage, 'ptme_sans_comptage.xlsx')
 
 
 # In[36]:
@@ -352,14 +347,12 @@ ptme_avec_comptage.shape[0]
 # In[37]:
 
 
-ptme_avec_comptage.to_excel('ptme_avec_comptage.xlsx', index=False)
+export_excel(ptme_avec_comptage, 'ptme_avec_comptage.xlsx')
 
 
 # In[38]:
 
 
-ptme_not_in_club.to_excel('ptme_not_in_club.xlsx', index=False)
-
 
 # In[39]:
 
@@ -380,7 +373,7 @@ ptme_enceinte_merge = pd.merge(
 )
 
 # (Optionnel) Supprimer la colonne intermédiaire
-ptme_enceinte_merge.to_excel('ptme_enceinte_merge.xlsx', index=False)
+export_excel(ptme_enceinte_merge, 'ptme_enceinte_merge.xlsx')
 
 
 # In[41]:
@@ -403,11 +396,10 @@ hh_ptme_url ='https://www.commcarehq.org/a/caris-test/api/odata/cases/v1/ee225c4
 auth = (os.getenv('CC_USERNAME'), os.getenv('CC_PASSWORD'))
 # Define parameters to filter inactive, non-graduated groups
 params = {}
-hh_ptme = get_commcare_odata(hh_ptme_url, auth, params)
-hh_ptme = pd.DataFrame(hh_ptme)
-hh_ptme.columns = [col.replace(' ', '_') for col in hh_ptme.columns]
+hh_ptme = sync_commcare_odata(hh_ptme_url, auth, params, feed_name='ptme_hh', as_frame=True)
 print(f'This Household dataset has {hh_ptme.shape[0]} observations')
 hh_ptme.head(2)
+print_request_metrics()
 
 
 # In[43]:
@@ -434,7 +426,7 @@ hh_depistage.shape[0]
 # In[45]:
 
 
-hh_depistage.to_excel('hh_depistage.xlsx', index=False)
+export_excel(hh_depistage, 'hh_depistage.xlsx')
 
 
 # In[46]:
@@ -454,6 +446,9 @@ ptme_no_depistage = woman_in_club[~woman_in_club['patient_code'].str.lower().isi
 # Mets patient_code en majuscules
 ptme_no_depistage.shape[0]
 
+# Fin des écritures Excel lancées en parallèle
+wait_for_exports()
+
 
 # In[48]:
 
@@ -8,6 +8,7 @@ Date: 2025
 
 import os
 import sys
+import argparse
 import subprocess
 import platform
 import time
@@ -384,10 +385,28 @@ def run_shell_script():
         print(f"❌ Erreur lors de l'exécution: {e}")
         return False
 
+def parse_args():
+    """Options de la ligne de commande."""
+    parser = argparse.ArgumentParser(description="Exécution complète des pipelines et rapports CARIS")
+    parser.add_argument('--sql-cache', action='store_true',
+                        help="Réutiliser les résultats SQL mis en cache (SQL_CACHE_TTL) au lieu d'interroger MySQL")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Ignorer le cache SQL : relire depuis MySQL et remplacer les entrées en cache")
+    return parser.parse_args()
+
 def main():
     """Fonction principale."""
+    args = parse_args()
     print("🔄 CARIS Dashboard - Exécution complète avec Git")
     print("=" * 60)
+
+    # Les pipelines lancés par run_all.sh héritent de ces variables (voir caris_fonctions.execute_sql_query)
+    if args.sql_cache or args.refresh:
+        os.environ['SQL_CACHE'] = '1'
+        print("🗄️ Cache SQL activé")
+    if args.refresh:
+        os.environ['SQL_CACHE_REFRESH'] = '1'
+        print("🔄 Rafraîchissement du cache SQL demandé")
     
     # Changer vers le répertoire du script
     script_dir = Path(__file__).parent
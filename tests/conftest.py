@@ -0,0 +1,75 @@
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def _install_selenium_placeholders():
+    """
+    Les modules testés importent Selenium au chargement ; sans le paquet, on
+    enregistre des modules vides pour pouvoir les importer (les tests ne
+    pilotent jamais de vrai navigateur).
+    """
+    try:
+        import selenium  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    class _Placeholder:
+        def __init__(self, *args, **kwargs):
+            pass
+
+    class By:
+        ID = 'id'
+        XPATH = 'xpath'
+        TAG_NAME = 'tag name'
+        CSS_SELECTOR = 'css selector'
+
+    names = {
+        'selenium': {},
+        'selenium.webdriver': {'Chrome': _Placeholder},
+        'selenium.webdriver.chrome': {},
+        'selenium.webdriver.chrome.options': {'Options': _Placeholder},
+        'selenium.webdriver.common': {},
+        'selenium.webdriver.common.by': {'By': By},
+        'selenium.webdriver.common.keys': {'Keys': _Placeholder},
+        'selenium.webdriver.common.action_chains': {'ActionChains': _Placeholder},
+        'selenium.webdriver.support': {},
+        'selenium.webdriver.support.ui': {'WebDriverWait': _Placeholder},
+        'selenium.webdriver.support.expected_conditions': {},
+        'selenium.common': {},
+        'selenium.common.exceptions': {
+            'TimeoutException': type('TimeoutException', (Exception,), {}),
+            'StaleElementReferenceException': type('StaleElementReferenceException', (Exception,), {}),
+        },
+    }
+    for name, attrs in names.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+    for name in names:
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, sys.modules[name])
+
+
+_install_selenium_placeholders()
+
+
+@pytest.fixture
+def download_dir(tmp_path, monkeypatch):
+    """DOWNLOAD_DIR de commcare_downloader redirigé vers un dossier vide (index et manifeste neufs)."""
+    import commcare_downloader
+
+    folder = str(tmp_path / 'data')
+    os.makedirs(folder)
+    monkeypatch.setattr(commcare_downloader, 'DOWNLOAD_DIR', folder)
+    monkeypatch.setattr(commcare_downloader, '_folder_index', None)
+    monkeypatch.setattr(commcare_downloader, '_download_manifest', None)
+    return folder
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import is_beneficiary_active, is_groupe_active
+
+START = pd.Timestamp('2024-04-01')
+END = pd.Timestamp('2024-06-30')
+
+
+# Versions ligne à ligne d'origine (start_date/end_date étaient des globales du module)
+def baseline_is_beneficiary_active(row, start_date, end_date):
+    if row['closed_date'] < start_date:
+        return "no"
+    if row["creation_date"] > end_date:
+        return "no"
+    if row['graduation_date'] > start_date:
+        return "yes"
+    if row['abandoned_date'] > start_date:
+        return "yes"
+    if row['inactive_date'] > start_date:
+        return "yes"
+    if row['inactive_date'] < start_date:
+        return "no"
+    if row['graduation_date'] < start_date:
+        return "no"
+    if (pd.isnull(row['is_inactive']) or row['is_inactive'] == 0) and (row['graduated'] == 0 or pd.isnull(row['graduated'])):
+        return "yes"
+    return "no"
+
+
+def baseline_is_groupe_active(row, start_date, end_date):
+    start_date_dt = pd.to_datetime(start_date)
+    end_date_dt = pd.to_datetime(end_date)
+    if row["office_name"] in ["CAY", "JER"]:
+        return "no"
+    if pd.notna(row['closed_date']) and row['closed_date'] < start_date_dt:
+        return "no"
+    if pd.notna(row['creation_date']) and row["creation_date"] > end_date_dt:
+        return "no"
+    if pd.notna(row['graduation_date']) and row['graduation_date'] > start_date_dt:
+        return "yes"
+    if pd.notna(row['inactive_date']) and row['inactive_date'] > start_date_dt:
+        return "yes"
+    if pd.notna(row['inactive_date']) and row['inactive_date'] < start_date_dt:
+        return "no"
+    if pd.notna(row['graduation_date']) and row['graduation_date'] < start_date_dt:
+        return "no"
+    if (pd.isnull(row['is_inactive']) or row['is_inactive'] == 0) and (row['is_graduated'] == 0 or pd.isnull(row['is_graduated'])):
+        return "yes"
+    return "no"
+
+
+def random_records(rng, size):
+    """Dates autour des bornes (bornes exactes et NaT compris), indicateurs 0/1/manquants."""
+    candidates = pd.to_datetime([START - pd.Timedelta(days=90), START, START + pd.Timedelta(days=10),
+                                 END, END + pd.Timedelta(days=30), pd.NaT])
+
+    def dates():
+        return pd.Series(candidates[rng.integers(0, len(candidates), size)])
+
+    def flags():
+        return pd.Series(rng.choice([0, 1, np.nan], size))
+
+    return pd.DataFrame({
+        'closed_date': dates(), 'creation_date': dates(), 'graduation_date': dates(),
+        'abandoned_date': dates(), 'inactive_date': dates(),
+        'is_inactive': flags(), 'graduated': flags(), 'is_graduated': flags(),
+        'office_name': rng.choice(['CAY', 'JER', 'PAP', 'GON', None], size),
+    })
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_beneficiary_rules_match_row_wise_baseline(seed):
+    df = random_records(np.random.default_rng(seed), 300)
+    expected = df.apply(baseline_is_beneficiary_active, axis=1, args=(START, END))
+    assert is_beneficiary_active(df, START, END).astype(str).tolist() == expected.tolist()
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_group_rules_match_row_wise_baseline(seed):
+    df = random_records(np.random.default_rng(seed), 300)
+    expected = df.apply(baseline_is_groupe_active, axis=1, args=(START, END))
+    assert is_groupe_active(df, START, END).astype(str).tolist() == expected.tolist()
+
+
+def test_rules_accept_text_dates_and_flags():
+    df = random_records(np.random.default_rng(0), 300)
+    expected = df.apply(baseline_is_groupe_active, axis=1, args=(START, END))
+    as_text = df.assign(**{c: df[c].dt.strftime('%Y-%m-%d') for c in ['closed_date', 'creation_date',
+                                                                       'graduation_date', 'inactive_date']},
+                        is_inactive=df['is_inactive'].map({0: '0', 1: '1'}))
+    assert is_groupe_active(as_text, '2024-04-01', '2024-06-30').astype(str).tolist() == expected.tolist()
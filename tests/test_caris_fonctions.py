@@ -0,0 +1,150 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event, text
+
+import caris_fonctions
+from caris_fonctions import SQL_SCHEMAS, _apply_sql_schema, execute_sql_query
+
+
+def _sql_frame():
+    schema = SQL_SCHEMAS['Charges_virales_pediatriques.sql']
+    df = pd.DataFrame({
+        'patient_code': ['A1', 'A2', 'A3'],
+        'office': ['CAP', None, 'GON'],
+        'commune': [None, 'Limbé', 'Gonaïves'],
+        'sex': ['F', 'M', None],
+        'age': ['4', None, '12'],
+    })
+    return _apply_sql_schema(df, schema)
+
+
+def test_schema_keeps_nulls_in_categorical_columns():
+    df = _sql_frame()
+    assert isinstance(df['office'].dtype, pd.CategoricalDtype)
+    assert df['office'].isna().tolist() == [False, True, False]
+    assert df['age'].dtype == 'float64'
+
+
+def test_left_merge_fills_only_added_columns():
+    df = _sql_frame()
+    caseid = pd.DataFrame({'patient_code': ['A1', 'A3'], 'caseid': ['c1', 'c3']})
+    merged = pd.merge(df, caseid, on='patient_code', how='left').drop_duplicates('patient_code')
+
+    with pytest.raises(TypeError):
+        merged.fillna(0)
+
+    # Motif utilisé par oev_pipeline et ptme_pipeline après leurs fusions
+    merged = merged.fillna({c: 0 for c in merged.columns.difference(df.columns)})
+    assert merged['caseid'].tolist() == ['c1', 0, 'c3']
+    assert merged['office'].isna().tolist() == [False, True, False]
+    assert isinstance(merged['sex'].dtype, pd.CategoricalDtype)
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """
+    execute_sql_query branché sur une base SQLite et un cache dans tmp_path ;
+    `queries` garde les SELECT qui atteignent la base.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'caris.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE patients (patient_code TEXT, age INTEGER)"))
+        conn.execute(text("INSERT INTO patients VALUES ('A1', 4), ('A2', 9), ('A3', 12)"))
+    queries = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statement.startswith('SELECT') and queries.append(statement))
+
+    monkeypatch.setattr(caris_fonctions, 'get_engine', lambda env_path: engine)
+    monkeypatch.setattr(caris_fonctions, 'load_db_settings', lambda env_path: ('caris', 'secret', 'db-host', 'caris_db'))
+    monkeypatch.setattr(caris_fonctions, 'SQL_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(caris_fonctions, '_cache_stats', {'hits': 0, 'misses': 0, 'bytes_saved': 0})
+    engine.queries = queries
+    yield engine
+    engine.dispose()
+
+
+def _sql_file(tmp_path, sql="SELECT patient_code, age FROM patients WHERE age >= :min_age ORDER BY patient_code"):
+    path = tmp_path / 'patients.sql'
+    path.write_text(sql)
+    return str(path)
+
+
+def _query(sql_file, **kwargs):
+    kwargs.setdefault('params', {'min_age': 5})
+    return execute_sql_query('dot.env', sql_file, cache=True, **kwargs)
+
+
+def _cache_files():
+    return sorted(os.listdir(caris_fonctions.SQL_CACHE_DIR))
+
+
+def test_cached_result_is_reused(sqlite_db, tmp_path):
+    sql_file = _sql_file(tmp_path)
+    first = _query(sql_file)
+    second = _query(sql_file)
+    assert len(sqlite_db.queries) == 1
+    pd.testing.assert_frame_equal(second, first)
+    assert first['patient_code'].tolist() == ['A2', 'A3']
+    assert caris_fonctions._cache_stats['hits'] == caris_fonctions._cache_stats['misses'] == 1
+
+
+def test_cache_key_follows_sql_text_and_params(sqlite_db, tmp_path):
+    sql_file = _sql_file(tmp_path)
+    _query(sql_file)
+    assert _query(sql_file, params={'min_age': 10})['patient_code'].tolist() == ['A3']
+    _sql_file(tmp_path, "SELECT patient_code, age FROM patients WHERE age < :min_age ORDER BY patient_code")
+    assert _query(sql_file)['patient_code'].tolist() == ['A1']
+    assert len(sqlite_db.queries) == 3
+    assert len(_cache_files()) == 3
+
+    # Le mot de passe ne fait pas partie de l'empreinte
+    key = caris_fonctions._sql_cache_key(('caris', 'secret', 'h', 'db'), 'SELECT 1', {'a': [1, 2]}, None, {})
+    assert key == caris_fonctions._sql_cache_key(('caris', 'autre', 'h', 'db'), 'SELECT 1', {'a': [1, 2]}, None, {})
+    assert key != caris_fonctions._sql_cache_key(('caris', 'secret', 'h', 'db'), 'SELECT 1', {'a': [1, 3]}, None, {})
+
+
+def test_expired_entry_is_read_again(sqlite_db, tmp_path, monkeypatch):
+    sql_file = _sql_file(tmp_path)
+    _query(sql_file)
+    monkeypatch.setattr(caris_fonctions, 'SQL_CACHE_TTL', 60)
+    path = os.path.join(caris_fonctions.SQL_CACHE_DIR, _cache_files()[0])
+    written = time.time() - 120
+    os.utime(path, (written, written))
+
+    _query(sql_file)
+    assert len(sqlite_db.queries) == 2
+    assert os.path.getmtime(path) > written
+
+
+def test_least_recently_read_entry_is_evicted(sqlite_db, tmp_path, monkeypatch):
+    sql_file = _sql_file(tmp_path)
+    _query(sql_file, params={'min_age': 1})
+    first = _cache_files()[0]
+    size = os.path.getsize(os.path.join(caris_fonctions.SQL_CACHE_DIR, first))
+    monkeypatch.setattr(caris_fonctions, 'SQL_CACHE_MAX_BYTES', int(size * 2.5))
+
+    _query(sql_file, params={'min_age': 2})
+    second = next(name for name in _cache_files() if name != first)
+    time.sleep(0.01)
+    _query(sql_file, params={'min_age': 1})  # relu : devient le plus récent
+    _query(sql_file, params={'min_age': 3})
+
+    assert first in _cache_files() and second not in _cache_files()
+    assert len(_cache_files()) == 2
+    assert len(sqlite_db.queries) == 3
+
+
+def test_refresh_reads_the_database_and_replaces_the_entry(sqlite_db, tmp_path):
+    sql_file = _sql_file(tmp_path)
+    _query(sql_file)
+    with sqlite_db.begin() as conn:
+        conn.execute(text("INSERT INTO patients VALUES ('A4', 7)"))
+    assert _query(sql_file)['patient_code'].tolist() == ['A2', 'A3']
+
+    assert _query(sql_file, refresh=True)['patient_code'].tolist() == ['A2', 'A3', 'A4']
+    assert _query(sql_file)['patient_code'].tolist() == ['A2', 'A3', 'A4']
+    assert len(sqlite_db.queries) == 2
+    assert len(_cache_files()) == 1
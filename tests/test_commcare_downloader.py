@@ -0,0 +1,203 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+import commcare_downloader
+from download_folder import PARTIAL_SUFFIX, today_str
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASES = [f'Export {i}' for i in range(6)]
+
+
+def _export_name(base):
+    return f'{base} (created 2025-01-01) {today_str()}.xlsx'
+
+
+class FakeDriver:
+    def __init__(self, download_dir):
+        self.download_dir = download_dir
+        self.downloads = []
+        self.quit_called = False
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeBrowsers:
+    """Fabrique de navigateurs : chaque téléchargement écrit un .crdownload puis le renomme, comme Chrome."""
+
+    def __init__(self, failing_logins=0, delay=0.1):
+        self.drivers = []
+        self.failing_logins = failing_logins
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def start_chrome(self, download_dir, headless=False):
+        driver = FakeDriver(download_dir)
+        with self.lock:
+            self.drivers.append(driver)
+        return driver
+
+    def commcare_login(self, driver, email, password, first_export_url):
+        with self.lock:
+            if self.failing_logins:
+                self.failing_logins -= 1
+                raise RuntimeError("Échec d'authentification")
+
+    def trigger_download(self, export_base, driver):
+        driver.downloads.append(export_base)
+        final = os.path.join(driver.download_dir, _export_name(export_base))
+
+        def download():
+            shutil.copyfile(os.path.join(ROOT, 'username.xlsx'), final + PARTIAL_SUFFIX)
+            time.sleep(self.delay)
+            os.replace(final + PARTIAL_SUFFIX, final)
+
+        threading.Thread(target=download, daemon=True).start()
+
+
+@pytest.fixture
+def browsers(download_dir, monkeypatch):
+    fake = FakeBrowsers()
+    monkeypatch.setattr(commcare_downloader, 'start_chrome', fake.start_chrome)
+    monkeypatch.setattr(commcare_downloader, 'commcare_login', fake.commcare_login)
+    monkeypatch.setattr(commcare_downloader, 'trigger_download', fake.trigger_download)
+    monkeypatch.setattr(commcare_downloader, 'EXPECTED_BASES', BASES)
+    monkeypatch.setattr(commcare_downloader, 'EXPORT_URLS', {b: f'https://example.org/{i}/' for i, b in enumerate(BASES)})
+    monkeypatch.setattr(commcare_downloader, 'VERIFICATION_TIMEOUT', 5)
+    monkeypatch.setattr(commcare_downloader, 'RETRY_BACKOFF_SECONDS', 0)
+    return fake
+
+
+def test_sessions_share_the_queue_and_move_files_into_place(browsers, download_dir):
+    succeeded, failed = commcare_downloader.run_parallel_downloads(BASES, 'me@example.org', 'pw', sessions=3)
+
+    assert (succeeded, failed) == (BASES, [])
+    assert len(browsers.drivers) == 3
+    assert all(driver.quit_called for driver in browsers.drivers)
+    assert sorted(b for driver in browsers.drivers for b in driver.downloads) == sorted(BASES)
+    assert sum(1 for driver in browsers.drivers if driver.downloads) > 1
+    assert sorted(f for f in os.listdir(download_dir) if f.endswith('.xlsx')) == sorted(map(_export_name, BASES))
+    for driver in browsers.drivers:
+        assert os.path.dirname(driver.download_dir) == os.path.join(download_dir, commcare_downloader.SESSIONS_SUBDIR)
+        assert os.listdir(driver.download_dir) == []
+
+
+def test_failed_login_returns_the_base_to_the_other_sessions(browsers):
+    browsers.failing_logins = 1
+    succeeded, failed = commcare_downloader.run_parallel_downloads(BASES, 'me@example.org', 'pw', sessions=3)
+
+    assert (succeeded, failed) == (BASES, [])
+    assert sum(1 for driver in browsers.drivers if not driver.downloads) == 1
+    assert all(driver.quit_called for driver in browsers.drivers)
+
+
+def test_every_base_fails_when_no_session_can_log_in(browsers):
+    browsers.failing_logins = 3
+    succeeded, failed = commcare_downloader.run_parallel_downloads(BASES, 'me@example.org', 'pw', sessions=3)
+    assert (succeeded, failed) == ([], BASES)
+
+
+class FakeElement:
+    def __init__(self, name, displayed=True, **attributes):
+        self.name = name
+        self.displayed = displayed
+        self.attributes = attributes
+
+    def is_displayed(self):
+        return self.displayed
+
+    def is_enabled(self):
+        return True
+
+    def get_attribute(self, name):
+        return self.attributes.get(name)
+
+
+class FakeExportPage:
+    """
+    Page d'export CommCare : liens « Download » de la navigation toujours
+    visibles, puis la modale dont la barre de progression atteint 100 % et
+    le lien du fichier apparaît au balayage `ready_after`.
+    """
+
+    NAV = {
+        "a[href*='download']": [FakeElement('nav-download', href='/a/test/data/export/custom/new/form/download/')],
+        "//button[contains(., 'Download') or contains(., 'Télécharger')]": [FakeElement('nav-button')],
+    }
+
+    def __init__(self, ready_after, file_link=True):
+        self.ready_after = ready_after
+        self.file_link = file_link
+        self.scans = 0
+        self.clicked = []
+
+    def find_elements(self, by, value):
+        if value == "#download-progress a[href$='.xlsx']":
+            self.scans += 1
+        ready = self.scans > self.ready_after
+        modal = {
+            "#download-progress .progress-bar": [FakeElement('bar', **{'aria-valuenow': '100' if ready else '40'})],
+            "#download-progress form a": [FakeElement('form-link')],
+            "#download-progress a[href$='.xlsx']":
+                [FakeElement('file-link', href='/file.xlsx')] if ready and self.file_link else [],
+        }
+        return modal.get(value) or self.NAV.get(value, [])
+
+    def execute_script(self, script, element):
+        if 'click()' in script:
+            self.clicked.append(element.name)
+
+
+@pytest.fixture
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(commcare_downloader, 'LINK_POLL_INTERVAL', 0.01)
+
+
+def test_download_link_waits_for_the_modal_despite_decoy_nav_links(fast_polling):
+    page = FakeExportPage(ready_after=5)
+    assert commcare_downloader.click_any_download_link(page, timeout_seconds=5)
+    assert page.clicked == ['file-link']
+    assert page.scans > 5
+
+
+def test_form_link_is_only_clicked_once_the_progress_bar_is_full(fast_polling):
+    page = FakeExportPage(ready_after=3, file_link=False)
+    assert commcare_downloader.click_any_download_link(page, timeout_seconds=5)
+    assert page.clicked == ['form-link']
+    assert page.scans == 4
+
+
+def test_no_click_when_only_page_links_are_visible(fast_polling):
+    page = FakeExportPage(ready_after=10 ** 6)
+    assert not commcare_downloader.click_any_download_link(page, timeout_seconds=0.2)
+    assert page.clicked == []
+
+
+def test_resume_removes_corrupt_exports_and_queues_them_again(download_dir, monkeypatch):
+    bases = ['Export 0', 'Export 1', 'Export 2', 'Export 3']
+    monkeypatch.setattr(commcare_downloader, 'EXPECTED_BASES', bases)
+    with open(os.path.join(ROOT, 'username.xlsx'), 'rb') as f:
+        xlsx = f.read()
+    contents = {'Export 0': xlsx, 'Export 1': xlsx[:len(xlsx) // 2], 'Export 2': b'<html>login</html>'}
+    for base, data in contents.items():
+        with open(os.path.join(download_dir, _export_name(base)), 'wb') as f:
+            f.write(data)
+    manifest = commcare_downloader.download_manifest()
+    manifest.finish('Export 0', os.path.join(download_dir, _export_name('Export 0')))
+    # Entrée périmée : export d'hier vérifié puis supprimé
+    yesterday = os.path.join(download_dir, 'Export 3 (created 2025-01-01) 2025-01-01.xlsx')
+    shutil.copyfile(os.path.join(ROOT, 'username.xlsx'), yesterday)
+    manifest.finish('Export 3', yesterday)
+    os.remove(yesterday)
+
+    commcare_downloader.verify_present_downloads(download_dir)
+
+    missing, present = commcare_downloader.check_existing_files(bases, download_dir)
+    assert missing == ['Export 1', 'Export 2', 'Export 3']
+    assert present['Export 0'] == [_export_name('Export 0')]
+    assert sorted(os.listdir(download_dir)) == ['.download_manifest.json', _export_name('Export 0')]
+    assert manifest.entries['Export 1']['status'] == manifest.entries['Export 2']['status'] == 'corrupt'
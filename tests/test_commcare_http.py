@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, urlsplit
+
+import pytest
+import requests
+
+import commcare_downloader
+import commcare_http
+import utils
+from download_folder import PARTIAL_SUFFIX, today_str
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+with open(os.path.join(ROOT, 'username.xlsx'), 'rb') as _f:
+    XLSX = _f.read()
+
+
+class CommCareStandIn(ThreadingHTTPServer):
+    """
+    Serveur CommCare local : connexion (csrftoken puis sessionid), préparation,
+    interrogation de l'état (prête après `polls_before_ready` réponses) et fichier.
+    """
+
+    def __init__(self, password='pw', polls_before_ready=2):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.password = password
+        self.polls_before_ready = polls_before_ready
+        self.files = {}
+        self.polls = {}
+        self.prepared = []
+        self.truncate = False
+        self.on_half_sent = None
+
+    @property
+    def root(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def export(self, export_id, filename):
+        self.files[export_id] = filename
+        return f'{self.root}/a/test/data/export/custom/new/form/download/{export_id}/'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, payload):
+        self._send(200, json.dumps(payload).encode(), [('Content-Type', 'application/json')])
+
+    def _logged_in(self):
+        return 'sessionid=abc' in self.headers.get('Cookie', '')
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query))
+        if parts.path == '/accounts/login/':
+            return self._send(200, b'login', [('Set-Cookie', 'csrftoken=tok; Path=/')])
+        if parts.path == '/a/test/dashboard/':
+            return self._send(200, b'dashboard')
+        if not self._logged_in():
+            return self._send(403)
+        if parts.path == '/a/test/data/export/custom/poll_custom_export_download/':
+            download_id = query['download_id']
+            server.polls[download_id] = server.polls.get(download_id, 0) + 1
+            if server.polls[download_id] <= server.polls_before_ready:
+                return self._json({'is_ready': False, 'progress': {'percent': 50}})
+            return self._json({'is_ready': True, 'has_file': True,
+                               'download_url': f'/a/test/retrieve/{download_id}/?get_file'})
+        if parts.path.startswith('/a/test/retrieve/'):
+            name = server.files[parts.path.split('/')[4]]
+            length = len(XLSX) + (1000 if server.truncate else 0)
+            self.send_response(200)
+            self.send_header('Content-Disposition', "attachment; filename*=UTF-8''" + quote(name))
+            self.send_header('Content-Length', str(length))
+            self.end_headers()
+            half = len(XLSX) // 2
+            self.wfile.write(XLSX[:half])
+            self.wfile.flush()
+            if server.on_half_sent:
+                server.on_half_sent()
+            self.wfile.write(XLSX[half:])
+            self.close_connection = True
+            return
+        self._send(404)
+
+    def do_POST(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        data = dict(parse_qsl(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()))
+        if parts.path == '/accounts/login/':
+            if data.get('csrfmiddlewaretoken') != 'tok' or data.get('auth-password') != server.password:
+                return self._send(200, b'login')
+            return self._send(302, headers=[('Set-Cookie', 'sessionid=abc; Path=/'),
+                                            ('Location', '/a/test/dashboard/')])
+        if parts.path == '/a/test/data/export/custom/prepare_custom_export/':
+            if not self._logged_in() or self.headers.get('X-CSRFToken') != 'tok':
+                return self._send(403)
+            export_id = json.loads(data['exportList'])[0]['export_id']
+            server.prepared.append(export_id)
+            return self._json({'success': True, 'download_id': export_id})
+        self._send(404)
+
+
+@pytest.fixture
+def commcare(monkeypatch):
+    server = CommCareStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Session HTTP neuve (cookies) pour chaque test
+    monkeypatch.setattr(utils, '_session', None)
+    monkeypatch.setattr(commcare_http, 'POLL_INTERVAL', 0.01)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _export_name(base):
+    return f'{base} (created 2025-01-01) {today_str()}.xlsx'
+
+
+def test_poll_waits_until_the_export_is_ready(commcare):
+    export_url = commcare.export('aa01', 'x.xlsx')
+    commcare_http.login('me@example.org', 'pw', commcare.root)
+    download_id = commcare_http.prepare_export(export_url)
+
+    download_url = commcare_http.poll_export(export_url, download_id, timeout=5)
+    assert download_url == f'{commcare.root}/a/test/retrieve/aa01/?get_file'
+    assert commcare.polls['aa01'] == commcare.polls_before_ready + 1
+
+
+def test_poll_gives_up_after_the_timeout(commcare):
+    commcare.polls_before_ready = 10 ** 6
+    export_url = commcare.export('aa01', 'x.xlsx')
+    commcare_http.login('me@example.org', 'pw', commcare.root)
+    with pytest.raises(TimeoutError):
+        commcare_http.poll_export(export_url, commcare_http.prepare_export(export_url), timeout=0.1)
+
+
+def test_stream_writes_a_partial_file_then_renames_it(commcare, tmp_path, monkeypatch):
+    monkeypatch.setattr(commcare_http, 'CHUNK_SIZE', 1024)
+    export_url = commcare.export('aa01', 'Visite Enfant.xlsx')
+    seen = []
+
+    def list_folder_mid_transfer():
+        deadline = time.time() + 2
+        while time.time() < deadline and not os.listdir(tmp_path):
+            time.sleep(0.01)
+        seen.extend(os.listdir(tmp_path))
+
+    commcare.on_half_sent = list_folder_mid_transfer
+    commcare_http.login('me@example.org', 'pw', commcare.root)
+    path = commcare_http.download_export(export_url, str(tmp_path), timeout=5)
+
+    assert seen == ['Visite Enfant.xlsx' + PARTIAL_SUFFIX]
+    assert path == str(tmp_path / 'Visite Enfant.xlsx')
+    assert os.listdir(tmp_path) == ['Visite Enfant.xlsx']
+    with open(path, 'rb') as f:
+        assert f.read() == XLSX
+
+
+def test_content_length_mismatch_leaves_no_file(commcare, tmp_path):
+    commcare.truncate = True
+    export_url = commcare.export('aa01', 'Visite Enfant.xlsx')
+    commcare_http.login('me@example.org', 'pw', commcare.root)
+    with pytest.raises((RuntimeError, requests.RequestException)):
+        commcare_http.download_export(export_url, str(tmp_path), timeout=5)
+    assert os.listdir(tmp_path) == []
+
+
+def test_run_http_downloads_records_each_export(commcare, download_dir, monkeypatch):
+    bases = ['Visite Enfant', 'Appels OEV']
+    urls = {base: commcare.export(f'ab0{i}', _export_name(base)) for i, base in enumerate(bases)}
+    monkeypatch.setattr(commcare_downloader, 'EXPORT_URLS', urls)
+    monkeypatch.setattr(commcare_downloader, 'EXPECTED_BASES', bases)
+
+    succeeded, failed = commcare_downloader.run_http_downloads(bases, 'me@example.org', 'pw')
+    assert (succeeded, failed) == (bases, [])
+    assert sorted(os.listdir(download_dir)) == sorted(
+        [_export_name(b) for b in bases] + ['.download_manifest.json'])
+    manifest = commcare_downloader.download_manifest()
+    assert all(manifest.is_verified(b, os.path.join(download_dir, _export_name(b))) for b in bases)
+
+
+def test_auth_failure_falls_back_to_selenium(commcare, download_dir, monkeypatch, tmp_path):
+    bases = ['Visite Enfant', 'Appels OEV']
+    urls = {base: commcare.export(f'ab0{i}', _export_name(base)) for i, base in enumerate(bases)}
+    monkeypatch.setattr(commcare_downloader, 'EXPORT_URLS', urls)
+    monkeypatch.setattr(commcare_downloader, 'EXPECTED_BASES', bases)
+
+    assert commcare_downloader.run_http_downloads(bases, 'me@example.org', 'wrong') == ([], bases)
+    assert commcare.prepared == []
+
+    # main_enhanced confie alors toutes les bases aux sessions Selenium
+    handed_over = []
+
+    def selenium_downloads(files, email, password):
+        handed_over.append(list(files))
+        return [], list(files)
+
+    monkeypatch.setattr(commcare_downloader, 'run_parallel_downloads', selenium_downloads)
+    monkeypatch.setattr(commcare_downloader, 'PARALLEL_SESSIONS', 2)
+    monkeypatch.setattr(commcare_downloader, 'MAX_GLOBAL_PASSES', 1)
+    monkeypatch.setattr(commcare_downloader, 'DOWNLOAD_BACKEND', 'http')
+    monkeypatch.setenv('EMAIL', 'me@example.org')
+    monkeypatch.setenv('PASSWORD', 'wrong')
+    monkeypatch.chdir(tmp_path)
+    commcare_downloader.main_enhanced()
+    assert handed_over == [bases]
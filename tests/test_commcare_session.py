@@ -0,0 +1,147 @@
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+
+import utils
+
+
+class ApiStandIn(ThreadingHTTPServer):
+    """
+    API CommCare locale : chaque chemin rejoue une suite de réponses
+    (statut, en-têtes, latence) puis répond 200 ; les connexions ouvertes
+    sont comptées pour vérifier le keep-alive.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.scripts = {}
+        self.hits = {}
+        self.connections = 0
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+    def script(self, path, *responses):
+        self.scripts[path] = list(responses)
+        return self.url(path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        path = urlsplit(self.path).path
+        server.hits[path] = server.hits.get(path, 0) + 1
+        script = server.scripts.get(path, [])
+        status, headers, latency = script.pop(0) if script else (200, {}, 0)
+        time.sleep(latency)
+        body = b'{"value": []}' if status == 200 else b'error'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    server = ApiStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(utils, '_session', None)
+    utils.get_request_metrics(reset=True)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Délais d'attente demandés par commcare_get, sans attendre réellement."""
+    delays = []
+    monkeypatch.setattr(utils, 'time', types.SimpleNamespace(sleep=delays.append, perf_counter=time.perf_counter))
+    return delays
+
+
+AUTH = ('me@example.org', 'key')
+
+
+def test_retry_after_is_honoured_on_429(api, sleeps):
+    url = api.script('/odata/', (429, {'Retry-After': '7'}, 0), (429, {'Retry-After': '3'}, 0))
+    response = utils.commcare_get(url, AUTH, max_retries=3)
+    assert response.status_code == 200
+    assert sleeps == [7.0, 3.0]
+    assert api.hits['/odata/'] == 3
+
+
+def test_retry_after_is_capped(api, sleeps):
+    url = api.script('/odata/', (429, {'Retry-After': '3600'}, 0))
+    utils.commcare_get(url, AUTH, max_retries=1)
+    assert sleeps == [utils.HTTP_BACKOFF_MAX]
+
+
+def test_server_errors_back_off_exponentially(api, sleeps):
+    url = api.script('/odata/', (503, {}, 0), (500, {}, 0), (502, {}, 0))
+    assert utils.commcare_get(url, AUTH, max_retries=3).status_code == 200
+    assert len(sleeps) == 3
+    for attempt, delay in enumerate(sleeps):
+        backoff = utils.HTTP_BACKOFF_FACTOR * 2 ** attempt
+        assert backoff <= delay <= backoff * 1.5
+
+
+def test_gives_up_after_max_retries(api, sleeps):
+    url = api.script('/odata/', *[(503, {}, 0)] * 5)
+    with pytest.raises(requests.HTTPError) as excinfo:
+        utils.commcare_get(url, AUTH, max_retries=2)
+    assert excinfo.value.response.status_code == 503
+    assert api.hits['/odata/'] == 3
+    assert len(sleeps) == 2
+
+
+def test_client_errors_are_not_retried(api, sleeps):
+    url = api.script('/odata/', (404, {}, 0))
+    with pytest.raises(requests.HTTPError):
+        utils.commcare_get(url, AUTH, max_retries=3)
+    assert api.hits['/odata/'] == 1
+    assert sleeps == []
+
+
+def test_metrics_record_latency_and_retries(api, sleeps):
+    url = api.script('/odata/', (503, {}, 0), (200, {}, 0.2))
+    utils.commcare_get(url + '?$skip=0', AUTH, max_retries=2)
+
+    metrics = utils.get_request_metrics(reset=True)
+    assert metrics['status_code'].tolist() == [503, 200]
+    assert metrics['attempt'].tolist() == [0, 1]
+    assert metrics['url'].unique().tolist() == [url]
+    assert metrics['elapsed'].iloc[1] >= 0.2
+    assert metrics['bytes'].iloc[1] == len(b'{"value": []}')
+    assert utils.get_request_metrics().empty
+
+
+def test_slow_response_times_out_then_retries(api, sleeps):
+    url = api.script('/odata/', (200, {}, 1.0))
+    response = utils.commcare_get(url, AUTH, max_retries=1, timeout=0.3)
+    assert response.status_code == 200
+    assert len(sleeps) == 1
+    assert utils.get_request_metrics()['status_code'].isna().tolist() == [True, False]
+
+
+def test_session_is_shared_and_keeps_connections_alive(api, sleeps):
+    assert utils.get_commcare_session() is utils.get_commcare_session()
+    for _ in range(5):
+        utils.commcare_get(api.url('/odata/'), AUTH)
+    assert api.connections == 1
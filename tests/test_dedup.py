@@ -0,0 +1,148 @@
+import pandas as pd
+import pytest
+
+import dedup
+from dedup import detecter_doublons_avec_groupes, detecter_doublons_incremental, mesurer_rappel
+
+COLONNES = ['name', 'commune', 'username']
+
+
+def _enfants():
+    """
+    Deux blocs (commune, agent) avec des quasi-doublons dans chacun, et les
+    mêmes noms répétés dans un autre bloc (jamais regroupés : la commune diffère).
+    """
+    rows = [
+        ('c01', 'Jean Baptiste Pierre', 'Limbé', 'agent1'),
+        ('c02', 'Jean Baptiste  Piere', 'Limbe', 'agent1'),
+        ('c03', 'jean-baptiste pierre', 'LIMBÉ', 'agent1'),
+        ('c04', 'Marie Louise Joseph', 'Limbé', 'agent1'),
+        ('c05', 'Marie Louise Josef', 'Limbé', 'agent1'),
+        ('c06', 'Rose Merlande Dorval', 'Limbé', 'agent1'),
+        ('c07', 'Jean Baptiste Pierre', 'Gonaïves', 'agent2'),
+        ('c08', 'Jean Baptist Pierre', 'Gonaives', 'agent2'),
+        ('c09', 'Marie Louise Joseph', 'Gonaïves', 'agent2'),
+        ('c10', 'Wilson Desir', 'Gonaïves', 'agent2'),
+        ('c11', 'Wilson Désir', 'Gonaïves', 'agent2'),
+        ('c12', 'Nadège Fleurant', 'Gonaïves', 'agent2'),
+    ]
+    return pd.DataFrame(rows, columns=['caseid', 'name', 'commune', 'username'])
+
+
+def _groupes(df):
+    """Groupes de caseid (ensemble d'ensembles, indépendant de la numérotation)."""
+    dup = df[df['duplicate_group_id'] > 0]
+    return {frozenset(g['caseid']) for _, g in dup.groupby('duplicate_group_id')}
+
+
+ATTENDUS = {
+    frozenset({'c01', 'c02', 'c03'}),
+    frozenset({'c04', 'c05'}),
+    frozenset({'c07', 'c08'}),
+    frozenset({'c10', 'c11'}),
+}
+
+
+def test_blocking_keeps_every_exhaustive_pair():
+    df = _enfants()
+    assert mesurer_rappel(df, COLONNES, threshold=90, workers=1)['rappel'] == 1.0
+
+    blocked = detecter_doublons_avec_groupes(df, COLONNES, threshold=90, workers=1)
+    exhaustive = detecter_doublons_avec_groupes(df, COLONNES, threshold=90, blocking=False, workers=1)
+    assert _groupes(blocked) == _groupes(exhaustive) == ATTENDUS
+
+
+def test_candidate_pairs_stay_within_blocks():
+    df_cmp = dedup._normalized_frame(_enfants(), COLONNES)
+    pairs = dedup.generer_paires_candidates(df_cmp, COLONNES)
+    assert all(df_cmp.iloc[i][['commune', 'username']].tolist() == df_cmp.iloc[j][['commune', 'username']].tolist()
+               for i, j in pairs)
+    # Les noms du premier bloc répétés dans le second ne sont jamais comparés
+    assert (0, 6) not in pairs and (3, 8) not in pairs
+
+
+def test_parallel_scoring_matches_single_process(monkeypatch):
+    monkeypatch.setattr(dedup, 'PARALLEL_MIN_PAIRS', 0)
+    monkeypatch.setattr(dedup, 'SCORE_CHUNK_SIZE', 3)
+    df = pd.concat([_enfants()] * 3, ignore_index=True)
+    df['caseid'] = [f'c{i:02d}' for i in range(len(df))]
+    df['na'] = [None if i % 4 else 'x' for i in range(len(df))]
+
+    single = detecter_doublons_avec_groupes(df, COLONNES, threshold=90, return_only_duplicates=False, workers=1)
+    multi = detecter_doublons_avec_groupes(df, COLONNES, threshold=90, return_only_duplicates=False, workers=2)
+    assert multi['duplicate_group_id'].tolist() == single['duplicate_group_id'].tolist()
+
+    single = detecter_doublons_avec_groupes(df, COLONNES, threshold=90, keep_most_na=True, workers=1)
+    multi = detecter_doublons_avec_groupes(df, COLONNES, threshold=90, keep_most_na=True, workers=2)
+    pd.testing.assert_frame_equal(multi, single)
+
+
+def test_parallel_chunks_are_read_back_in_order(monkeypatch):
+    monkeypatch.setattr(dedup, 'PARALLEL_MIN_PAIRS', 0)
+    df_cmp = dedup._normalized_frame(_enfants(), COLONNES)
+    vals = df_cmp.values.astype(str)
+    # Toutes les paires : chaque lot de 2 va à l'un des processus
+    pairs = [(i, j) for i in range(len(vals)) for j in range(i + 1, len(vals))]
+
+    single = dedup._score_paires(vals, pairs, 90, dedup._similar)
+    assert len(single) > 1
+    assert dedup.score_paires_parallele(vals, pairs, 90, workers=2, chunk_size=2) == single
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / 'dedup_index.sqlite')
+
+
+def _incremental(df, index_path, threshold=90):
+    return detecter_doublons_incremental(df, COLONNES, threshold=threshold, index_name='nutrition',
+                                         index_path=index_path, return_only_duplicates=False, workers=1)
+
+
+def _complet(df, threshold=90):
+    return detecter_doublons_avec_groupes(df, COLONNES, threshold=threshold, return_only_duplicates=False, workers=1)
+
+
+def test_incremental_matches_full_run_on_new_rows(index_path, capsys):
+    df = _enfants()
+    assert _groupes(_incremental(df, index_path)) == ATTENDUS
+
+    nouveaux = pd.DataFrame([('c13', 'Nadege Fleurant', 'Gonaives', 'agent2'),
+                             ('c14', 'Rose Merlande Dorvale', 'Limbé', 'agent1')], columns=df.columns)
+    df = pd.concat([df, nouveaux], ignore_index=True)
+    capsys.readouterr()
+    result = _incremental(df, index_path)
+    assert '2 enregistrements nouveaux ou modifiés, 0 retirés' in capsys.readouterr().out
+    assert _groupes(result) == _groupes(_complet(df))
+    assert frozenset({'c12', 'c13'}) in _groupes(result)
+
+
+def test_modified_record_drops_its_old_links(index_path, capsys):
+    df = _enfants()
+    _incremental(df, index_path)
+
+    df.loc[df['caseid'] == 'c05', 'name'] = 'Guerline Saint Fort'
+    capsys.readouterr()
+    result = _incremental(df, index_path)
+    assert '1 enregistrements nouveaux ou modifiés, 1 retirés' in capsys.readouterr().out
+    assert _groupes(result) == _groupes(_complet(df))
+    assert frozenset({'c04', 'c05'}) not in _groupes(result)
+
+
+def test_removed_record_leaves_the_index(index_path):
+    df = _enfants()
+    _incremental(df, index_path)
+
+    df = df[df['caseid'] != 'c11'].reset_index(drop=True)
+    result = _incremental(df, index_path)
+    assert _groupes(result) == _groupes(_complet(df))
+    assert all('c10' not in g for g in _groupes(result))
+
+
+def test_config_change_rebuilds_the_index(index_path, capsys):
+    df = _enfants()
+    _incremental(df, index_path)
+    capsys.readouterr()
+    result = _incremental(df, index_path, threshold=80)
+    assert 'reconstruction complète' in capsys.readouterr().out
+    assert _groupes(result) == _groupes(_complet(df, threshold=80))
@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+
+import pytest
+
+import download_folder
+from download_folder import (PARTIAL_SUFFIX, DownloadManifest, DownloadWatcher, FolderIndex, assert_export_complete,
+                             check_xlsx, pattern_for_date)
+
+NAME = 'Visite Enfant (created 2025-01-01) 2025-08-14.xlsx'
+PATTERN = pattern_for_date('Visite Enfant', '2025-08-14')
+
+
+def _chrome_download(folder, name, delay=0.2, chunks=3):
+    """Comme Chrome : écrit <nom>.crdownload par morceaux puis le renomme."""
+    def run():
+        partial = os.path.join(folder, name + PARTIAL_SUFFIX)
+        time.sleep(delay)
+        with open(partial, 'wb') as f:
+            for _ in range(chunks):
+                f.write(b'x' * 1024)
+                f.flush()
+                time.sleep(0.05)
+        os.rename(partial, os.path.join(folder, name))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+@pytest.fixture(params=['watchdog', 'polling'])
+def watcher(request, tmp_path, monkeypatch):
+    if request.param == 'watchdog' and not download_folder.WATCHDOG_AVAILABLE:
+        pytest.skip('watchdog non installé')
+    monkeypatch.setattr(download_folder, 'POLL_INTERVAL', 0.05)
+    with DownloadWatcher(str(tmp_path), use_watchdog=request.param == 'watchdog') as w:
+        assert w.event_driven == (request.param == 'watchdog')
+        yield w
+
+
+def test_watcher_reports_the_file_once_renamed(watcher):
+    thread = _chrome_download(watcher.folder, NAME)
+    path = watcher.wait_for_file(PATTERN, timeout=5, settle=0.1)
+    thread.join()
+    assert path == os.path.join(watcher.folder, NAME)
+    assert not os.path.exists(path + PARTIAL_SUFFIX)
+    assert os.path.getsize(path) == 3 * 1024
+
+
+def test_watcher_ignores_a_download_still_in_progress(watcher):
+    with open(os.path.join(watcher.folder, NAME + PARTIAL_SUFFIX), 'wb') as f:
+        f.write(b'x')
+    assert watcher.wait_for_file(PATTERN, timeout=0.3, settle=0.1) is None
+    assert watcher.partial_downloads() == [NAME + PARTIAL_SUFFIX]
+
+
+def test_watcher_waits_for_the_file_to_settle(watcher):
+    path = os.path.join(watcher.folder, NAME)
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    start = time.time()
+    assert watcher.wait_for_file(PATTERN, timeout=5, settle=0.3) == path
+    assert time.time() - start >= 0.2
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+with open(os.path.join(ROOT, 'username.xlsx'), 'rb') as _f:
+    XLSX = _f.read()
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_check_xlsx_rejects_truncated_and_non_zip_files(tmp_path):
+    assert check_xlsx(_write(tmp_path / 'ok.xlsx', XLSX)) is None
+    assert 'illisible' in check_xlsx(_write(tmp_path / 'cut.xlsx', XLSX[:len(XLSX) // 2]), full=False)
+    assert 'illisible' in check_xlsx(_write(tmp_path / 'html.xlsx', b'<html>Session expired</html>'))
+
+
+def test_verified_file_is_kept_across_runs(tmp_path, monkeypatch):
+    path = _write(tmp_path / NAME, XLSX)
+    assert DownloadManifest(str(tmp_path)).finish('Visite Enfant', path, export_url='u')['status'] == 'verified'
+
+    # Nouveau passage : le manifeste est relu depuis le dossier, l'archive n'est pas rouverte
+    monkeypatch.setattr(download_folder, 'check_xlsx', lambda *a, **k: pytest.fail('archive relue'))
+    manifest = DownloadManifest(str(tmp_path))
+    assert manifest.entries['Visite Enfant']['export_url'] == 'u'
+    assert manifest.is_verified('Visite Enfant', path)
+    assert manifest.verify_file('Visite Enfant', path)
+
+
+def test_matching_sha256_is_not_checked_again(tmp_path, monkeypatch):
+    path = _write(tmp_path / NAME, XLSX)
+    DownloadManifest(str(tmp_path)).finish('Visite Enfant', path)
+    os.utime(path, ns=(0, 10 ** 18))
+
+    monkeypatch.setattr(download_folder, 'check_xlsx', lambda *a, **k: pytest.fail('archive relue'))
+    manifest = DownloadManifest(str(tmp_path))
+    assert not manifest.is_verified('Visite Enfant', path)
+    assert manifest.verify_file('Visite Enfant', path)
+    assert DownloadManifest(str(tmp_path)).is_verified('Visite Enfant', path)
+
+
+def test_stale_entry_does_not_vouch_for_a_rewritten_file(tmp_path):
+    path = _write(tmp_path / NAME, XLSX)
+    DownloadManifest(str(tmp_path)).finish('Visite Enfant', path)
+    _write(path, XLSX[:-100])
+
+    manifest = DownloadManifest(str(tmp_path))
+    assert not manifest.is_verified('Visite Enfant', path)
+    assert not manifest.verify_file('Visite Enfant', path)
+    assert manifest.entries['Visite Enfant']['status'] == 'corrupt'
+
+
+def test_assert_export_complete(tmp_path):
+    path = _write(tmp_path / NAME, XLSX)
+    assert_export_complete(path)  # absent du manifeste : contrôle de l'archive
+
+    _write(path + PARTIAL_SUFFIX, b'')
+    with pytest.raises(RuntimeError, match='en cours'):
+        assert_export_complete(path)
+    os.remove(path + PARTIAL_SUFFIX)
+
+    manifest = DownloadManifest(str(tmp_path))
+    manifest.finish('Visite Enfant', _write(path, b'<html>login</html>'))
+    with pytest.raises(RuntimeError, match='non vérifié'):
+        assert_export_complete(path)
+
+    manifest.finish('Visite Enfant', _write(path, XLSX))
+    assert_export_complete(path)
+    _write(path, XLSX[:len(XLSX) // 2])  # entrée périmée : l'archive est recontrôlée
+    with pytest.raises(RuntimeError, match='corrompu'):
+        assert_export_complete(path)
+
+
+def test_patterns_per_base_kind_are_compiled_once_per_day():
+    pat = pattern_for_date('Visite Enfant', '2025-08-14')
+    assert pat is pattern_for_date('Visite Enfant', '2025-08-14')
+    assert pat is not pattern_for_date('Visite Enfant', '2025-08-15')
+    assert pat.match('visite enfant (created 2024-12-01) 2025-08-14.xlsx')
+    assert not pat.match('Visite Enfant (created 2024-12-01) 2025-08-15.xlsx')
+
+    simple = pattern_for_date('household mother', '2025-08-14')
+    assert simple.match('household mother 2025-08-14.xlsx')
+    assert simple.match('household mother 2025-08-14 (1).xlsx')
+    special = pattern_for_date('muso_groupes', '2025-08-14')
+    assert special.match('muso_groupes (created 2025-03-25) 2025-08-14.xlsx')
+    assert not special.match('muso_groupes (created 2025-03-26) 2025-08-14.xlsx')
+
+
+@pytest.fixture
+def day(monkeypatch):
+    """Date du jour réglable pour download_folder (FolderIndex, pattern_for_date)."""
+    current = ['2025-08-14']
+    monkeypatch.setattr(download_folder, 'today_str', lambda: current[0])
+    return current
+
+
+def _touch(folder, name):
+    _write(os.path.join(folder, name), b'x')
+
+
+def test_index_rolls_over_at_midnight(tmp_path, day):
+    folder = str(tmp_path)
+    _touch(folder, 'Visite Enfant (created 2025-01-01) 2025-08-14.xlsx')
+    _touch(folder, 'household mother 2025-08-14.xlsx')
+    index = FolderIndex(folder, ['Visite Enfant', 'household mother', 'Appels OEV'])
+    assert index.missing() == ['Appels OEV']
+    assert index.files('household mother') == ['household mother 2025-08-14.xlsx']
+
+    day[0] = '2025-08-15'
+    # Même un index tenu par les événements se rebalaye au changement de jour
+    index.live = True
+    assert index.sync().missing() == ['Visite Enfant', 'household mother', 'Appels OEV']
+
+    _touch(folder, 'Appels OEV (created 2025-01-01) 2025-08-15.xlsx')
+    index.live = False
+    assert index.sync().present('Appels OEV')
+    assert not index.present('Visite Enfant')
+
+
+def test_index_tracks_added_removed_and_duplicate_files(tmp_path, day):
+    folder = str(tmp_path)
+    index = FolderIndex(folder, ['household mother', 'Visite Enfant'])
+    assert index.present_map() == {'household mother': [], 'Visite Enfant': []}
+
+    _touch(folder, 'household mother 2025-08-14.xlsx')
+    _touch(folder, 'household mother 2025-08-14 (1).xlsx')
+    _touch(folder, 'household mother 2025-08-14.xlsx' + PARTIAL_SUFFIX)
+    _touch(folder, 'notes.txt')
+    assert not index.present('household mother')  # pas encore rebalayé
+    index.refresh()
+    assert index.duplicates() == {'household mother': ['household mother 2025-08-14 (1).xlsx',
+                                                       'household mother 2025-08-14.xlsx']}
+
+    os.remove(os.path.join(folder, 'household mother 2025-08-14 (1).xlsx'))
+    index.discard('household mother 2025-08-14 (1).xlsx')
+    index.add(os.path.join(folder, 'Visite Enfant (created 2025-01-01) 2025-08-14.xlsx'))
+    assert index.duplicates() == {}
+    assert index.missing() == []
+
+
+def test_gui_presence_follows_the_selected_folder_and_day(tmp_path, day, monkeypatch):
+    import commcare_downloader
+    monkeypatch.setattr(commcare_downloader, '_folder_index', None)
+    first, second = str(tmp_path / 'a'), str(tmp_path / 'b')
+    os.makedirs(first)
+    os.makedirs(second)
+    _touch(first, 'household mother 2025-08-14.xlsx')
+    bases = ['household mother', 'Visite Enfant']
+
+    assert commcare_downloader.folder_index(first, bases).present_map() == {
+        'household mother': ['household mother 2025-08-14.xlsx'], 'Visite Enfant': []}
+    assert commcare_downloader.folder_index(second, bases).missing() == bases
+    assert commcare_downloader.folder_index(first, bases[:1]).present('household mother')
+
+    day[0] = '2025-08-15'
+    assert not commcare_downloader.folder_index(first, bases[:1]).present('household mother')
@@ -0,0 +1,93 @@
+import openpyxl
+import pandas as pd
+import pytest
+
+from excel_io import WorkbookBuilder, write_excel
+
+
+def _grid(path, sheet_name):
+    worksheet = openpyxl.load_workbook(path)[sheet_name]
+    values = {(c.row, c.column): c.value for row in worksheet.iter_rows() for c in row if c.value not in (None, '')}
+    return values, sorted(str(r) for r in worksheet.merged_cells.ranges)
+
+
+def _records():
+    return pd.DataFrame({
+        'office': ['CAP', 'CAP', 'CAP', 'GON', 'GON', 'PAP'],
+        'agent': ['a', 'a', 'b', 'c', 'c', 'd'],
+        'mois': ['jan', 'fev', 'jan', 'jan', 'fev', 'fev'],
+        'semaine': [1, 2, 1, 2, 1, 1],
+        'visites': [1, 2, 3, 4, 5, 6],
+        'appels': [1.5, None, 2.0, 3.0, 4.0, 0.5],
+    })
+
+
+FRAMES = {
+    'plat': lambda df: df,
+    'index_nommé': lambda df: df.set_index('agent'),
+    'index_multiple': lambda df: df.set_index(['office', 'agent', 'mois']),
+    'pivot': lambda df: df.pivot_table(index='office', columns='mois', values='visites', aggfunc='sum'),
+    'pivot_multiple': lambda df: df.pivot_table(index=['office', 'agent'], columns=['mois', 'semaine'],
+                                                values=['visites', 'appels'], aggfunc='sum'),
+}
+
+
+@pytest.mark.parametrize('index', [True, False])
+@pytest.mark.parametrize('name', sorted(FRAMES))
+def test_add_frame_lays_cells_out_like_to_excel(tmp_path, name, index):
+    df = FRAMES[name](_records())
+    if isinstance(df.columns, pd.MultiIndex) and not index:
+        pytest.skip("to_excel n'écrit pas de colonnes à plusieurs niveaux sans index")
+    built, expected = str(tmp_path / 'built.xlsx'), str(tmp_path / 'expected.xlsx')
+    WorkbookBuilder().add_frame('Feuille', df, startrow=2, startcol=1, index=index).save(built)
+    with pd.ExcelWriter(expected, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Feuille', startrow=2, startcol=1, index=index, merge_cells=True)
+    assert _grid(built, 'Feuille') == _grid(expected, 'Feuille')
+
+
+def test_titles_headers_and_deleted_rows(tmp_path):
+    pivot = FRAMES['pivot_multiple'](_records())
+    path = str(tmp_path / 'performances.xlsx')
+    (WorkbookBuilder()
+     .add_title('Pivot', 0, 'Performances', last_col=9, font_size=14)
+     .add_frame('Pivot', pivot, startrow=2)
+     .delete_row('Pivot', 5)
+     .set_column_width('Pivot', 0, 20)
+     .save(path))
+
+    worksheet = openpyxl.load_workbook(path)['Pivot']
+    merged = sorted(str(r) for r in worksheet.merged_cells.ranges)
+    assert 'A1:J1' in merged
+    assert worksheet['A1'].value == 'Performances'
+    assert worksheet['A1'].font.b and worksheet['A1'].font.sz == 14
+    assert worksheet['A1'].alignment.horizontal == 'center'
+
+    # En-tête sur trois lignes (valeurs, mois, semaine) : « appels » couvre les 4 colonnes (mois, semaine)
+    assert worksheet['C3'].value == 'appels' and 'C3:F3' in merged
+    assert worksheet['C4'].value == 'fev' and 'C4:D4' in merged
+    header = worksheet['C3']
+    assert header.font.b and header.border.left.style == 'thin' and header.alignment.horizontal == 'center'
+    assert worksheet.column_dimensions['A'].width == pytest.approx(20, abs=1)
+
+    # Ligne 6 (noms de l'index) supprimée : les données remontent d'une ligne
+    assert [worksheet.cell(6, c).value for c in (1, 2)] == ['CAP', 'a']
+    assert 'A6:A7' in merged
+    assert worksheet['A6'].font.b and worksheet['A6'].border.top.style == 'thin'
+    # titre, ligne vide, trois lignes d'en-tête, quatre lignes de données
+    assert worksheet.max_row == 2 + 3 + 4
+
+
+@pytest.mark.parametrize('index_name', [None, 'agent'])
+def test_write_excel_formats_index_and_header_like_to_excel(tmp_path, index_name):
+    df = _records().set_index(pd.Index(pd.date_range('2024-01-01', periods=6), name=index_name))
+    written, expected = str(tmp_path / 'written.xlsx'), str(tmp_path / 'expected.xlsx')
+    write_excel(df, written, index=True)
+    df.to_excel(expected, index=True)
+    assert _grid(written, 'Sheet1') == _grid(expected, 'Sheet1')
+
+    worksheet = openpyxl.load_workbook(written)['Sheet1']
+    assert (worksheet['A1'].value is not None) == (index_name is not None)
+    for cell in (worksheet['B1'], worksheet['A2'], worksheet['A7']):
+        assert cell.font.b and cell.border.left.style == 'thin' and cell.alignment.horizontal == 'center'
+    assert worksheet['A2'].number_format == 'yyyy-mm-dd hh:mm:ss'
+    assert not worksheet['B2'].font.b
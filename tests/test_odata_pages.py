@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pytest
+
+import utils
+
+
+class ODataStandIn(ThreadingHTTPServer):
+    """
+    Flux OData paginé local.
+
+    mode 'skip'   : pagination par $skip/$top, lien suivant sur chaque page pleine ;
+    mode 'sloppy' : comme 'skip', mais la dernière page (courte) porte encore un lien ;
+    mode 'cursor' : le lien suivant porte $skip mais la page servie dépend de `cursor`.
+    Les premières pages répondent plus lentement, pour que l'ordre d'arrivée diffère de l'ordre des pages.
+    """
+
+    def __init__(self, total, page_size, mode='skip'):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.total, self.page_size, self.mode = total, page_size, mode
+        self.requests = []
+        self.lock = threading.Lock()
+        self.in_flight = self.max_in_flight = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/odata/cases'
+
+    def page(self, query):
+        if self.mode == 'cursor':
+            start = int(query.get('cursor', ['0'])[0])
+        else:
+            start = int(query.get('$skip', ['0'])[0])
+        top = int(query.get('$top', [self.page_size])[0])
+        records = [{'caseid': f'c{i}'} for i in range(start, min(start + top, self.total))]
+        body = {'value': records}
+        following = start + top
+        if following < self.total or self.mode == 'sloppy':
+            extra = f'&cursor={following}' if self.mode == 'cursor' else ''
+            body['@odata.nextLink'] = f'{self.url}?$skip={following}&$top={top}{extra}'
+        return start, body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            start, body = server.page(parse_qs(urlsplit(self.path).query))
+            time.sleep(max(0.0, 0.08 - 0.02 * start / server.page_size))
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+@pytest.fixture
+def odata():
+    servers = []
+
+    def start(total, page_size, mode='skip'):
+        server = ODataStandIn(total, page_size, mode)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _caseids(server, max_in_flight=4):
+    pages = utils.iter_commcare_odata_pages(server.url, None, {'$top': server.page_size}, max_in_flight)
+    return [[r['caseid'] for r in page] for page in pages]
+
+
+def test_prefetched_pages_are_yielded_in_order(odata):
+    server = odata(total=1000, page_size=100)
+    pages = _caseids(server)
+    assert [c for page in pages for c in page] == [f'c{i}' for i in range(1000)]
+    assert [len(page) for page in pages] == [100] * 10
+    assert server.max_in_flight > 1
+
+
+def test_short_last_page_ends_the_iteration(odata):
+    server = odata(total=250, page_size=100, mode='sloppy')
+    pages = _caseids(server)
+    assert [len(page) for page in pages] == [100, 100, 50]
+    assert [c for page in pages for c in page] == [f'c{i}' for i in range(250)]
+
+
+def test_falls_back_to_next_link_when_skip_is_ignored(odata):
+    server = odata(total=750, page_size=100, mode='cursor')
+    pages = _caseids(server)
+    assert [c for page in pages for c in page] == [f'c{i}' for i in range(750)]
+    assert [len(page) for page in pages] == [100] * 7 + [50]
+
+
+def test_get_commcare_odata_without_prefetch(odata):
+    server = odata(total=250, page_size=100)
+    records = utils.get_commcare_odata(server.url, None, {'$top': 100}, max_in_flight=1)
+    assert [r['caseid'] for r in records] == [f'c{i}' for i in range(250)]
+    assert server.max_in_flight == 1
+
+
+# Pages d'un flux de formulaires ; « form_weight » n'apparaît qu'à la deuxième page
+FORM_PAGES = [
+    [{'form_case id': 'c0', 'form_age': '3', 'received on': '2025-01-02T10:00:00'},
+     {'form_case id': 'c1', 'form_age': '5', 'received on': 'pas une date'}],
+    [],
+    [{'form_case id': 'c2', 'form_age': '7', 'received on': '2025-01-03T09:30:00', 'form_weight': 12.5}],
+]
+
+
+@pytest.fixture
+def stubbed_pages(monkeypatch):
+    calls = []
+
+    def pages(url, auth_credentials, filter_params, max_in_flight=utils.ODATA_MAX_IN_FLIGHT):
+        calls.append(max_in_flight)
+        yield from FORM_PAGES
+
+    monkeypatch.setattr(utils, 'iter_commcare_odata_pages', pages)
+    return calls
+
+
+def _form_frames(**kwargs):
+    return utils.iter_commcare_odata_frames('https://example.org/odata', None, {}, strip_form_prefix=True,
+                                            dtypes={'age': 'float64'}, parse_dates=['received_on'], **kwargs)
+
+
+def test_frames_are_normalized_and_typed_page_by_page(stubbed_pages):
+    frames = list(_form_frames(max_in_flight=2))
+    assert stubbed_pages == [2]
+    assert len(frames) == 2  # la page vide ne produit pas de frame
+    assert list(frames[0].columns) == ['case_id', 'age', 'received_on']
+    assert frames[0]['age'].tolist() == [3.0, 5.0]
+    assert str(frames[0]['received_on'].dtype).startswith('datetime64')
+    assert frames[0]['received_on'].isna().tolist() == [False, True]
+    assert list(frames[1].columns) == ['case_id', 'age', 'received_on', 'weight']
+
+
+def test_collect_in_memory_keeps_every_column(stubbed_pages):
+    df = utils.collect_odata_frames(_form_frames())
+    assert df['case_id'].tolist() == ['c0', 'c1', 'c2']
+    assert df['weight'].isna().tolist() == [True, True, False]
+    assert utils.collect_odata_frames(iter([])).empty
+
+
+def test_collect_to_parquet_drops_columns_after_the_first_page(stubbed_pages, tmp_path, capsys):
+    path = str(tmp_path / 'forms.parquet')
+    assert utils.collect_odata_frames(_form_frames(), output_path=path) == path
+    out = capsys.readouterr().out
+    assert "columns absent from the first page are dropped: ['weight']" in out
+    assert '3 records written' in out
+
+    df = pd.read_parquet(path)
+    assert list(df.columns) == ['case_id', 'age', 'received_on']
+    assert df['case_id'].tolist() == ['c0', 'c1', 'c2']
+    assert df['age'].tolist() == [3.0, 5.0, 7.0]
+    assert df['received_on'].iloc[2] == pd.Timestamp('2025-01-03 09:30:00')
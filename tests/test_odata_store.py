@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+import utils
+
+
+class FakeFeed:
+    """Flux OData en mémoire : applique le filtre `<champ> ge <valeur>` ajouté par la synchronisation."""
+
+    def __init__(self, records, modified_field='last_modified_date'):
+        self.records = list(records)
+        self.modified_field = modified_field
+        self.calls = []
+
+    def __call__(self, url, auth_credentials, params):
+        self.calls.append(dict(params))
+        records = self.records
+        delta = params.get('$filter', '').rpartition(f'{self.modified_field} ')[2]
+        if delta.startswith('ge '):
+            records = [r for r in records if r[self.modified_field] >= delta[3:]]
+        yield records
+
+
+@pytest.fixture
+def store(tmp_path):
+    return str(tmp_path / 'odata.sqlite')
+
+
+def _sync(feed, store, monkeypatch, params=None, **kwargs):
+    monkeypatch.setattr(utils, 'iter_commcare_odata_pages', feed)
+    records = utils.sync_commcare_odata('https://example.org/odata/cases', ('u', 'p'), params or {},
+                                        store_path=store, **kwargs)
+    return sorted(r['caseid'] for r in records)
+
+
+def test_delta_keeps_records_sharing_the_high_water_mark(store, monkeypatch):
+    feed = FakeFeed([{'caseid': 'a', 'last_modified_date': '2024-01-01T00:00:00Z'}])
+    assert _sync(feed, store, monkeypatch) == ['a']
+
+    feed.records.append({'caseid': 'b', 'last_modified_date': '2024-01-01T00:00:00Z'})
+    assert _sync(feed, store, monkeypatch) == ['a', 'b']
+    assert feed.calls[-1]['$filter'] == 'last_modified_date ge 2024-01-01T00:00:00Z'
+
+
+def test_stale_full_sync_drops_deleted_cases(store, monkeypatch):
+    feed = FakeFeed([{'caseid': 'a', 'last_modified_date': '2024-01-01'},
+                     {'caseid': 'b', 'last_modified_date': '2024-01-02'}])
+    assert _sync(feed, store, monkeypatch, full_refresh_days=7) == ['a', 'b']
+
+    del feed.records[0]
+    assert _sync(feed, store, monkeypatch, full_refresh_days=7) == ['a', 'b']
+    assert '$filter' in feed.calls[-1]
+
+    with sqlite3.connect(store) as conn:
+        conn.execute("UPDATE odata_feeds SET full_synced_at = '2000-01-01T00:00:00'")
+    assert _sync(feed, store, monkeypatch, full_refresh_days=7) == ['b']
+    assert '$filter' not in feed.calls[-1]
+
+
+def test_feeds_with_different_filters_do_not_share_a_store(store, monkeypatch):
+    open_cases = FakeFeed([{'caseid': 'a', 'last_modified_date': '2024-01-01'}])
+    closed_cases = FakeFeed([{'caseid': 'z', 'last_modified_date': '2024-01-01'}])
+    assert _sync(open_cases, store, monkeypatch, {'$filter': 'closed eq false'}) == ['a']
+    assert _sync(closed_cases, store, monkeypatch, {'$filter': 'closed eq true'}) == ['z']
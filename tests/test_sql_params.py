@@ -0,0 +1,47 @@
+import os
+import re
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import mysql
+
+from caris_fonctions import SQL_PARAMS, _sql_statement
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SQL_FILE = 'Charges_virales_pediatriques.sql'
+
+
+def _read_sql():
+    with open(os.path.join(ROOT, SQL_FILE), 'r') as file:
+        return file.read().replace('use caris_db;', '')
+
+
+def _bound_predicates():
+    """Prédicats paramétrés (:nom) de la clause WHERE du fichier."""
+    lines = [line.strip() for line in _read_sql().splitlines()]
+    return [line[len('AND '):] for line in lines if line.startswith('AND (') and re.search(r':\w+', line)]
+
+
+def test_defaults_compile_for_mysql():
+    params = SQL_PARAMS[SQL_FILE]
+    compiled = _sql_statement(_read_sql(), params).compile(dialect=mysql.dialect())
+    assert set(params) <= set(compiled.params)
+    assert 'HAVING' not in str(compiled)
+    assert re.search(r'SELECT\s+b\.departement, b\.commune, b\.section, a\.\*', str(compiled))
+
+
+def test_default_params_filter_nothing():
+    engine = create_engine('sqlite://')
+    rows = [('CAP', 'ND', 'CAP/001', 3), (None, None, None, None), ('GON', 'AV', 'GON/002', 17)]
+    assert len(_bound_predicates()) == len(SQL_PARAMS[SQL_FILE])
+    query = 'SELECT COUNT(*) FROM a WHERE ' + ' AND '.join(_bound_predicates())
+    with engine.connect() as conn:
+        conn.exec_driver_sql('CREATE TABLE a (office TEXT, network TEXT, site TEXT, age INTEGER)')
+        conn.exec_driver_sql('INSERT INTO a VALUES (?, ?, ?, ?)', rows[0])
+        conn.exec_driver_sql('INSERT INTO a VALUES (?, ?, ?, ?)', rows[1])
+        conn.exec_driver_sql('INSERT INTO a VALUES (?, ?, ?, ?)', rows[2])
+
+        defaults = SQL_PARAMS[SQL_FILE]
+        assert conn.execute(_sql_statement(query, defaults), defaults).scalar() == len(rows)
+
+        params = {**defaults, 'excluded_offices': ['GON'], 'min_age': 1}
+        assert conn.execute(_sql_statement(query, params), params).scalar() == 1
@@ -1,127 +1,697 @@
 import requests
 import json
 import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 # Get system timezone
 import time
 import re
+import sqlite3
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 load_dotenv()
 
-def get_commcare_odata(url, auth_credentials, filter_params):
+# Nombre maximal de pages OData demandées en parallèle
+ODATA_MAX_IN_FLIGHT = 4
+
+# Session HTTP partagée (keep-alive, gzip) et politique de relance
+HTTP_POOL_SIZE = 16
+HTTP_TIMEOUT = (10, 120)
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '5'))
+HTTP_BACKOFF_FACTOR = 1.0
+HTTP_BACKOFF_MAX = 60
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_NEXT_LINK_RE = re.compile(r'"@odata\.nextLink"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+_session = None
+_session_lock = threading.Lock()
+_request_metrics = []
+_metrics_lock = threading.Lock()
+
+
+def get_commcare_session():
+    """
+    Return the process-wide HTTP session used for CommCare API calls
+    
+    The session keeps connections alive between requests (one pool of
+    HTTP_POOL_SIZE connections per host) and negotiates gzip responses.
+    
+    Returns:
+        requests.Session: Shared session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+            _session = session
+        return _session
+
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before the next attempt: Retry-After when given, else exponential backoff with jitter."""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        if retry_after.strip().isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+            return min(max((retry_at - datetime.now(retry_at.tzinfo)).total_seconds(), 0), HTTP_BACKOFF_MAX)
+        except (TypeError, ValueError):
+            pass
+    backoff = HTTP_BACKOFF_FACTOR * (2 ** attempt)
+    return min(backoff + random.uniform(0, backoff / 2), HTTP_BACKOFF_MAX)
+
+
+def _record_request(url, status_code, elapsed, size, attempt):
+    with _metrics_lock:
+        _request_metrics.append({'url': urlsplit(url)._replace(query='').geturl(), 'status_code': status_code,
+                                 'elapsed': elapsed, 'bytes': size, 'attempt': attempt})
+
+
+def commcare_get(url, auth_credentials, params=None, max_retries=None, **kwargs):
     """
-    Fetch active muso groups from CommCare using OData API
+    GET a CommCare API URL through the shared session, with retries
+    
+    Connection errors and 429/5xx responses are retried with exponential
+    backoff, honouring the Retry-After header. Every attempt is recorded in
+    the request metrics.
     
     Args:
-        url (str): The OData API URL
+        url (str): URL to request
         auth_credentials (tuple): Username and password tuple (username, password)
-        filter_params (dict): Parameters to filter the data
+        params (dict): Query parameters
+        max_retries (int): Number of retries (defaults to HTTP_MAX_RETRIES)
+        **kwargs: Extra arguments passed to requests (e.g. stream=True)
         
     Returns:
-        list: List of muso group records
+        requests.Response: The successful response
+        
+    Raises:
+        requests.HTTPError: If the last attempt still returns an error status
+        requests.ConnectionError, requests.Timeout: If the last attempt fails to connect
     """
-    # Make the initial request to the OData API
-    response = requests.get(url, auth=auth_credentials, params=filter_params)
-
-    # Check if the request was successful
-    if response.status_code != 200:
-        print(f"Error: API request failed with status code {response.status_code}")
-        return []
-    # Get initial data
-    data = response.json()['value']
-    # Follow pagination links if they exist
-    while "@odata.nextLink" in response.json():
-        next_link = response.json()["@odata.nextLink"]
-        print(f"Following next link: {next_link}")
+    if max_retries is None:
+        max_retries = HTTP_MAX_RETRIES
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    session = get_commcare_session()
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        try:
+            response = session.get(url, auth=auth_credentials, params=params, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _record_request(url, None, time.perf_counter() - start, 0, attempt)
+            if attempt == max_retries:
+                raise
+            delay = _retry_delay(None, attempt)
+            print(f"Request error on {url}: {e}. Retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+            continue
+        size = int(response.headers.get('Content-Length', 0)) if kwargs.get('stream') else len(response.content)
+        _record_request(url, response.status_code, time.perf_counter() - start, size, attempt)
+        if response.status_code in HTTP_RETRY_STATUS and attempt < max_retries:
+            delay = _retry_delay(response, attempt)
+            print(f"Status {response.status_code} on {url}. Retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            response.close()
+            time.sleep(delay)
+            continue
+        response.raise_for_status()
+        return response
+
+
+def get_request_metrics(reset=False):
+    """
+    Return the per-request latency metrics recorded by commcare_get
+    Args:
+        reset (bool): Clear the recorded metrics afterwards
+    Returns:
+        pd.DataFrame: One row per attempt (url, status_code, elapsed, bytes, attempt)
+    """
+    with _metrics_lock:
+        metrics = pd.DataFrame(_request_metrics, columns=['url', 'status_code', 'elapsed', 'bytes', 'attempt'])
+        if reset:
+            _request_metrics.clear()
+    return metrics
+
+
+def print_request_metrics(reset=True):
+    """Print a latency summary of the CommCare requests made so far."""
+    metrics = get_request_metrics(reset)
+    if metrics.empty:
+        print("No CommCare requests recorded")
+        return
+    retries = int((metrics['attempt'] > 0).sum())
+    print(f"CommCare requests: {len(metrics)} ({retries} retries), "
+          f"{metrics['bytes'].sum() / 1e6:.1f} MB, "
+          f"latency p50 {metrics['elapsed'].median():.2f}s / p95 {metrics['elapsed'].quantile(0.95):.2f}s / "
+          f"max {metrics['elapsed'].max():.2f}s")
+
+
+def _get_odata_page(url, auth_credentials, params=None):
+    """
+    Download one OData page without parsing it
+    Args:
+        url (str): Page URL
+        auth_credentials (tuple): Username and password tuple
+        params (dict): Query parameters (first page only)
+    Returns:
+        str: Raw response text
+    """
+    return commcare_get(url, auth_credentials, params=params).text
+
+
+def _find_next_link(text):
+    """Extract @odata.nextLink from a raw page without decoding the whole payload."""
+    match = _NEXT_LINK_RE.search(text)
+    if match is None:
+        return None
+    return json.loads(f'"{match.group(1)}"')
+
+
+def _skip_link(next_link, skip):
+    """Return next_link with its $skip query parameter set to `skip`."""
+    parts = urlsplit(next_link)
+    query = [(k, str(skip) if k == '$skip' else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query, safe='$')))
+
+
+def _link_skip(link):
+    """Value of the $skip query parameter of an OData link (None if absent)."""
+    skip = dict(parse_qsl(urlsplit(link).query)).get('$skip')
+    return int(skip) if skip is not None and skip.isdigit() else None
+
+
+def _iter_pages_by_skip(next_link, auth_credentials, max_in_flight):
+    """
+    Yield the remaining pages of a $skip/$top feed, fetched from a thread pool
+    with at most `max_in_flight` page requests open, in order.
+    
+    The next link returned with each page must point exactly one page further.
+    When it does not, the server is not paging by $skip alone: the prefetched
+    pages are dropped and the rest of the feed follows @odata.nextLink from
+    the last page that was checked.
+    """
+    skip = _link_skip(next_link)
+    page_size = int(dict(parse_qsl(urlsplit(next_link).query)).get('$top', skip))
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=max_in_flight)
+    link = next_link
+    try:
+        while True:
+            while len(pending) < max_in_flight:
+                page_url = _skip_link(next_link, skip)
+                pending.append((skip, page_url, pool.submit(_get_odata_page, page_url, auth_credentials)))
+                skip += page_size
+            page_skip, page_url, future = pending.popleft()
+            payload = json.loads(future.result())
+            server_link = payload.get('@odata.nextLink')
+            if server_link and _link_skip(server_link) != page_skip + page_size:
+                break
+            print(f"Following next link: {page_url}")
+            yield payload['value']
+            if len(payload['value']) < page_size or not server_link:
+                return
+            link = server_link
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    print(f"$skip is not honoured by {urlsplit(link).path}, following @odata.nextLink instead")
+    yield from _iter_pages_by_link(_get_odata_page(link, auth_credentials), auth_credentials)
+
+
+def _iter_pages_by_link(text, auth_credentials):
+    """
+    Yield opaque @odata.nextLink pages, downloading page N+1 while page N is parsed.
+    """
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        while True:
+            next_link = _find_next_link(text)
+            future = pool.submit(_get_odata_page, next_link, auth_credentials) if next_link else None
+            yield json.loads(text)['value']
+            if future is None:
+                return
+            print(f"Following next link: {next_link}")
+            text = future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_commcare_odata_pages(url, auth_credentials, filter_params, max_in_flight=ODATA_MAX_IN_FLIGHT):
+    """
+    Yield the records of a CommCare OData feed one page at a time
+    
+    Pages are prefetched: when the feed paginates with $skip/$top, up to
+    `max_in_flight` pages are requested concurrently; otherwise the next page
+    is downloaded while the current one is being parsed.
+    
+    Args:
+        url (str): The OData API URL
+        auth_credentials (tuple): Username and password tuple (username, password)
+        filter_params (dict): Parameters to filter the data
+        max_in_flight (int): Maximum number of page requests open at once
         
-        # Get the next page of data
-        response = requests.get(next_link, auth=auth_credentials)
+    Yields:
+        list: Records of one page
         
-        if response.status_code == 200:
-            # Add new records to our data
-            new_records = response.json()['value']
-            data += new_records
-            print(f"Retrieved additional {len(new_records)} records. Total: {len(data)}")
-        else:
-            print(f"Error: Failed to retrieve next page: {response.status_code}")
-            break
+    Raises:
+        requests.HTTPError: If a page still fails after the retries of commcare_get
+    """
+    # Make the initial request to the OData API
+    text = _get_odata_page(url, auth_credentials, filter_params)
+
+    total = 0
+    next_link = _find_next_link(text)
+    if next_link and max_in_flight > 1 and '$skip' in dict(parse_qsl(urlsplit(next_link).query)):
+        pages = _iter_pages_by_skip(next_link, auth_credentials, max_in_flight)
+        first_page = json.loads(text)['value']
+        total += len(first_page)
+        yield first_page
+    else:
+        pages = _iter_pages_by_link(text, auth_credentials)
+        first_page = next(pages)
+        total += len(first_page)
+        yield first_page
+
+    for new_records in pages:
+        total += len(new_records)
+        print(f"Retrieved additional {len(new_records)} records. Total: {total}")
+        yield new_records
+
+
+def get_commcare_odata(url, auth_credentials, filter_params, max_in_flight=ODATA_MAX_IN_FLIGHT):
+    """
+    Fetch all records of a CommCare OData feed, following pagination
     
+    Args:
+        url (str): The OData API URL
+        auth_credentials (tuple): Username and password tuple (username, password)
+        filter_params (dict): Parameters to filter the data
+        max_in_flight (int): Maximum number of page requests open at once
+        
+    Returns:
+        list: List of records
+    """
+    data = []
+    for new_records in iter_commcare_odata_pages(url, auth_credentials, filter_params, max_in_flight):
+        data += new_records
+
     print(f"Total records retrieved: {len(data)}")
     return data
 
 
+def normalize_odata_columns(df, strip_form_prefix=False):
+    """
+    Normalize OData column names the way the pipelines do ('case name' -> 'case_name',
+    'form_' removed from form feeds)
+    Args:
+        df (pd.DataFrame): Frame built from OData records
+        strip_form_prefix (bool): Remove 'form_' from column names (form feeds)
+    Returns:
+        pd.DataFrame: The same frame with renamed columns
+    """
+    df.columns = df.columns.str.replace(' ', '_')
+    if strip_form_prefix:
+        df.columns = df.columns.str.replace('form_', '', regex=False)
+    return df
+
+
+def _odata_frame(records, strip_form_prefix=False, dtypes=None, parse_dates=None):
+    """Build one normalized, typed DataFrame from a page of OData records."""
+    df = normalize_odata_columns(pd.DataFrame.from_records(records), strip_form_prefix)
+    if dtypes:
+        df = df.astype({c: t for c, t in dtypes.items() if c in df.columns})
+    for col in parse_dates or []:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    return df
 
-def is_beneficiary_active(row):
+
+def iter_commcare_odata_frames(url, auth_credentials, filter_params, strip_form_prefix=False,
+                               dtypes=None, parse_dates=None, max_in_flight=ODATA_MAX_IN_FLIGHT):
     """
-    Check if a beneficiary is active based on various date fields
+    Yield one normalized DataFrame per OData page
     Args:
-        row (dict): A dictionary representing a beneficiary record
-        start_date (str): The start date for the active period
-        end_date (str): The end date for the active period"
-        """
-    if row['closed_date']<start_date:
-        return "no"
-    if row["creation_date"]>end_date:
-        return "no"
-    if row['graduation_date']>start_date:
-        return "yes"
-    if row['abandoned_date']>start_date:
-        return "yes"
-    if row['inactive_date']>start_date:
-        return "yes"
-    if row['inactive_date']<start_date:
-        return "no"
-    if row['graduation_date']<start_date:
-        return "no"
-    if (pd.isnull(row['is_inactive']) or row['is_inactive']==0) and (row['graduated']==0 or pd.isnull(row['graduated'])):
-        return "yes"
-    return "no"
-
-
-# define a function to check if a group is active
-def is_groupe_active(row):
-    """
-    Check if a group is active based on various date fields
+        url (str): The OData API URL
+        auth_credentials (tuple): Username and password tuple (username, password)
+        filter_params (dict): Parameters to filter the data
+        strip_form_prefix (bool): Remove 'form_' from column names (form feeds)
+        dtypes (dict): Column -> dtype applied to each page
+        parse_dates (list): Columns converted with pd.to_datetime(errors='coerce')
+        max_in_flight (int): Maximum number of page requests open at once
+    Yields:
+        pd.DataFrame: One page of records
+    """
+    for records in iter_commcare_odata_pages(url, auth_credentials, filter_params, max_in_flight):
+        if records:
+            yield _odata_frame(records, strip_form_prefix, dtypes, parse_dates)
+
+
+def _stable_parquet_frame(df):
+    """Give a chunk dtypes that stay the same from one page to the next (object -> string, int -> float)."""
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_integer_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]):
+            df[col] = df[col].astype('float64')
+        elif df[col].dtype == object:
+            df[col] = df[col].astype('string')
+    return df
+
+
+def collect_odata_frames(frames, output_path=None):
+    """
+    Collect DataFrame chunks into a single DataFrame, or stream them to a Parquet file
+    
+    Without `output_path` the chunks are concatenated once at the end. With
+    `output_path` each chunk is appended to the Parquet file as it arrives,
+    so only one page is held in memory; the schema of the first chunk is kept.
+    
     Args:
-        row (dict): A dictionary representing a group record
+        frames (iterable): DataFrame chunks (e.g. iter_commcare_odata_frames)
+        output_path (str): Optional .parquet file to write
     Returns:
-        str: 'yes' if active, 'no' if inactive
+        pd.DataFrame or str: The concatenated frame, or the path of the written file
+    """
+    if output_path is None:
+        chunks = list(frames)
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    columns = None
+    rows = 0
+    try:
+        for chunk in frames:
+            chunk = _stable_parquet_frame(chunk)
+            if writer is None:
+                columns = list(chunk.columns)
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(output_path, table.schema)
+            else:
+                extra = [c for c in chunk.columns if c not in columns]
+                if extra:
+                    print(f"Warning: columns absent from the first page are dropped: {extra}")
+                table = pa.Table.from_pandas(chunk.reindex(columns=columns), schema=writer.schema,
+                                             preserve_index=False, safe=False)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    print(f"{rows} records written to {output_path}")
+    return output_path
+
+
+# Base SQLite locale des flux OData (synchronisation incrémentale)
+ODATA_STORE_PATH = os.getenv('ODATA_STORE_PATH', 'commcare_odata.sqlite')
+ODATA_STORE_CHUNKSIZE = 5000
+# A feed is pulled in full again after this many days, so that cases deleted,
+# archived or no longer matching the filter leave the store (0 disables)
+ODATA_FULL_REFRESH_DAYS = float(os.getenv('ODATA_FULL_REFRESH_DAYS', '7'))
+
+
+def _open_odata_store(store_path):
+    """Open (and create if needed) the local SQLite store of OData records."""
+    conn = sqlite3.connect(store_path, timeout=60)
+    # WAL: several feeds can be synced at the same time from different threads
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS odata_records ("
+        " feed TEXT NOT NULL, record_key TEXT NOT NULL, modified TEXT, record TEXT NOT NULL,"
+        " PRIMARY KEY (feed, record_key))"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS odata_feeds ("
+        " feed TEXT PRIMARY KEY, high_water TEXT, synced_at TEXT, full_synced_at TEXT)"
+    )
+    # Stores created before full_synced_at existed: their feeds get a full refresh on the next sync
+    if 'full_synced_at' not in {r[1] for r in conn.execute("PRAGMA table_info(odata_feeds)")}:
+        conn.execute("ALTER TABLE odata_feeds ADD COLUMN full_synced_at TEXT")
+    return conn
+
+
+def _iter_odata_store_frames(conn, feed_name, strip_form_prefix=False, chunksize=ODATA_STORE_CHUNKSIZE):
+    """Yield the stored records of a feed as normalized DataFrames of `chunksize` rows."""
+    cursor = conn.execute("SELECT record FROM odata_records WHERE feed = ? ORDER BY rowid", (feed_name,))
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            return
+        yield _odata_frame([json.loads(r) for (r,) in rows], strip_form_prefix)
+
+
+def sync_commcare_odata(url, auth_credentials, filter_params, key_field='caseid',
+                        modified_field='last_modified_date', feed_name=None,
+                        store_path=ODATA_STORE_PATH, full_refresh=None, as_frame=False,
+                        strip_form_prefix=False, full_refresh_days=None):
     """
-        # Convert reference dates to UTC timezone-aware timestamps
-    start_date_dt = pd.to_datetime(start_date)
-    end_date_dt = pd.to_datetime(end_date)
-    print("start date and end date", start_date_dt, end_date_dt)
+    Incrementally sync a CommCare OData feed into a local SQLite store
     
-    # Convert and normalize dates from the row
-    # Check conditions only if dates are valid
-    if row["office_name"] in ["CAY","JER"]:
-        return "no"
-    # if pd.notna(row['opened_date']) and row['opened_date'] < start_date_dt:
-    #     return "no"
-    if pd.notna(row['closed_date']) and row['closed_date'] < start_date_dt:
-        return "no"
-    if pd.notna(row['creation_date']) and row["creation_date"] > end_date_dt:
-        return "no"
-    if pd.notna(row['graduation_date']) and row['graduation_date'] > start_date_dt:
-        return "yes"
-    if pd.notna(row['inactive_date']) and row['inactive_date'] > start_date_dt:
-        return "yes"
-    if pd.notna(row['inactive_date']) and row['inactive_date'] < start_date_dt:
-        return "no"
-    if pd.notna(row['graduation_date']) and row['graduation_date'] < start_date_dt:
-        return "no"
-    if (pd.isnull(row['is_inactive']) or row['is_inactive']==0) and (row['is_graduated']==0 or pd.isnull(row['is_graduated'])):
-        return "yes"
-    return "no"
+    Only records whose `modified_field` is greater than or equal to the stored
+    high-water mark are requested (records sharing that timestamp are fetched
+    again and absorbed by the upsert); they are upserted page by page by
+    `key_field` and the merged snapshot is returned. The first sync of a feed
+    is a full pull, and so is any sync once the last full pull is older than
+    `full_refresh_days`: deltas never see deleted or archived cases, nor cases
+    that stopped matching `filter_params`.
+    
+    Args:
+        url (str): The OData API URL
+        auth_credentials (tuple): Username and password tuple (username, password)
+        filter_params (dict): Parameters to filter the data
+        key_field (str): Record identifier ('caseid' for cases, 'formid' for forms)
+        modified_field (str): Field compared to the high-water mark
+        feed_name (str): Name of the feed in the store (defaults to the URL
+            followed by the filter parameters)
+        store_path (str): Path of the SQLite store
+        full_refresh (bool): Drop the stored feed and pull everything again
+            (defaults to the ODATA_FULL_REFRESH environment variable)
+        full_refresh_days (float): Age in days of the last full pull after
+            which a full refresh is forced (defaults to ODATA_FULL_REFRESH_DAYS)
+        as_frame (bool): Return a DataFrame with normalized column names,
+            built from the store in chunks, instead of a list of records
+        strip_form_prefix (bool): Remove 'form_' from column names (form feeds, as_frame only)
+        
+    Returns:
+        list or pd.DataFrame: Merged snapshot
+    """
+    params = dict(filter_params or {})
+    feed_name = feed_name or (f"{url}?{urlencode(sorted(params.items()))}" if params else url)
+    if full_refresh is None:
+        full_refresh = os.getenv('ODATA_FULL_REFRESH') == '1'
+    if full_refresh_days is None:
+        full_refresh_days = ODATA_FULL_REFRESH_DAYS
 
-import re
-from datetime import datetime
-import os
+    conn = _open_odata_store(store_path)
+    try:
+        row = conn.execute("SELECT high_water, full_synced_at FROM odata_feeds WHERE feed = ?",
+                           (feed_name,)).fetchone()
+        if row is not None and not full_refresh and full_refresh_days > 0:
+            last_full = datetime.fromisoformat(row[1]) if row[1] else None
+            if last_full is None or (datetime.now() - last_full).total_seconds() >= full_refresh_days * 86400:
+                print(f"Last full sync of {feed_name} is older than {full_refresh_days:g} days")
+                full_refresh = True
+        high_water = None if full_refresh or row is None else row[0]
+        if high_water:
+            delta = f"{modified_field} ge {high_water}"
+            params['$filter'] = f"({params['$filter']}) and {delta}" if params.get('$filter') else delta
+            print(f"Incremental sync of {feed_name} since {high_water}")
+        else:
+            print(f"Full sync of {feed_name}")
+
+        upserted = 0
+        modified = [high_water] if high_water else []
+        if full_refresh:
+            # Clearing the high-water mark first makes an interrupted refresh fall back to a full pull
+            with conn:
+                conn.execute("DELETE FROM odata_records WHERE feed = ?", (feed_name,))
+                conn.execute("UPDATE odata_feeds SET high_water = NULL WHERE feed = ?", (feed_name,))
+        # One short transaction per page: upserts are idempotent and the
+        # high-water mark only moves once the whole delta has been stored
+        for records in iter_commcare_odata_pages(url, auth_credentials, params):
+            missing_key = sum(1 for r in records if r.get(key_field) is None)
+            if missing_key:
+                raise KeyError(f"{missing_key} records of {feed_name} have no '{key_field}' field")
+            with conn:
+                conn.executemany(
+                    "INSERT INTO odata_records (feed, record_key, modified, record) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (feed, record_key) DO UPDATE SET modified = excluded.modified, record = excluded.record",
+                    [(feed_name, str(r[key_field]), r.get(modified_field), json.dumps(r)) for r in records]
+                )
+            modified += [str(r[modified_field]) for r in records if r.get(modified_field)]
+            modified = [max(modified)] if modified else []
+            upserted += len(records)
+        synced_at = datetime.now().isoformat(timespec='seconds')
+        with conn:
+            conn.execute(
+                "INSERT INTO odata_feeds (feed, high_water, synced_at, full_synced_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (feed) DO UPDATE SET high_water = excluded.high_water, synced_at = excluded.synced_at,"
+                " full_synced_at = COALESCE(excluded.full_synced_at, odata_feeds.full_synced_at)",
+                (feed_name, modified[0] if modified else None, synced_at, synced_at if not high_water else None)
+            )
+        print(f"Upserted {upserted} records into {feed_name}")
+
+        if as_frame:
+            snapshot = collect_odata_frames(_iter_odata_store_frames(conn, feed_name, strip_form_prefix))
+        else:
+            snapshot = [json.loads(r) for (r,) in conn.execute(
+                "SELECT record FROM odata_records WHERE feed = ? ORDER BY rowid", (feed_name,))]
+    finally:
+        conn.close()
+
+    print(f"Snapshot of {feed_name}: {len(snapshot)} records")
+    return snapshot
+
+
+def fetch_sources(sources, max_workers=None):
+    """
+    Run independent remote sources (OData feeds, SQL queries) concurrently
+    
+    Each source is a callable without arguments (use functools.partial) that
+    returns a DataFrame or a list of records. The wall-clock time of the stage
+    is that of the slowest source instead of their sum.
+    
+    Args:
+        sources (dict): Mapping of source name to callable
+        max_workers (int): Number of threads (defaults to one per source)
+        
+    Returns:
+        dict: Mapping of source name to DataFrame, in the order of `sources`
+    """
+    def timed(name, fetch):
+        start = time.perf_counter()
+        result = fetch()
+        df = result if isinstance(result, pd.DataFrame) else pd.DataFrame(result)
+        print(f"Source {name}: {df.shape[0]} rows in {time.perf_counter() - start:.1f}s")
+        return df
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers or max(len(sources), 1)) as pool:
+        futures = {name: pool.submit(timed, name, fetch) for name, fetch in sources.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    print(f"Fetched {len(results)} sources in {time.perf_counter() - start:.1f}s")
+    return results
+
+
+ACTIVITY_DATE_COLUMNS = ['closed_date', 'creation_date', 'graduation_date', 'abandoned_date', 'inactive_date']
+ACTIVITY_LEVELS = ['no', 'yes']
+
+
+def _activity_frame(df, start_date, end_date):
+    """
+    Typed view of the columns used by the activity rules.
+
+    Date columns are parsed to naive datetimes (NaT when missing or
+    invalid) and the 0/1 flags to numbers, so every rule is a plain
+    vectorised comparison; comparisons with NaT are False, as in the
+    row-wise checks.
+    """
+    typed = {'start': pd.Timestamp(start_date), 'end': pd.Timestamp(end_date)}
+    for column in ACTIVITY_DATE_COLUMNS:
+        if column in df.columns:
+            values = df[column]
+            if not pd.api.types.is_datetime64_any_dtype(values.dtype):
+                values = pd.to_datetime(values, errors='coerce')
+            if getattr(values.dtype, 'tz', None) is not None:
+                values = values.dt.tz_convert(None)
+            typed[column] = values
+        else:
+            typed[column] = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+    for column in ['is_inactive', 'graduated', 'is_graduated']:
+        typed[column] = (pd.to_numeric(df[column], errors='coerce') if column in df.columns
+                         else pd.Series(float('nan'), index=df.index))
+    typed['office_name'] = df['office_name'] if 'office_name' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    return typed
+
+
+def _not_set(flag):
+    return flag.isna() | (flag == 0)
+
+
+# Ordered rule cascades: the first matching rule gives the answer
+BENEFICIARY_ACTIVITY_RULES = [
+    (lambda t: t['closed_date'] < t['start'], 'no'),
+    (lambda t: t['creation_date'] > t['end'], 'no'),
+    (lambda t: t['graduation_date'] > t['start'], 'yes'),
+    (lambda t: t['abandoned_date'] > t['start'], 'yes'),
+    (lambda t: t['inactive_date'] > t['start'], 'yes'),
+    (lambda t: t['inactive_date'] < t['start'], 'no'),
+    (lambda t: t['graduation_date'] < t['start'], 'no'),
+    (lambda t: _not_set(t['is_inactive']) & _not_set(t['graduated']), 'yes'),
+]
+
+GROUP_ACTIVITY_RULES = [
+    (lambda t: t['office_name'].isin(['CAY', 'JER']), 'no'),
+    (lambda t: t['closed_date'] < t['start'], 'no'),
+    (lambda t: t['creation_date'] > t['end'], 'no'),
+    (lambda t: t['graduation_date'] > t['start'], 'yes'),
+    (lambda t: t['inactive_date'] > t['start'], 'yes'),
+    (lambda t: t['inactive_date'] < t['start'], 'no'),
+    (lambda t: t['graduation_date'] < t['start'], 'no'),
+    (lambda t: _not_set(t['is_inactive']) & _not_set(t['is_graduated']), 'yes'),
+]
+
+
+def classify_activity(df, rules, start_date, end_date, default='no'):
+    """
+    Evaluate an ordered rule cascade on every row at once with np.select.
 
-def file_matches_today(base, fname):
-    today = datetime.today().strftime('%Y-%m-%d')
-    base_norm = base.lower().replace(" ", "_")
-    fname_norm = os.path.basename(fname).lower().replace(" ", "_")
-    pat = re.compile(rf"^{re.escape(base_norm)}\s+{today}(?:\s+\(\d+\))?\.xlsx$")
-    return bool(pat.match(fname_norm))
+    Args:
+        df (pd.DataFrame): Records to classify
+        rules (list): (condition, value) pairs; a condition takes the typed
+            columns (see _activity_frame) and returns a boolean Series
+        start_date, end_date: Bounds of the reporting period
+        default (str): Value when no rule matches
+
+    Returns:
+        pd.Series: Categorical 'no'/'yes' column aligned on df.index
+    """
+    typed = _activity_frame(df, start_date, end_date)
+    conditions = [condition(typed).fillna(False).to_numpy(dtype=bool) for condition, _ in rules]
+    values = np.select(conditions, [value for _, value in rules], default=default)
+    return pd.Series(pd.Categorical(values, categories=ACTIVITY_LEVELS), index=df.index)
+
+
+def is_beneficiary_active(df, start_date, end_date):
+    """
+    Flag the beneficiaries active during [start_date, end_date].
+
+    Args:
+        df (pd.DataFrame): Beneficiary records (closed_date, creation_date,
+            graduation_date, abandoned_date, inactive_date, is_inactive, graduated)
+        start_date, end_date: Bounds of the reporting period
+
+    Returns:
+        pd.Series: Categorical 'yes' if active, 'no' if inactive
+    """
+    return classify_activity(df, BENEFICIARY_ACTIVITY_RULES, start_date, end_date)
+
+
+def is_groupe_active(df, start_date, end_date):
+    """
+    Flag the groups active during [start_date, end_date].
+
+    Groups of the CAY and JER offices are never active.
+
+    Args:
+        df (pd.DataFrame): Group records (office_name, closed_date, creation_date,
+            graduation_date, inactive_date, is_inactive, is_graduated)
+        start_date, end_date: Bounds of the reporting period
+
+    Returns:
+        pd.Series: Categorical 'yes' if active, 'no' if inactive
+    """
+    return classify_activity(df, GROUP_ACTIVITY_RULES, start_date, end_date)